@@ -30,96 +30,787 @@
 # ###################################################
 
 import os.path
+import sys
+import hashlib
 import argparse
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from PIL import Image
 
 from atlas.atlas_data import AtlasData
 from util.utils import get_parser
 from util.utils import get_packer
+from util.utils import get_image_writer
 from util.utils import get_atlas_path
 from util.utils import clear_atlas_dir
+from util.utils import create_atlas_dir
+from util.manifest import load_manifest
+from util.manifest import save_manifest
+from util.manifest import get_build_options
+from util.manifest import scan_inputs
+from util.manifest import is_up_to_date
+from util.manifest import create_entry
+from util.manifest import remove_stale_outputs
+from util.pixel_cache import PixelCache
+from util.pipeline import PipelineStage
+from util.pipeline import run_pipeline
+from util.trace import start_trace
+from util.trace import get_tracer
+from util.trace import trace_span
 from util.utils import get_color
+from packing_algorithms.bin_size import SizeSearch
+from packing_algorithms.bin_size import search_bin
+from packing_algorithms.heuristic_race import race_packing_variants
+from packing_algorithms.heuristic_race import sort_geometry
 from packing_algorithms.texture_packer import PackerError
-from math.math import next_power_of_two
+from maths.math import round_down_power_of_two
 
+# The algorithms packing into a bin whose size is searched for, the others size the atlas themselves.
+BIN_SIZE_ALGORITHMS = ('maxrects', 'skyline', 'guillotine')
 
-def pack_atlas(args, dirPath, curr_size):
-    texture_packer = get_packer(args['packing_algorithm'], curr_size, args['maxrects_heuristic'])
-    childDirs = os.listdir(dirPath)
+# Pillow allocates images in blocks of this size at most.  Its default splits atlas images in 16MB blocks that
+# stay with the allocator of the thread that composited them once freed, an image in one block this big is
+# mapped on its own and given back as soon as it is saved.
+IMAGE_BLOCK_SIZE = 1 << 30
 
-    index = 0
-    imagesList = []
+# The rows of an atlas image filtered for the parallel PNG encoder at a time, the encoder queues the rows of
+# one strip for compressing while it filters the next.
+PNG_STRIP_HEIGHT = 128
 
-    # Open all images in the directory and add to the packer input data structure.
-    for currPath in childDirs:
+
+def get_trim_box(img):
+    # The bounding box of the pixels that are not fully transparent, the whole image if it has no alpha.
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        alpha = img.split()[-1]
+    elif img.mode == 'P' and 'transparency' in img.info:
+        alpha = img.convert('RGBA').split()[-1]
+    else:
+        return (0, 0, img.size[0], img.size[1])
+
+    box = alpha.getbbox()
+    if box is None:
+        # Nothing visible at all, keep a single pixel so the image still has a place in the atlas.
+        return (0, 0, 1, 1)
+    return box
+
+
+def get_pixel_hash(img):
+    # Images with the same size and the same pixels, whatever their file format or mode, hash the same.
+    sha1 = hashlib.sha1('%dx%d' % img.size)
+    sha1.update(img.convert('RGBA').tobytes())
+    return sha1.hexdigest()
+
+
+def list_atlas_files(dirPath):
+    # Returns a (name, file_path) per file in the directory, in directory order.
+    files = []
+    for currPath in os.listdir(dirPath):
         file_path = os.path.join(dirPath, currPath)
         if (currPath.startswith(".") or os.path.isdir(file_path)):
             continue
-
+        files.append((currPath, file_path))
+    return files
+
+
+def open_atlas_image(file_path, trim=False):
+    # Returns (img, imgTrim), with trim the image is cropped to its visible pixels and imgTrim is
+    # (offsetX, offsetY, originalWidth, originalHeight), otherwise it is None.
+    img = Image.open(file_path)
+    imgTrim = None
+    if trim:
+        box = get_trim_box(img)
+        imgTrim = (box[0], box[1], img.size[0], img.size[1])
+        if box != (0, 0, img.size[0], img.size[1]):
+            img = img.crop(box)
+    return (img, imgTrim)
+
+
+def decode_atlas_image(file_path, trim=False, pixel_cache=None):
+    # Returns (img, imgTrim) like open_atlas_image with the pixels decoded.  They are read from pixel_cache
+    # when it has the image and added to it when they had to be decoded.
+    if pixel_cache is not None:
+        cached = pixel_cache.load(file_path, trim)
+        if cached is not None:
+            return cached
+
+    (img, imgTrim) = open_atlas_image(file_path, trim)
+    img.load()
+    if pixel_cache is not None:
+        pixel_cache.store(file_path, trim, img, imgTrim)
+    return (img, imgTrim)
+
+
+def scan_atlas_files(files, trim=False, dedup=False, pixel_cache=None):
+    # files is a list of (name, file_path) tuples.  Returns (geometry, trims, aliases).  With trim every image
+    # is cropped to its visible pixels and trims maps its name to (offsetX, offsetY, originalWidth,
+    # originalHeight).  With dedup only one of each set of identical images is kept and aliases maps the names
+    # of the others to its name.
+    geometry = []
+    trims = {}
+    pixelHashes = {}
+
+    # Only the headers are read unless trim or dedup need the pixels, and no file is left open, the pixels
+    # are decoded again when the atlas is composited.
+    for (name, file_path) in files:
         try:
-            img = Image.open(file_path)
-            texture_packer.add_texture(img.size[0], img.size[1], currPath)
-            imagesList.append((currPath, img))
-            index += 1
+            if trim or dedup:
+                (img, imgTrim) = decode_atlas_image(file_path, trim, pixel_cache)
+            else:
+                (img, imgTrim) = open_atlas_image(file_path)
+            if imgTrim is not None:
+                trims[name] = imgTrim
+            if dedup:
+                pixelHashes[name] = get_pixel_hash(img)
+            geometry.append((name, img.size[0], img.size[1]))
+            img.close()
         except (IOError):
             print "ERROR: PIL failed to open file: ", file_path
 
-    # Pack the textures into an atlas as efficiently as possible.
-    packResult = texture_packer.pack_textures(True, True)
-
-    return (texture_packer, packResult, imagesList)
-
-
-def create_atlas(texMode, dirPath, atlasPath, dirName, args):
-    done = False
-    curr_size = int(args['maxrects_bin_size'])
-    texture_packer = None
-    imagesList = None
-    packResult = None
+    # The first name in alphabetical order is packed, so the choice does not depend on the directory order.
+    aliases = {}
+    owners = {}
+    for name in sorted(pixelHashes.keys()):
+        owner = owners.setdefault(pixelHashes[name], name)
+        if owner != name:
+            aliases[name] = owner
+    if aliases:
+        geometry = [texture for texture in geometry if texture[0] not in aliases]
+
+    return (geometry, trims, aliases)
+
+
+def find_common_images(atlasFiles, minAtlases, trim=False, pixel_cache=None):
+    # atlasFiles maps each atlas name to its (name, file_path) list.  Images with identical pixels (after
+    # trim) in at least minAtlases of the atlases go in the common atlas, each under the 'atlas/name' of its
+    # first copy in name order.  Returns (commonFiles, shared), commonFiles being the (name, file_path) list of the common
+    # atlas and shared mapping each atlas name to {name: (common name, imgTrim)} for its copies.
+    copies = {}
+    for atlasName in sorted(atlasFiles.keys()):
+        for (name, file_path) in atlasFiles[atlasName]:
+            try:
+                (img, imgTrim) = decode_atlas_image(file_path, trim, pixel_cache)
+                pixelHash = get_pixel_hash(img)
+            except (IOError):
+                # Reported when the atlas itself is scanned.
+                continue
+            copies.setdefault(pixelHash, []).append((atlasName, name, file_path, imgTrim))
+
+    commonFiles = []
+    shared = {}
+    for imageCopies in copies.values():
+        if len(set([copy[0] for copy in imageCopies])) < minAtlases:
+            continue
 
-    # Retry until optimal font atlas size is found.
-    while not done:
+        (atlasName, name, file_path, imgTrim) = min(imageCopies)
+        commonName = '%s/%s' % (atlasName, name)
+        commonFiles.append((commonName, file_path))
+        for (atlasName, name, file_path, imgTrim) in imageCopies:
+            shared.setdefault(atlasName, {})[name] = (commonName, imgTrim)
+
+    commonFiles.sort()
+    return (commonFiles, shared)
+
+
+class DecodeBatch:
+    # The images of one decode_images call.  Iterating yields ((x, y), img) as they are decoded, each holding a
+    # slot of the decoder until release_image is called for it.  close gives back the slots of the images that
+    # were decoded but never taken and makes the requests still queued skip decoding, so a consumer that stops
+    # early, because an image failed to decode or otherwise, leaves no slot behind for the other atlases.
+    decoder = None
+    results = None
+    lock = None
+    held = 0
+    closed = False
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.lock = threading.Lock()
+        self.held = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self.results
+
+    def acquire_slot(self):
+        # Returns False, holding no slot, once the batch is closed.
+        if self.closed:
+            return False
+        self.decoder.decoded_slots.acquire()
+        self.lock.acquire()
         try:
-            result = pack_atlas(args, dirPath, curr_size)
-            texture_packer = result[0]
-            packResult = result[1]
-            imagesList = result[2]
-            done = True
+            if self.closed:
+                self.decoder.decoded_slots.release()
+                return False
+            self.held += 1
+            return True
+        finally:
+            self.lock.release()
+
+    def release_image(self):
+        self.lock.acquire()
+        try:
+            # The slots of a closed batch have all been given back already.
+            if not self.closed:
+                self.held -= 1
+                self.decoder.decoded_slots.release()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.closed = True
+            for i in range(self.held):
+                self.decoder.decoded_slots.release()
+            self.held = 0
+        finally:
+            self.lock.release()
+
+
+class AtlasImageDecoder:
+    # Decodes atlas images on a thread pool shared by all the atlases being composited, PIL releases the GIL
+    # while decoding.  Each thread has one file open at a time, and a thread only decodes an image once one of
+    # max_decoded slots is free, so no more than max_decoded images wait to be pasted however far the
+    # decoding runs ahead of the compositing.
+    pool = None
+    trim = False
+    pixel_cache = None
+    decoded_slots = None
+
+    def __init__(self, pool, trim, pixel_cache, max_decoded):
+        self.pool = pool
+        self.trim = trim
+        self.pixel_cache = pixel_cache
+        self.decoded_slots = threading.Semaphore(max(1, max_decoded))
+
+    def _decode(self, request):
+        (batch, position, file_path, flipped) = request
+        if not batch.acquire_slot():
+            return None
+        try:
+            with trace_span('decode', 'composite', file=file_path):
+                img = decode_atlas_image(file_path, self.trim, self.pixel_cache)[0]
+                if flipped:
+                    img = img.transpose(Image.ROTATE_90)
+        except Exception:
+            batch.release_image()
+            raise
+        return (position, img)
+
+    def decode_images(self, textures, filePaths):
+        # Returns a DecodeBatch decoding the image of every texture, in any order.  The caller closes it when
+        # done with it, whether or not every image was taken.
+        batch = DecodeBatch(self)
+        requests = [(batch, (tex.x, tex.y), filePaths[tex.name], tex.flipped) for tex in textures]
+        batch.results = self.pool.imap_unordered(self._decode, requests)
+        return batch
+
+
+def composite_atlas(decoder, texMode, textures, filePaths, size, bgColor):
+    atlas_image = Image.new(texMode, size, bgColor)
+    batch = decoder.decode_images(textures, filePaths)
+    try:
+        for (position, img) in batch:
+            atlas_image.paste(img, position)
+            batch.release_image()
+    finally:
+        batch.close()
+    return atlas_image
+
+
+def composite_strips(decoder, texMode, textures, filePaths, size, bgColor, writer, stripHeight):
+    # Streams the atlas to writer stripHeight rows at a time.  The textures are indexed by their top edge,
+    # an image is only decoded when the first strip it crosses is reached and dropped after its last one,
+    # so only the images crossing the current strip are held in memory.
+    (width, height) = size
+    index = sorted(textures, key=lambda tex: (tex.y, tex.x))
+    nextTexture = 0
+    active = []
+
+    try:
+        for stripTop in xrange(0, height, stripHeight):
+            stripBottom = min(height, stripTop + stripHeight)
+            firstTexture = nextTexture
+            while nextTexture < len(index) and index[nextTexture].y < stripBottom:
+                nextTexture += 1
+            batch = decoder.decode_images(index[firstTexture:nextTexture], filePaths)
+            try:
+                for ((x, y), img) in batch:
+                    # The strip already bounds how many images are kept, holding a slot for each of them could
+                    # leave none for the rest of the strip.
+                    active.append((x, y, img))
+                    batch.release_image()
+            finally:
+                batch.close()
+
+            strip = Image.new(texMode, (width, stripBottom - stripTop), bgColor)
+            for (x, y, img) in active:
+                strip.paste(img, (x, y - stripTop))
+            writer.write_strip(strip)
+
+            active = [texture for texture in active if texture[1] + texture[2].size[1] > stripBottom]
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+
+def get_pixel_cache(args):
+    if not args['pixel_cache']:
+        return None
+    return PixelCache(args['pixel_cache'], int(args['pixel_cache_size']) << 20)
+
+
+def get_atlas_packer(args, curr_width, curr_height):
+    if args['packing_algorithm'] == 'skyline':
+        return get_packer('skyline', curr_width, args['skyline_heuristic'], waste_map=args['skyline_waste_map'], height=curr_height)
+    elif args['packing_algorithm'] == 'guillotine':
+        return get_packer('guillotine', curr_width, args['guillotine_heuristic'], split_heuristic=args['guillotine_split'], merge=args['guillotine_merge'], height=curr_height)
+    else:
+        return get_packer(args['packing_algorithm'], curr_width, args['maxrects_heuristic'], args['maxrects_spatial_index'], args['maxrects_backend'], args['maxrects_batch'], height=curr_height)
+
+
+def get_size_search(args):
+    size_search = args['maxrects_size_search']
+    return SizeSearch(args['bin_shape'], size_search in ('pot', 'potwidth'), size_search in ('pot', 'potheight'))
+
+
+def pack_atlas(args, geometry, curr_width, curr_height):
+    with trace_span('pack attempt', 'pack', width=curr_width, height=curr_height) as span:
+        texture_packer = get_atlas_packer(args, curr_width, curr_height)
+
+        texture_packer.add_textures(geometry)
+
+        # Pack the textures into an atlas as efficiently as possible.
+        packResult = texture_packer.pack_textures(True, True)
+
+        span.set_arg('fitted', '%dx%d' % (packResult[0], packResult[1]))
+        if texture_packer.get_free_rect_count() is not None:
+            span.set_arg('free_rects', texture_packer.get_free_rect_count())
+
+    return (texture_packer, packResult)
+
+
+def pack_geometry(args, geometry, dirName, max_size, race_pool=None):
+    # Returns (variant, (texture_packer, packResult)), variant being the winner when the maxrects heuristics
+    # are raced, on race_pool if there is one.  Raises PackerError if the geometry does not fit a max_size
+    # atlas, 0 means no limit.
+    variant = None
+    if args['packing_algorithm'] in BIN_SIZE_ALGORITHMS:
+        # Search for the optimal atlas size using the image dimensions alone.
+        min_size = int(args['maxrects_bin_size'])
+        if max_size > 0:
+            min_size = min(min_size, max_size)
+        size_search = get_size_search(args)
+        if args['packing_algorithm'] == 'maxrects' and args['maxrects_heuristic'] == 'auto':
+            packer_options = (args['maxrects_spatial_index'], args['maxrects_backend'], args['maxrects_batch'])
+            (variant, result) = race_packing_variants(geometry, min_size, size_search, packer_options, upper_bound=max_size, pool=race_pool)
+            if (args['verbose']):
+                print "Packed", dirName, "with", variant
+        else:
+            result = search_bin(lambda width, height: pack_atlas(args, geometry, width, height), geometry, min_size, size_search, args['verbose'], max_size)[1]
+        if size_search.shape == 'rect' and args['verbose']:
+            print "Best bin shape for", dirName, "is %dx%d" % (result[1][0], result[1][1])
+    else:
+        result = pack_atlas(args, geometry, 0, 0)
+        if max_size > 0 and max(result[1][0], result[1][1]) > max_size:
+            raise PackerError('Failed to fit in the maximum atlas size %d' % max_size)
+
+    return (variant, result)
+
+
+def fill_page(args, geometry, page_width, page_height):
+    # Packs whatever fits on a page_width x page_height page in order and returns (texture_packer, overflow geometry).
+    if args['packing_algorithm'] == 'maxrects' and args['maxrects_heuristic'] == 'auto':
+        # There is nothing to race until the page contents are known, fill the page with the default heuristic.
+        args = dict(args, maxrects_heuristic='area')
+
+    texture_packer = get_atlas_packer(args, page_width, page_height)
+    overflow = texture_packer.fill_textures(geometry)
+    return (texture_packer, overflow)
+
+
+def pack_pages(args, geometry, dirName, race_pool=None):
+    # Returns a (variant, (texture_packer, packResult)) per page.  Everything goes on one page unless it
+    # does not fit the maximum atlas size, then the largest images are packed first and every page takes
+    # what still fits in the space the heuristic wastes least, leaving the rest to the next page.
+    max_size = int(args['max_atlas_size'])
+    try:
+        return [pack_geometry(args, geometry, dirName, max_size, race_pool)]
+    except PackerError:
+        if max_size <= 0 or args['packing_algorithm'] not in BIN_SIZE_ALGORITHMS:
+            raise
+
+    # Full pages are the biggest size the search could have picked.
+    size_search = get_size_search(args)
+    page_width = round_down_power_of_two(max_size) if size_search.width_power_of_two else max_size
+    page_height = round_down_power_of_two(max_size) if size_search.height_power_of_two else max_size
+
+    pages = []
+    remaining = sort_geometry(geometry, 'area')
+    while remaining:
+        (fill_packer, overflow) = fill_page(args, remaining, page_width, page_height)
+        if len(overflow) == len(remaining):
+            raise PackerError('%s does not fit in the maximum atlas size %d' % (remaining[0][0], max_size))
+
+        # Repack the page on its own so the last, emptier pages shrink to the size they need.
+        overflowNames = set([name for (name, width, height) in overflow])
+        pageGeometry = [texture for texture in remaining if texture[0] not in overflowNames]
+        try:
+            pages.append(pack_geometry(args, pageGeometry, dirName, max_size, race_pool))
         except PackerError:
-            curr_size = next_power_of_two(curr_size)
-            print "Failed, trying next power of two", curr_size
-
-    borderSize = 1
-    atlas_name = '%s.%s' % (dirName, args['atlas_type'])
-    atlas_data = AtlasData(name=dirName, width=packResult[0], height=packResult[1], color_mode=texMode, file_type=args['atlas_type'], border=borderSize)
-    for tex in texture_packer.texArr:
-        atlas_data.add_texture(tex)
-
-    parser = get_parser(args['output_data_type'])
-    parser.parse(atlas_data)
-    parser.save('%s.%s' % (os.path.join(atlasPath, os.path.basename(dirPath)), parser.get_file_ext()))
-
-    atlas_image = Image.new(texMode, (packResult[0], packResult[1]), get_color(args['bg_color']))
-
-    index = 0
-    for image in imagesList:
-        tex = texture_packer.get_texture(image[0])
-        atlas_image.paste(image[1], (tex.x, tex.y))
-        index += 1
-
-    atlas_image.save(os.path.join(atlasPath, os.path.basename(dirPath)) + "." + args['atlas_type'], args['atlas_type'])
-    if (args['verbose']):
-        atlas_image.show()
+            # Batch mode and the race pack in another order than the fill and can miss, keep the fill.
+            pages.append((None, (fill_packer, fill_packer.pack_textures(True, True))))
+        remaining = overflow
+
+    return pages
+
+
+def pack_atlas_job(job, race_pool=None):
+    # Runs in a pool worker.  Returns (pages, trace events), a (variant, textures, packResult) per page, the
+    # packers themselves stay behind.  The trace events are those recorded in the worker when it is traced.
+    # race_pool is only passed when packing in this process, see AtlasPipeline.
+    (args, geometry, dirName) = job
+    with trace_span('pack atlas', 'pack', atlas=dirName, images=len(geometry)):
+        pages = [(variant, texture_packer.texArr, packResult) for (variant, (texture_packer, packResult)) in pack_pages(args, geometry, dirName, race_pool)]
+    tracer = get_tracer()
+    return (pages, tracer.take_worker_events() if tracer is not None else None)
+
+
+class AtlasBuild:
+    # An atlas on its way through the build pipeline.  files is the (name, file_path) list of its images and
+    # shared maps the names of the images packed in another atlas to the texture listing them.
+    name = None
+    files = None
+    shared = None
+    geometry = None
+    trims = None
+    aliases = None
+    pages = None
+    atlas_data = None
+    outputs = None
+
+    def __init__(self, name, files, shared=None):
+        self.name = name
+        self.shared = shared if shared is not None else {}
+        self.files = [(fileName, file_path) for (fileName, file_path) in files if fileName not in self.shared]
+
+    def remove_outputs(self):
+        # A build that failed part way may have written its data file and some pages, none of them are kept.
+        for output in self.outputs or []:
+            if os.path.isfile(output):
+                os.remove(output)
+
+
+class AtlasPipeline:
+    # Builds atlases in four stages that each run on threads of their own, so the disk, the packing processes
+    # and the encoders are kept busy together on different atlases: scanning the image headers, packing and
+    # writing the data file, decoding and compositing a page, and encoding and saving it.  The bounded queues
+    # between the stages hold back the stages that run ahead, the decoder bounds the decoded images and a page
+    # is only composited once one of the atlas image slots is free, a slot being held until the page is saved.
+    texMode = None
+    atlasPath = None
+    args = None
+    pack_pool = None
+    pack_threads = 1
+    decoder = None
+    pixel_cache = None
+    png_pool = None
+    race_pool = None
+    atlas_image_slots = None
+
+    def __init__(self, texMode, atlasPath, args, pack_pool, pack_threads, decoder, pixel_cache, png_pool=None, race_pool=None):
+        # pack_pool is the process pool packing the atlases, None packs them on a single thread of this process.
+        # race_pool is the process pool that thread races the maxrects variants on, the pipeline threads are
+        # running by then and it is not safe to start one.  png_pool is the thread pool the parallel PNG
+        # encoder compresses on.
+        self.texMode = texMode
+        self.atlasPath = atlasPath
+        self.args = args
+        self.pack_pool = pack_pool
+        self.pack_threads = pack_threads
+        self.decoder = decoder
+        self.pixel_cache = pixel_cache
+        self.png_pool = png_pool
+        self.race_pool = race_pool
+        self.atlas_image_slots = threading.Semaphore(max(1, int(args['max_atlas_images'])))
+
+    def scan(self, build):
+        with trace_span('scan', 'scan', atlas=build.name, images=len(build.files)):
+            (build.geometry, build.trims, build.aliases) = scan_atlas_files(build.files, self.args['trim'], self.args['dedup'], self.pixel_cache)
+        yield build
+
+    def pack(self, build):
+        # An atlas whose images are all in the common atlas only has a data file.
+        build.pages = []
+        if build.geometry:
+            with trace_span('pack', 'pack', atlas=build.name) as span:
+                job = (self.args, build.geometry, build.name)
+                if self.pack_pool is not None:
+                    (build.pages, events) = self.pack_pool.apply(pack_atlas_job, (job,))
+                    if get_tracer() is not None:
+                        get_tracer().add_events(events)
+                else:
+                    build.pages = pack_atlas_job(job, self.race_pool)[0]
+                span.set_arg('pages', len(build.pages))
+
+        with trace_span('data', 'pack', atlas=build.name, textures=len(build.geometry) + len(build.aliases) + len(build.shared)):
+            build.atlas_data = self._create_atlas_data(build)
+            parser = get_parser(self.args['output_data_type'], self.args['compact_data'])
+            parser.parse(build.atlas_data)
+            data_path = '%s.%s' % (os.path.join(self.atlasPath, build.name), parser.get_file_ext())
+            parser.save(data_path)
+        build.outputs = [data_path] + build.outputs
+
+        for page in range(len(build.pages)):
+            yield (build, page)
+
+    def _create_atlas_data(self, build):
+        # Lists the packed textures in the atlas data, fills in build.outputs with the page images.
+        multiPage = len(build.pages) > 1
+        width = max([packResult[0] for (variant, textures, packResult) in build.pages] or [0])
+        height = max([packResult[1] for (variant, textures, packResult) in build.pages] or [0])
+
+        borderSize = 1
+        atlas_data = AtlasData(name=build.name, width=width, height=height, color_mode=self.texMode, file_type=self.args['atlas_type'], border=borderSize)
+        if len(build.pages) == 1 and build.pages[0][0] is not None:
+            atlas_data.set_packing_variant(build.pages[0][0])
+
+        build.outputs = []
+        for (page, (variant, textures, packResult)) in enumerate(build.pages):
+            if multiPage:
+                image_path = '%s_%d.%s' % (os.path.join(self.atlasPath, build.name), page, self.args['atlas_type'])
+                atlas_data.add_page(os.path.basename(image_path), packResult[0], packResult[1])
+            else:
+                image_path = os.path.join(self.atlasPath, build.name) + "." + self.args['atlas_type']
+            build.outputs.append(image_path)
+
+            for tex in textures:
+                if multiPage:
+                    tex.set_page(page)
+                if tex.name in build.trims:
+                    tex.set_trim(*build.trims[tex.name])
+                atlas_data.add_texture(tex)
+
+        # Duplicates share the rect of the image they alias but keep their own trim.
+        for (name, owner) in build.aliases.items():
+            alias = atlas_data.texture_dict[owner].get_alias(name)
+            if name in build.trims:
+                alias.set_trim(*build.trims[name])
+            atlas_data.add_texture(alias)
+
+        for tex in build.shared.values():
+            atlas_data.add_texture(tex)
+
+        return atlas_data
+
+    def composite(self, item):
+        (build, page) = item
+        (variant, textures, packResult) = build.pages[page]
+        size = (packResult[0], packResult[1])
+        image_path = build.outputs[page + 1]
+        filePaths = dict(build.files)
+
+        stripHeight = int(self.args['strip_height'])
+        if stripHeight > 0:
+            # Streamed straight to the file, there is nothing left to encode.
+            with trace_span('composite', 'composite', atlas=build.name, page=page, width=size[0], height=size[1], strips=True):
+                writer = self._get_image_writer(image_path, size)
+                composite_strips(self.decoder, self.texMode, textures, filePaths, size, get_color(self.args['bg_color']), writer, stripHeight)
+            yield (build, page, None)
+        else:
+            self.atlas_image_slots.acquire()
+            try:
+                with trace_span('composite', 'composite', atlas=build.name, page=page, width=size[0], height=size[1]):
+                    atlas_image = composite_atlas(self.decoder, self.texMode, textures, filePaths, size, get_color(self.args['bg_color']))
+            except Exception:
+                self.atlas_image_slots.release()
+                raise
+            yield (build, page, atlas_image)
+
+    def _get_image_writer(self, image_path, size):
+        return get_image_writer(self.args['atlas_type'], image_path, size[0], size[1], self.texMode,
+                                int(self.args['png_compress_level']), self.args['png_filter'], self.png_pool)
+
+    def _save_atlas_image(self, atlas_image, image_path):
+        if self.args['atlas_type'] != 'png':
+            atlas_image.save(image_path, self.args['atlas_type'])
+        elif self.args['png_encoder'] == 'parallel':
+            (width, height) = atlas_image.size
+            writer = self._get_image_writer(image_path, atlas_image.size)
+            try:
+                for stripTop in xrange(0, height, PNG_STRIP_HEIGHT):
+                    writer.write_strip(atlas_image.crop((0, stripTop, width, min(height, stripTop + PNG_STRIP_HEIGHT))))
+                writer.close()
+            except Exception:
+                writer.abort()
+                raise
+        else:
+            atlas_image.save(image_path, self.args['atlas_type'], compress_level=int(self.args['png_compress_level']))
+
+    def encode(self, item):
+        (build, page, atlas_image) = item
+        if atlas_image is not None:
+            try:
+                with trace_span('encode', 'encode', atlas=build.name, page=page, type=self.args['atlas_type']):
+                    self._save_atlas_image(atlas_image, build.outputs[page + 1])
+                if (self.args['verbose']):
+                    atlas_image.show()
+            finally:
+                self.atlas_image_slots.release()
+        yield (build, page)
+
+    def run(self, builds):
+        # Returns the builds that failed, mapped to the traceback of the failure.
+        scanThreads = int(self.args['scan_threads'])
+        packThreads = self.pack_threads if self.pack_pool is not None else 1
+        compositeThreads = int(self.args['composite_threads'])
+        encodeThreads = int(self.args['encode_threads'])
+        stages = [PipelineStage('scan', self.scan, scanThreads, scanThreads),
+                  PipelineStage('pack', self.pack, packThreads, packThreads),
+                  PipelineStage('composite', self.composite, compositeThreads, compositeThreads),
+                  PipelineStage('encode', self.encode, encodeThreads, encodeThreads)]
+
+        # Start the atlases with the most files first so a large atlas does not hold up the end of the build.
+        builds = sorted(builds, key=lambda build: len(build.files), reverse=True)
+        (results, failures) = run_pipeline(builds, stages)
+
+        errors = {}
+        for (stageName, item, error) in failures:
+            build = item if isinstance(item, AtlasBuild) else item[0]
+            errors.setdefault(build, error)
+        return errors
+
+
+def get_shared_textures(common_data, shared):
+    # Lists every copy of a common image as a reference to its rect in the common atlas, with its own trim.
+    textures = {}
+    for (name, (commonName, imgTrim)) in shared.items():
+        tex = common_data.texture_dict[commonName].get_alias(name, common_data.name)
+        if imgTrim is not None:
+            tex.set_trim(*imgTrim)
+        textures[name] = tex
+    return textures
 
 
 def iterate_data_directory(texMode, atlasPath, resPath, args):
+    old_atlases = load_manifest(atlasPath)
+    new_atlases = {}
+    options = get_build_options(args)
+    inputs_dict = {}
+    atlasFiles = {}
+
     childDirs = os.listdir(resPath)
     for currPath in childDirs:
         if (currPath.startswith(".")):
             continue
-        if (os.path.isdir(os.path.join(resPath, currPath))):
-            create_atlas(texMode, os.path.join(resPath, currPath), atlasPath, currPath, args)
+        dirPath = os.path.join(resPath, currPath)
+        if (os.path.isdir(dirPath)):
+            old_entry = old_atlases.get(currPath)
+            with trace_span('scan inputs', 'scan', atlas=currPath):
+                inputs_dict[currPath] = scan_inputs(dirPath, old_entry['inputs'] if old_entry is not None else None)
+                atlasFiles[currPath] = list_atlas_files(dirPath)
+
+    commonAtlases = int(args['common_atlas'])
+    commonName = args['common_atlas_name']
+    if commonAtlases > 0:
+        if commonName in atlasFiles:
+            print "ERROR: The common atlas name", commonName, "is also an images directory, pick another with --common-atlas-name"
+            return 1
+        # The common atlas depends on the images of every directory.
+        inputs_dict[commonName] = {}
+        for dirName in atlasFiles:
+            for (name, info) in inputs_dict[dirName].items():
+                inputs_dict[commonName]['%s/%s' % (dirName, name)] = info
+
+    if args['incremental']:
+        for dirName in inputs_dict:
+            if is_up_to_date(old_atlases.get(dirName), options, inputs_dict[dirName], atlasPath):
+                new_atlases[dirName] = old_atlases[dirName]
+        # Any changed image can move images in or out of the common atlas, so either all of them are
+        # reused or none are.
+        if commonAtlases > 0 and len(new_atlases) != len(inputs_dict):
+            new_atlases = {}
+        print "Rebuilding", len(inputs_dict) - len(new_atlases), "atlases,", len(new_atlases), "are up to date"
+
+    numJobs = int(args['jobs'])
+    if numJobs <= 0:
+        numJobs = multiprocessing.cpu_count()
+    numAtlases = len([dirName for dirName in atlasFiles if dirName not in new_atlases])
+
+    # The packing processes are started before any thread is, forking while other threads run is not safe.
+    numPackers = max(1, min(numJobs, numAtlases))
+    pack_pool = multiprocessing.Pool(numPackers) if numPackers > 1 else None
+    # Atlases packed in this process race the maxrects variants on a pool of their own, started now too.
+    race_pool = None
+    if pack_pool is None and args['packing_algorithm'] == 'maxrects' and args['maxrects_heuristic'] == 'auto' and multiprocessing.cpu_count() > 1:
+        race_pool = multiprocessing.Pool(multiprocessing.cpu_count())
+    pixel_cache = get_pixel_cache(args)
+    decode_pool = ThreadPool(max(1, int(args['max_open_files'])))
+    decoder = AtlasImageDecoder(decode_pool, args['trim'], pixel_cache, int(args['max_decoded_images']))
+    png_pool = None
+    if args['atlas_type'] == 'png' and (args['png_encoder'] == 'parallel' or int(args['strip_height']) > 0):
+        pngThreads = int(args['png_threads'])
+        png_pool = ThreadPool(pngThreads if pngThreads > 0 else multiprocessing.cpu_count())
+    pipeline = AtlasPipeline(texMode, atlasPath, args, pack_pool, numPackers, decoder, pixel_cache, png_pool, race_pool)
+
+    try:
+        shared = {}
+        if commonAtlases > 0 and commonName not in new_atlases:
+            with trace_span('find common', 'scan'):
+                (commonFiles, sharedFiles) = find_common_images(atlasFiles, commonAtlases, args['trim'], pixel_cache)
+            print "Moving", len(commonFiles), "images found in", commonAtlases, "or more atlases to", commonName
+            common_build = AtlasBuild(commonName, commonFiles)
+            errors = pipeline.run([common_build])
+            if errors:
+                print "ERROR: Failed to create atlas", commonName
+                print errors[common_build]
+                common_build.remove_outputs()
+                return 1
+            new_atlases[commonName] = create_entry(options, inputs_dict[commonName], common_build.outputs)
+            for (dirName, files) in sharedFiles.items():
+                shared[dirName] = get_shared_textures(common_build.atlas_data, files)
+
+        builds = []
+        for dirName in sorted(atlasFiles.keys()):
+            if dirName not in new_atlases:
+                builds.append(AtlasBuild(dirName, atlasFiles[dirName], shared.get(dirName)))
+        errors = pipeline.run(builds)
+    finally:
+        decode_pool.close()
+        decode_pool.join()
+        if png_pool is not None:
+            png_pool.close()
+            png_pool.join()
+        if pack_pool is not None:
+            pack_pool.close()
+            pack_pool.join()
+        if race_pool is not None:
+            race_pool.close()
+            race_pool.join()
+
+    ret = 0
+    for build in builds:
+        if build in errors:
+            print "ERROR: Failed to create atlas", build.name
+            print errors[build]
+            build.remove_outputs()
+            ret = 1
+        else:
+            new_atlases[build.name] = create_entry(options, inputs_dict[build.name], build.outputs)
+
+    for name in remove_stale_outputs(atlasPath, old_atlases, new_atlases):
+        print "Removed stale output", name
+    save_manifest(atlasPath, new_atlases)
+
+    if pixel_cache is not None:
+        evicted = pixel_cache.evict()
+        if evicted > 0:
+            print "Evicted", evicted, "images from the pixel cache"
+
+    return ret
 
 
 def parse_args():
@@ -129,14 +820,50 @@ def parse_args():
     arg_parser.add_argument('-r', '--res-path', action='store', required=True, help='The location of the games resources.')
     arg_parser.add_argument('-t', '--atlas-type', action='store', required=False, default='tga', choices=('tga', 'png', 'jpg', 'jpeg'), help='The file type of the texture atlases')
     arg_parser.add_argument('-m', '--atlas-mode', action='store', required=False, default='RGBA', choices=('RGB', 'RGBA'), help='The bit mode of the texture atlases')
-    arg_parser.add_argument('-o', '--output-data-type', action='store', required=False, default='xml', choices=('xml', 'json'), help='The file output type of the atlas dictionary')
+    arg_parser.add_argument('-o', '--output-data-type', action='store', required=False, default='xml', choices=('xml', 'json', 'bin'), help='The file output type of the atlas dictionary, bin is a memory mappable binary file with a perfect hash of the image names (read it with data_parsers.bin_parser.BinReader).')
+    arg_parser.add_argument('--compact-data', action='store_true', help='Write the atlas data files without indentation or line breaks.')
     arg_parser.add_argument('-i', '--images-dir', action='store', required=False, default='textures', help='The directory inside the resource path to search for images to batch into texture atlases.')
     arg_parser.add_argument('-c', '--bg-color', action='store', required=False, default='128,128,128,255', help='The background color of the unused area in the texture atlas (e.g. 255,255,255,255).')
-    arg_parser.add_argument('-a', '--packing-algorithm', action='store', required=False, default='maxrects', choices=('ratcliff', 'maxrects'), help='The packing algorithm to use.')
-    arg_parser.add_argument('-e', '--maxrects-heuristic', action='store', required=False, default='area', choices=('shortside', 'longside', 'area', 'bottomleft', 'contactpoint'), help='The packing heuristic/rule to use if the maxrects algorithm is selected.')
-    arg_parser.add_argument('-s', '--maxrects-bin-size', action='store', required=False, default='1024', help='The size of atlas when using the maxrects algorithm.')
+    arg_parser.add_argument('-a', '--packing-algorithm', action='store', required=False, default='maxrects', choices=('ratcliff', 'maxrects', 'skyline', 'guillotine'), help='The packing algorithm to use, skyline is the fastest for very large image sets and guillotine sits between it and maxrects in speed and packing.')
+    arg_parser.add_argument('-e', '--maxrects-heuristic', action='store', required=False, default='area', choices=('shortside', 'longside', 'area', 'bottomleft', 'contactpoint', 'auto'), help='The packing heuristic/rule to use if the maxrects algorithm is selected, auto packs with every heuristic, rotation setting and sort order on all CPUs and keeps the smallest atlas.')
+    arg_parser.add_argument('-s', '--maxrects-bin-size', '--bin-size', action='store', required=False, default='1024', help='The minimum size of atlas when using the maxrects, skyline or guillotine algorithm.')
+    arg_parser.add_argument('--max-atlas-size', action='store', required=False, default='0', help='The largest atlas size, images that do not fit go on extra pages (name_0, name_1, ...) packed the same way (0 is no limit).')
+    arg_parser.add_argument('--maxrects-size-search', '--size-search', action='store', required=False, default='pot', choices=('pot', 'any', 'potwidth', 'potheight'), help='Search power of two or arbitrary atlas sizes when the images do not fit the bin size, potwidth and potheight only keep one side a power of two (rect bin shape only).')
+    arg_parser.add_argument('--bin-shape', action='store', required=False, default='square', choices=('square', 'rect'), help='Search square atlases or any width x height for the smallest area, rect packs strip shaped image sets much tighter but packs each set many more times.')
+    arg_parser.add_argument('--maxrects-spatial-index', action='store_true', help='Index the maxrects free rectangles spatially and by size, faster for atlases with thousands of images.')
+    arg_parser.add_argument('--maxrects-backend', action='store', required=False, default='python', choices=('python', 'numpy'), help='Score the maxrects heuristics in pure python or vectorised with numpy (needs numpy, ignores --maxrects-spatial-index).')
+    arg_parser.add_argument('--maxrects-batch', action='store_true', help='Place the images best scoring first rather than in directory order, packs tighter but is slower.')
+    arg_parser.add_argument('--skyline-heuristic', action='store', required=False, default='bottomleft', choices=('bottomleft', 'minwaste'), help='The packing heuristic/rule to use if the skyline algorithm is selected.')
+    arg_parser.add_argument('--skyline-waste-map', action='store_true', help='Reuse the gaps left below the skyline, packs tighter but is a little slower.')
+    arg_parser.add_argument('--guillotine-heuristic', action='store', required=False, default='area', choices=('area', 'shortside', 'longside'), help='The free rectangle choice rule to use if the guillotine algorithm is selected.')
+    arg_parser.add_argument('--guillotine-split', action='store', required=False, default='shorterleftover', choices=('shorterleftover', 'longerleftover', 'minarea', 'maxarea'), help='How the guillotine algorithm cuts the space left next to a placed image in two.')
+    arg_parser.add_argument('--guillotine-merge', action='store_true', help='Join neighbouring guillotine free rectangles back together, packs tighter but is a little slower.')
+    arg_parser.add_argument('--trim', action='store_true', help='Crop the fully transparent border off every image before packing, the data file records the original size and the offset of the cropped image in it.')
+    arg_parser.add_argument('--dedup', action='store_true', help='Pack images with identical pixels (after --trim) once, the data file lists the others as aliases of the packed one.')
+    arg_parser.add_argument('--strip-height', action='store', required=False, default='0', help='Composite the atlas this many rows at a time, streaming each strip to the file and only decoding the images it crosses, so memory follows the strip size rather than the atlas size (tga and png only, 0 composites the whole atlas in memory).')
+    arg_parser.add_argument('--png-encoder', action='store', required=False, default='pil', choices=('pil', 'parallel'), help='Save png atlases with PIL, or compress them in independent chunks on --png-threads threads (--strip-height always uses the parallel encoder).')
+    arg_parser.add_argument('--png-threads', action='store', required=False, default='0', help='The number of threads compressing png atlases for the parallel encoder (0 uses every CPU), the files are the same whatever the number.')
+    arg_parser.add_argument('--png-compress-level', action='store', required=False, default='6', choices=[str(level) for level in range(10)], help='The zlib compression level of png atlases, 0 is fastest and 9 smallest.')
+    arg_parser.add_argument('--png-filter', action='store', required=False, default='up', choices=('none', 'sub', 'up'), help='The row filter the parallel png encoder applies before compressing, PIL picks its own.')
+    arg_parser.add_argument('--max-open-files', action='store', required=False, default='8', help='The most image files decoded at once, the images are decoded on this many threads while the atlases are composited.')
+    arg_parser.add_argument('--max-decoded-images', action='store', required=False, default='64', help='The most decoded images waiting to be pasted into an atlas, decoding waits when there are this many.')
+    arg_parser.add_argument('--max-atlas-images', action='store', required=False, default='2', help='The most atlas images in memory at once, between being composited and saved.')
+    arg_parser.add_argument('--scan-threads', action='store', required=False, default='2', help='The number of threads reading image headers (and decoding images for --trim or --dedup).')
+    arg_parser.add_argument('--composite-threads', action='store', required=False, default='2', help='The number of atlas pages composited at the same time, each holds its atlas image in memory.')
+    arg_parser.add_argument('--encode-threads', action='store', required=False, default='2', help='The number of threads encoding and saving atlas images.')
+    arg_parser.add_argument('--pixel-cache', action='store', required=False, default='', help='A directory to keep the decoded (and trimmed) images in between builds, unchanged images are then read back memory mapped instead of being decoded again.')
+    arg_parser.add_argument('--pixel-cache-size', action='store', required=False, default='1024', help='The size in MB the pixel cache is cut back to after each build, dropping the least recently used images.')
+    arg_parser.add_argument('--common-atlas', action='store', required=False, default='0', help='Move images with identical pixels (after --trim) found in at least this many directories into one shared atlas, the other atlases reference them by atlas name (0 is off).')
+    arg_parser.add_argument('--common-atlas-name', action='store', required=False, default='common', help='The name of the shared atlas made by --common-atlas.')
+    arg_parser.add_argument('-j', '--jobs', action='store', required=False, default='1', help='The number of worker processes packing atlases in parallel (0 uses every CPU), scanning, compositing and encoding run on threads alongside them.')
+    arg_parser.add_argument('--trace', action='store', required=False, default='', help='Time every stage of the build and write it to this file as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev), a summary per stage and per atlas is printed to stderr.')
+    arg_parser.add_argument('-n', '--incremental', action='store_true', help='Only rebuild the atlases whose images or options changed since the last build.')
 
     args = vars(arg_parser.parse_args())
+    if args['bin_shape'] == 'square' and args['maxrects_size_search'] in ('potwidth', 'potheight'):
+        arg_parser.error('--size-search %s needs --bin-shape rect' % args['maxrects_size_search'])
+    if int(args['strip_height']) > 0 and args['atlas_type'] not in ('tga', 'png'):
+        arg_parser.error('--strip-height needs an atlas type of tga or png')
 
     return {'parser': arg_parser, 'args': args}
 
@@ -144,6 +871,9 @@ def parse_args():
 def main():
     parser_dict = parse_args()
 
+    if hasattr(Image.core, 'set_block_size') and 'PILLOW_BLOCK_SIZE' not in os.environ:
+        Image.core.set_block_size(IMAGE_BLOCK_SIZE)
+
     if (not os.path.isdir(parser_dict['args']['res_path'])):
         print "Not passed a valid directory"
         parser_dict['parser'].print_help()
@@ -157,11 +887,21 @@ def main():
         return 1
 
     atlasesPath = get_atlas_path(parser_dict['args']['res_path'])
-    clear_atlas_dir(atlasesPath)
-
-    res = iterate_data_directory(parser_dict['args']['atlas_mode'], atlasesPath, textures_dir, parser_dict['args'])
+    if parser_dict['args']['incremental']:
+        create_atlas_dir(atlasesPath)
+    else:
+        clear_atlas_dir(atlasesPath)
+
+    tracePath = parser_dict['args']['trace']
+    tracer = start_trace() if tracePath else None
+    try:
+        res = iterate_data_directory(parser_dict['args']['atlas_mode'], atlasesPath, textures_dir, parser_dict['args'])
+    finally:
+        if tracer is not None:
+            tracer.save(tracePath)
+            tracer.print_summary()
     return res
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -38,8 +38,8 @@ from atlas.atlas_data import AtlasData
 from util.utils import get_color
 from util.utils import get_packer
 from util.utils import get_parser
-from math.math import next_power_of_two
-from packing_algorithms.texture_packer import PackerError
+from packing_algorithms.bin_size import SizeSearch
+from packing_algorithms.bin_size import search_bin
 
 
 def parse_args():
@@ -54,6 +54,7 @@ def parse_args():
     arg_parser.add_argument('-o', '--output-data-type', action='store', required=False, default='xml', choices=('xml', 'json'), help='The file output type of the image font chars data dictionary')
     arg_parser.add_argument('-c', '--bg-color', action='store', required=False, default='255,255,255,0', help='The background color of the unused area in the texture atlas (e.g. 255,255,255,255).')
     arg_parser.add_argument('-a', '--packing-algorithm', action='store', required=False, default='maxrects', choices=('ratcliff', 'maxrects'), help='The packing algorithm to use to pack the font chars.')
+    arg_parser.add_argument('--bin-shape', action='store', required=False, default='square', choices=('square', 'rect'), help='Search square power of two font atlases or any power of two width x height for the smallest area.')
 
     args = vars(arg_parser.parse_args())
 
@@ -75,43 +76,41 @@ def create_fonts_dir(res_path):
         os.mkdir(fonts_path)
 
 
-def pack_fonts(font_filename, point_size, text, color, atlas_size):
-    texture_packer = get_packer('maxrects', str(atlas_size), 'area')
+def render_font_chars(font_filename, point_size, text, color):
     font = ImageFont.truetype(font_filename, point_size)
 
     image_dict = {}
+    geometry = []
     for character in text:
         size = font.getsize(character)
         name = '%s_%s_%s' % (os.path.basename(font_filename), str(point_size), character)
         image_dict[name] = Image.new('RGBA', size, color)
         draw = ImageDraw.Draw(image_dict[name])
         draw.text((0, 0), character, font=font)
-        texture_packer.add_texture(image_dict[name].size[0], image_dict[name].size[1], name)
+        geometry.append((name, image_dict[name].size[0], image_dict[name].size[1]))
+
+    return (geometry, image_dict)
+
+
+def pack_fonts(geometry, atlas_width, atlas_height):
+    texture_packer = get_packer('maxrects', atlas_width, 'area', height=atlas_height)
+
+    for (name, width, height) in geometry:
+        texture_packer.add_texture(width, height, name)
 
     # Pack the textures into an atlas as efficiently as possible.
     packResult = texture_packer.pack_textures(True, True)
 
-    return (texture_packer, packResult, image_dict)
+    return (texture_packer, packResult)
 
 
-def create_imagefont(res_path, font_filename, point_size, text, color):
-    done = False
-    curr_size = 64
-    texture_packer = None
-    image_dict = None
-    packResult = None
+def create_imagefont(res_path, font_filename, point_size, text, color, bin_shape='square'):
+    (geometry, image_dict) = render_font_chars(font_filename, point_size, text, color)
 
-    # Retry until optimal font atlas size is found.
-    while not done:
-        try:
-            result = pack_fonts(font_filename, point_size, text, color, curr_size)
-            texture_packer = result[0]
-            packResult = result[1]
-            image_dict = result[2]
-            done = True
-        except PackerError:
-            curr_size = next_power_of_two(curr_size)
-            print "Failed, trying next power of two", curr_size
+    # Search for the optimal font atlas size using the glyph dimensions alone.
+    result = search_bin(lambda width, height: pack_fonts(geometry, width, height), geometry, 64, SizeSearch(bin_shape))[1]
+    texture_packer = result[0]
+    packResult = result[1]
 
     borderSize = 1
     font_image_name = os.path.join(get_fonts_path(res_path), '%s_%s.%s' % (os.path.basename(font_filename).split('.')[0], str(point_size), 'tga'))
@@ -144,7 +143,7 @@ def main():
 
     for size in point_sizes_list:
         print "Creating for ", size
-        create_imagefont(parser_dict['args']['res_path'], parser_dict['args']['font_file'], int(size), font_chars, get_color(parser_dict['args']['bg_color']))
+        create_imagefont(parser_dict['args']['res_path'], parser_dict['args']['font_file'], int(size), font_chars, get_color(parser_dict['args']['bg_color']), parser_dict['args']['bin_shape'])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# ###################################################
+# @file PackerBenchmark.py
+# @author PJ O Halloran (pjohalloran at gmail dot com)
+#
+# Times the packing algorithms on generated
+# rectangle sets of increasing size.
+#
+# This script is provided for free under the MIT license:
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is furnished
+# to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# ###################################################
+
+import time
+import random
+import argparse
+
+from util.utils import get_packer
+from packing_algorithms.texture_packer import PackerError
+from packing_algorithms.bin_size import get_bin_size_lower_bound
+
+
+def generate_geometry(count, min_edge, max_edge, seed):
+    generator = random.Random(seed)
+    geometry = []
+    for i in range(count):
+        geometry.append(('rect%d' % i, generator.randint(min_edge, max_edge), generator.randint(min_edge, max_edge)))
+    return geometry
+
+
+def run_benchmark(args, count):
+    geometry = generate_geometry(count, int(args['min_edge']), int(args['max_edge']), int(args['seed']))
+    # Leave some slack over the lower bound so that every set fits in a single pass.
+    size = get_bin_size_lower_bound(geometry) * 5 / 4
+
+    if args['packing_algorithm'] == 'skyline':
+        texture_packer = get_packer('skyline', size, args['skyline_heuristic'], waste_map=args['skyline_waste_map'])
+    elif args['packing_algorithm'] == 'guillotine':
+        texture_packer = get_packer('guillotine', size, args['guillotine_heuristic'], split_heuristic=args['guillotine_split'], merge=args['guillotine_merge'])
+    else:
+        texture_packer = get_packer(args['packing_algorithm'], size, args['maxrects_heuristic'], args['maxrects_spatial_index'], args['maxrects_backend'], args['maxrects_batch'])
+    start = time.time()
+    try:
+        texture_packer.add_textures(geometry)
+        packResult = texture_packer.pack_textures(True, True)
+    except PackerError:
+        packResult = None
+    elapsed = time.time() - start
+
+    free_rects = texture_packer.get_free_rect_count() if hasattr(texture_packer, 'get_free_rect_count') else 0
+    return (count, size, elapsed, packResult is not None, free_rects)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Benchmark for the texture packing algorithms.')
+
+    arg_parser.add_argument('-a', '--packing-algorithm', action='store', required=False, default='maxrects', choices=('ratcliff', 'maxrects', 'skyline', 'guillotine'), help='The packing algorithm to benchmark.')
+    arg_parser.add_argument('-e', '--maxrects-heuristic', action='store', required=False, default='area', choices=('shortside', 'longside', 'area', 'bottomleft', 'contactpoint'), help='The packing heuristic/rule to use if the maxrects algorithm is selected.')
+    arg_parser.add_argument('--maxrects-spatial-index', action='store_true', help='Index the maxrects free rectangles spatially and by size.')
+    arg_parser.add_argument('--maxrects-backend', action='store', required=False, default='python', choices=('python', 'numpy'), help='Score the maxrects heuristics in pure python or vectorised with numpy (needs numpy, ignores --maxrects-spatial-index).')
+    arg_parser.add_argument('--maxrects-batch', action='store_true', help='Place the images best scoring first rather than in directory order, packs tighter but is slower.')
+    arg_parser.add_argument('--skyline-heuristic', action='store', required=False, default='bottomleft', choices=('bottomleft', 'minwaste'), help='The packing heuristic/rule to use if the skyline algorithm is selected.')
+    arg_parser.add_argument('--skyline-waste-map', action='store_true', help='Reuse the gaps left below the skyline.')
+    arg_parser.add_argument('--guillotine-heuristic', action='store', required=False, default='area', choices=('area', 'shortside', 'longside'), help='The free rectangle choice rule to use if the guillotine algorithm is selected.')
+    arg_parser.add_argument('--guillotine-split', action='store', required=False, default='shorterleftover', choices=('shorterleftover', 'longerleftover', 'minarea', 'maxarea'), help='How the guillotine algorithm cuts the space left next to a placed image in two.')
+    arg_parser.add_argument('--guillotine-merge', action='store_true', help='Join neighbouring guillotine free rectangles back together, packs tighter but is a little slower.')
+    arg_parser.add_argument('-n', '--counts', action='store', required=False, default='1000,2000,5000,10000,20000', help='Comma delimited list of rectangle counts to pack.')
+    arg_parser.add_argument('--min-edge', action='store', required=False, default='4', help='The smallest generated rectangle edge.')
+    arg_parser.add_argument('--max-edge', action='store', required=False, default='64', help='The largest generated rectangle edge.')
+    arg_parser.add_argument('--seed', action='store', required=False, default='1', help='The seed for the generated rectangle sizes.')
+
+    args = vars(arg_parser.parse_args())
+
+    return {'parser': arg_parser, 'args': args}
+
+
+def main():
+    args = parse_args()['args']
+
+    print '%8s %8s %10s %12s %10s' % ('rects', 'bin', 'seconds', 'us/rect', 'free')
+    for count in args['counts'].split(','):
+        (count, size, elapsed, packed, free_rects) = run_benchmark(args, int(count))
+        print '%8d %8d %10.3f %12.1f %10d%s' % (count, size, elapsed, elapsed * 1000000 / count, free_rects, '' if packed else ' (failed to fit)')
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
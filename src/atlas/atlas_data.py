@@ -6,6 +6,10 @@ class AtlasData:
     color_mode = ""
     file_type = ""
     name = ""
+    heuristic = None
+    rotations = None
+    sort_order = None
+    pages = None
 
     def __init__(self, name, width=512, height=512, border=1, color_mode="RGBA", file_type="tga"):
         self.texture_dict = {}
@@ -21,3 +25,15 @@ class AtlasData:
 
     def get_texture_count(self):
         return len(self.texture_dict)
+
+    def set_packing_variant(self, variant):
+        # Records which combination won when the maxrects heuristics were raced.
+        self.heuristic = variant.heuristic
+        self.rotations = variant.allow_rotations
+        self.sort_order = variant.sort_order
+
+    def add_page(self, file_name, width, height):
+        # Atlases split over several images list each page, the textures record which one they are on.
+        if self.pages is None:
+            self.pages = []
+        self.pages.append({'index': len(self.pages), 'file': file_name, 'width': width, 'height': height})
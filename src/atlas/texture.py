@@ -1,7 +1,19 @@
-from math.rect import Rect
+from maths.rect import Rect
 
 
 class Texture:
+    # The page of a multi-page atlas the texture is packed on, None when the atlas has a single page.
+    page = None
+    # The size of the source image and where the texture sits in it, None unless its transparent border was trimmed.
+    original_width = None
+    original_height = None
+    offset_x = None
+    offset_y = None
+    # The name of the texture this one shares its rect with, None unless its pixels are a duplicate.
+    alias = None
+    # The atlas holding the rect the texture is drawn from, None when that is the atlas the texture is listed in.
+    atlas = None
+
     def __init__(self, width, height, name=""):
         self.width = width
         self.height = height
@@ -19,6 +31,27 @@ class Texture:
         self.flipped = flipped
         self.placed = True
 
+    def set_page(self, page):
+        self.page = page
+
+    def set_trim(self, offsetX, offsetY, originalWidth, originalHeight):
+        self.offset_x = offsetX
+        self.offset_y = offsetY
+        self.original_width = originalWidth
+        self.original_height = originalHeight
+
+    def get_alias(self, name, atlas=None):
+        # A copy of the texture placed on the same rect under another name, atlas names the atlas the rect
+        # is in when the copy is listed in another one.
+        alias = Texture(self.width, self.height, name)
+        alias.place_texture(self.x, self.y, self.flipped)
+        if self.page is not None:
+            alias.set_page(self.page)
+        alias.alias = self.name
+        if atlas is not None:
+            alias.atlas = atlas
+        return alias
+
     def flip_dimensions(self):
         if(self.flipped):
             tmp = self.width
@@ -33,6 +66,17 @@ class Texture:
         tex_dict['y'] = self.y
         tex_dict['flipped'] = self.flipped
         tex_dict['name'] = self.name
+        if self.page is not None:
+            tex_dict['page'] = self.page
+        if self.alias is not None:
+            tex_dict['alias'] = self.alias
+        if self.atlas is not None:
+            tex_dict['atlas'] = self.atlas
+        if self.original_width is not None:
+            tex_dict['original_width'] = self.original_width
+            tex_dict['original_height'] = self.original_height
+            tex_dict['offset_x'] = self.offset_x
+            tex_dict['offset_y'] = self.offset_y
         return tex_dict
 
     def get_rect(self):
@@ -0,0 +1,339 @@
+import mmap
+import struct
+
+from parser import Parser
+from parser import ParserError
+
+# The binary atlas data is meant to be memory mapped and used in place, nothing in it needs parsing.  Every
+# value is little endian and every section starts on an 8 byte boundary:
+#
+#   header    HEADER_FORMAT, the offsets of the sections below are from the start of the file
+#   pages     page_count PAGE_FORMAT entries, (file name, width, height)
+#   hash      record_count int32 displacements of the perfect hash over the texture names
+#   records   record_count RECORD_FORMAT entries of record_stride bytes, in perfect hash order
+#   strings   the UTF-8 strings the rest refers to, each ended by a NUL
+#
+# Strings are referred to by their offset in the string table, NO_STRING is none.
+BIN_MAGIC = 'ATLB'
+BIN_VERSION = 2
+NO_STRING = 0xffffffff
+
+# magic, version, flags, width, height, border, record_count, page_count, record_stride, hash_seed, the name,
+# color mode, file type, heuristic and sort order strings, then the offsets of the pages, hash, records and
+# strings and the size of the string table.
+HEADER_FORMAT = '<4sHHIIIIIIIIIIIIIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+HEADER_ROTATIONS = 0x1
+
+PAGE_FORMAT = '<III'
+PAGE_SIZE = struct.calcsize(PAGE_FORMAT)
+
+# name, x, y, width, height, page, flags, offset_x, offset_y, original_width, original_height, the alias and atlas
+# strings, then the normalized u0, v0, u1, v1 of the rect on its page.  width and height are the size of the
+# image before it is flipped, a flipped texture covers height x width pixels of the page.  Textures that were
+# not trimmed have no offset and their own size as the original size.  The UVs of a texture drawn from another
+# atlas are 0, the rect is that of its alias in that atlas.
+RECORD_FORMAT = '<IIIIIHHiiIIIIffff'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_FLIPPED = 0x1
+RECORD_TRIMMED = 0x2
+RECORD_ALIAS = 0x4
+RECORD_EXTERNAL = 0x8
+
+FNV_OFFSET_BASIS = 0x811c9dc5
+FNV_PRIME = 0x01000193
+
+# The displacements tried for a bucket, and the hash seeds tried, before giving up on a table.
+MAX_DISPLACEMENT = 1 << 16
+MAX_HASH_SEEDS = 32
+
+
+def name_hash(seed, name):
+    # 32 bit FNV-1a of the name's bytes, with the seed mixed into the offset basis and the murmur3 finaliser
+    # run over the result so every bit of it depends on every bit of the seed and the name.
+    h = FNV_OFFSET_BASIS ^ ((seed * 0x9e3779b1) & 0xffffffff)
+    for c in name:
+        h = ((h ^ ord(c)) * FNV_PRIME) & 0xffffffff
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xffffffff
+    h ^= h >> 16
+    return h
+
+
+def get_bucket(hash_seed, name, size):
+    return name_hash(hash_seed, name) % size
+
+
+def get_slot(hash_seed, displacement, name, size):
+    # A displacement is either -slot - 1 or a seed offset from 1 to MAX_DISPLACEMENT.
+    if displacement < 0:
+        return -displacement - 1
+    return name_hash(hash_seed + displacement, name) % size
+
+
+def _place_buckets(names, hash_seed):
+    # Hash and displace: the names are put in buckets by their hash_seed hash, and the fullest buckets are
+    # given the first displacement that sends all of their names to free slots.  Buckets of a single name are
+    # given a free slot directly.  Returns (displacements, slots), slots[i] being the name at record i, or None
+    # when a bucket finds no displacement.
+    size = len(names)
+    buckets = [[] for i in range(size)]
+    for name in names:
+        buckets[get_bucket(hash_seed, name, size)].append(name)
+
+    displacements = [0] * size
+    slots = [None] * size
+    order = sorted(range(size), key=lambda bucket: (-len(buckets[bucket]), bucket))
+    position = 0
+    while position < size and len(buckets[order[position]]) > 1:
+        bucket = order[position]
+        for displacement in xrange(1, MAX_DISPLACEMENT + 1):
+            used = set()
+            for name in buckets[bucket]:
+                slot = get_slot(hash_seed, displacement, name, size)
+                if slots[slot] is not None or slot in used:
+                    break
+                used.add(slot)
+            else:
+                break
+        else:
+            return None
+        for name in buckets[bucket]:
+            slots[get_slot(hash_seed, displacement, name, size)] = name
+        displacements[bucket] = displacement
+        position += 1
+
+    free = [slot for slot in range(size) if slots[slot] is None]
+    while position < size and len(buckets[order[position]]) == 1:
+        bucket = order[position]
+        slot = free.pop()
+        slots[slot] = buckets[bucket][0]
+        displacements[bucket] = -slot - 1
+        position += 1
+
+    return (displacements, slots)
+
+
+def create_perfect_hash(names):
+    # Returns (hash_seed, displacements, slots) for a minimal perfect hash over the names.  A hash seed whose
+    # buckets cannot all be placed is given up for the next one, the seeds are far enough apart that their
+    # displacements never overlap.
+    for attempt in range(MAX_HASH_SEEDS):
+        hash_seed = attempt * (MAX_DISPLACEMENT + 1)
+        placed = _place_buckets(names, hash_seed)
+        if placed is not None:
+            return (hash_seed, placed[0], placed[1])
+    raise ParserError('Failed to build a perfect hash over %d texture names' % len(names))
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class BinParser(Parser):
+
+    def get_file_ext(self):
+        return 'bin'
+
+    def get_file_mode(self):
+        return 'wb'
+
+    def write(self, data_file):
+        atlas_data = self.atlas_data
+        strings = {}
+        stringData = []
+        stringsSize = [0]
+
+        def add_string(value):
+            if value is None:
+                return NO_STRING
+            value = _encode(value)
+            if value not in strings:
+                strings[value] = stringsSize[0]
+                stringData.append(value + '\0')
+                stringsSize[0] += len(value) + 1
+            return strings[value]
+
+        names = [_encode(name) for name in atlas_data.texture_dict]
+        if len(set(names)) != len(names):
+            raise ParserError('Texture names of atlas %s are not unique once encoded' % atlas_data.name)
+        textures = dict(zip(names, atlas_data.texture_dict.values()))
+        (hashSeed, displacements, slots) = create_perfect_hash(names)
+
+        pages = atlas_data.pages or []
+        pageEntries = [(add_string(page['file']), page['width'], page['height']) for page in pages]
+        headerStrings = [add_string(atlas_data.name), add_string(atlas_data.color_mode), add_string(atlas_data.file_type),
+                         add_string(atlas_data.heuristic), add_string(atlas_data.sort_order)]
+        for name in slots:
+            tex = textures[name]
+            add_string(name)
+            add_string(tex.alias)
+            add_string(tex.atlas)
+
+        pagesOffset = _align(HEADER_SIZE)
+        hashOffset = _align(pagesOffset + PAGE_SIZE * len(pageEntries))
+        recordsOffset = _align(hashOffset + 4 * len(displacements))
+        stringsOffset = _align(recordsOffset + RECORD_SIZE * len(slots))
+
+        flags = HEADER_ROTATIONS if atlas_data.rotations else 0
+        header = struct.pack(HEADER_FORMAT, BIN_MAGIC, BIN_VERSION, flags, atlas_data.width, atlas_data.height,
+                             atlas_data.border, len(slots), len(pageEntries), RECORD_SIZE, hashSeed, *(headerStrings +
+                             [pagesOffset, hashOffset, recordsOffset, stringsOffset, stringsSize[0]]))
+        offset = self._write_section(data_file, 0, 0, header)
+        offset = self._write_section(data_file, offset, pagesOffset, ''.join([struct.pack(PAGE_FORMAT, *entry) for entry in pageEntries]))
+        offset = self._write_section(data_file, offset, hashOffset, struct.pack('<%di' % len(displacements), *displacements))
+
+        offset = self._write_section(data_file, offset, recordsOffset, '')
+        for name in slots:
+            data_file.write(self._pack_record(textures[name], strings[name], add_string))
+        offset += RECORD_SIZE * len(slots)
+
+        self._write_section(data_file, offset, stringsOffset, ''.join(stringData))
+
+    def _write_section(self, data_file, offset, sectionOffset, data):
+        # Pads up to where the section starts and writes it, returns the offset after it.
+        data_file.write('\0' * (sectionOffset - offset))
+        data_file.write(data)
+        return sectionOffset + len(data)
+
+    def _pack_record(self, tex, nameOffset, add_string):
+        flags = 0
+        if tex.flipped:
+            flags |= RECORD_FLIPPED
+        if tex.alias is not None:
+            flags |= RECORD_ALIAS
+        if tex.original_width is not None:
+            flags |= RECORD_TRIMMED
+            trim = (tex.offset_x, tex.offset_y, tex.original_width, tex.original_height)
+        else:
+            trim = (0, 0, tex.width, tex.height)
+
+        uvs = (0.0, 0.0, 0.0, 0.0)
+        if tex.atlas is not None:
+            flags |= RECORD_EXTERNAL
+        else:
+            (pageWidth, pageHeight) = (self.atlas_data.width, self.atlas_data.height)
+            if tex.page is not None:
+                pageWidth = self.atlas_data.pages[tex.page]['width']
+                pageHeight = self.atlas_data.pages[tex.page]['height']
+            (width, height) = (tex.height, tex.width) if tex.flipped else (tex.width, tex.height)
+            uvs = (float(tex.x) / pageWidth, float(tex.y) / pageHeight,
+                   float(tex.x + width) / pageWidth, float(tex.y + height) / pageHeight)
+
+        return struct.pack(RECORD_FORMAT, nameOffset, tex.x, tex.y, tex.width, tex.height, tex.page or 0, flags,
+                           trim[0], trim[1], trim[2], trim[3], add_string(tex.alias), add_string(tex.atlas), *uvs)
+
+
+class BinReader:
+    # Reads a binary atlas data file memory mapped, looking textures up by name through the perfect hash
+    # without reading the rest of the file.  Textures are returned as dicts with the keys Texture.to_dict()
+    # writes, plus u0, v0, u1 and v1.
+    data_map = None
+    name = None
+    color_mode = None
+    file_type = None
+    heuristic = None
+    sort_order = None
+    rotations = False
+    width = 0
+    height = 0
+    border = 0
+    pages = None
+    record_count = 0
+    record_stride = RECORD_SIZE
+    hash_seed = 0
+    hash_offset = 0
+    records_offset = 0
+    strings_offset = 0
+
+    def __init__(self, filename):
+        data_file = open(filename, 'rb')
+        try:
+            self.data_map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            data_file.close()
+
+        if len(self.data_map) < HEADER_SIZE:
+            self.close()
+            raise ParserError('%s is not a binary atlas data file' % filename)
+        header = struct.unpack_from(HEADER_FORMAT, self.data_map, 0)
+        if header[0] != BIN_MAGIC or header[1] != BIN_VERSION:
+            self.close()
+            raise ParserError('%s is not a version %d binary atlas data file' % (filename, BIN_VERSION))
+
+        (magic, version, flags, self.width, self.height, self.border, self.record_count, pageCount,
+         self.record_stride, self.hash_seed, nameOffset, modeOffset, typeOffset, heuristicOffset, sortOrderOffset,
+         pagesOffset, self.hash_offset, self.records_offset, self.strings_offset, stringsSize) = header
+        self.rotations = bool(flags & HEADER_ROTATIONS)
+        self.name = self._get_string(nameOffset)
+        self.color_mode = self._get_string(modeOffset)
+        self.file_type = self._get_string(typeOffset)
+        self.heuristic = self._get_string(heuristicOffset)
+        self.sort_order = self._get_string(sortOrderOffset)
+
+        self.pages = []
+        for index in range(pageCount):
+            (fileOffset, width, height) = struct.unpack_from(PAGE_FORMAT, self.data_map, pagesOffset + index * PAGE_SIZE)
+            self.pages.append({'index': index, 'file': self._get_string(fileOffset), 'width': width, 'height': height})
+
+    def close(self):
+        if self.data_map is not None:
+            self.data_map.close()
+            self.data_map = None
+
+    def _get_string(self, offset):
+        if offset == NO_STRING:
+            return None
+        start = self.strings_offset + offset
+        return self.data_map[start:self.data_map.find('\0', start)]
+
+    def _get_displacement(self, bucket):
+        return struct.unpack_from('<i', self.data_map, self.hash_offset + bucket * 4)[0]
+
+    def _get_record(self, index):
+        return struct.unpack_from(RECORD_FORMAT, self.data_map, self.records_offset + index * self.record_stride)
+
+    def get_texture_count(self):
+        return self.record_count
+
+    def get_texture_names(self):
+        return [self._get_string(self._get_record(index)[0]) for index in range(self.record_count)]
+
+    def get_texture(self, name):
+        # Returns the texture called name, or None if the atlas has no such texture.
+        if self.record_count == 0:
+            return None
+        name = _encode(name)
+        displacement = self._get_displacement(get_bucket(self.hash_seed, name, self.record_count))
+        index = get_slot(self.hash_seed, displacement, name, self.record_count)
+
+        record = self._get_record(index)
+        if self._get_string(record[0]) != name:
+            return None
+        return self._create_texture(record)
+
+    def _create_texture(self, record):
+        (nameOffset, x, y, width, height, page, flags, offsetX, offsetY, originalWidth, originalHeight,
+         aliasOffset, atlasOffset, u0, v0, u1, v1) = record
+        tex_dict = {'name': self._get_string(nameOffset), 'x': x, 'y': y, 'width': width, 'height': height,
+                    'flipped': bool(flags & RECORD_FLIPPED), 'u0': u0, 'v0': v0, 'u1': u1, 'v1': v1}
+        if self.pages:
+            tex_dict['page'] = page
+        if flags & RECORD_ALIAS:
+            tex_dict['alias'] = self._get_string(aliasOffset)
+        if flags & RECORD_EXTERNAL:
+            tex_dict['atlas'] = self._get_string(atlasOffset)
+        if flags & RECORD_TRIMMED:
+            tex_dict['original_width'] = originalWidth
+            tex_dict['original_height'] = originalHeight
+            tex_dict['offset_x'] = offsetX
+            tex_dict['offset_y'] = offsetY
+        return tex_dict
@@ -31,5 +31,11 @@ class JsonParser(Parser):
     def get_file_ext(self):
         return 'json'
 
-    def parse(self, atlas_data):
-        self.parser_output = simplejson.dumps(atlas_data, cls=CustomTypeEncoder, indent=4)
+    def write(self, data_file):
+        # iterencode hands over the document a piece at a time as it walks the textures.
+        if self.compact:
+            encoder = CustomTypeEncoder(separators=(',', ':'))
+        else:
+            encoder = CustomTypeEncoder(indent=4)
+        for chunk in encoder.iterencode(self.atlas_data):
+            data_file.write(chunk)
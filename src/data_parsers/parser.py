@@ -2,24 +2,41 @@ class ParserError(Exception):
     pass
 
 
+# The data files are written in many small pieces, a large buffer keeps that to a few writes.
+WRITE_BUFFER_SIZE = 1 << 16
+
+
 class Parser:
-    parser_output = None
+    # Parsers stream the atlas data to the file as they save it, one texture at a time, rather than building
+    # the whole document in memory first.  compact leaves out the indentation and line breaks.
+    atlas_data = None
+    compact = False
 
-    def __init__(self):
-        pass
+    def __init__(self, compact=False):
+        self.compact = compact
 
     def get_file_ext(self):
         raise NotImplementedError('Parser::get_file_ext() not implemented')
 
+    def get_file_mode(self):
+        # The mode the data file is opened in, binary formats need 'wb' so no line endings are translated.
+        return 'w'
+
     def parse(self, atlas_data):
-        raise NotImplementedError('Parser::parse() not implemented')
+        self.atlas_data = atlas_data
+
+    def write(self, data_file):
+        raise NotImplementedError('Parser::write() not implemented')
 
     def is_ready_to_save(self):
-        return self.parser_output is not None and len(self.parser_output) > 0
+        return self.atlas_data is not None
 
     def save(self, filename):
         if not self.is_ready_to_save():
             raise ParserError('Cannot save to file - no data, please parse data before trying to save')
 
-        file = open(filename, 'w')
-        file.write(self.parser_output)
+        data_file = open(filename, self.get_file_mode(), WRITE_BUFFER_SIZE)
+        try:
+            self.write(data_file)
+        finally:
+            data_file.close()
@@ -1,44 +1,68 @@
-import xml.dom.minidom
+from xml.sax.saxutils import escape
 
 from parser import Parser
 
+# Attribute values are always in double quotes.
+ATTRIBUTE_ENTITIES = {'"': '&quot;'}
+
 
 class XmlParser(Parser):
-    document = None
-    root_element = None
+    # Writes the elements straight to the file, laid out the way xml.dom.minidom pretty prints them.
+    data_file = None
 
     def get_file_ext(self):
         return 'xml'
 
-    def parse(self, atlas_data):
-        self._create_root_node()
-        self._parse_atlas_data(atlas_data)
-        self.parser_output = self.document.toprettyxml(newl="\n", indent="    ")
-        self._clean_up()
+    def write(self, data_file):
+        self.data_file = data_file
+        try:
+            self.data_file.write('<?xml version="1.0" ?>')
+            self._new_line(0)
+            self.data_file.write('<Root>')
+            self._parse_atlas_data(self.atlas_data)
+            self._new_line(0)
+            self.data_file.write('</Root>')
+            self._new_line(0)
+        finally:
+            self.data_file = None
 
-    def _create_root_node(self, root_name='Root'):
-        self.document = xml.dom.minidom.Document()
-        self.root_element = self.document.createElement(root_name)
-        self.document.appendChild(self.root_element)
+    def _new_line(self, depth):
+        if not self.compact:
+            self.data_file.write('\n' + '    ' * depth)
 
     def _parse_atlas_data(self, atlas_data):
-        atlas = self.document.createElement('Atlas')
-        atlas.setAttribute('name', atlas_data.name)
-        atlas.setAttribute('mode', atlas_data.color_mode)
-        atlas.setAttribute('type', atlas_data.file_type)
-        atlas.setAttribute('border', str(atlas_data.border))
-        atlas.setAttribute('width', str(atlas_data.width))
-        atlas.setAttribute('height', str(atlas_data.height))
+        atlas = {'name': atlas_data.name,
+                 'mode': atlas_data.color_mode,
+                 'type': atlas_data.file_type,
+                 'border': atlas_data.border,
+                 'width': atlas_data.width,
+                 'height': atlas_data.height}
+        if atlas_data.heuristic is not None:
+            atlas['heuristic'] = atlas_data.heuristic
+            atlas['rotations'] = atlas_data.rotations
+            atlas['sort_order'] = atlas_data.sort_order
+
+        empty = not atlas_data.pages and not atlas_data.texture_dict
+        self._new_line(1)
+        self._write_element('Atlas', atlas, empty)
+        if empty:
+            return
+
+        if atlas_data.pages is not None:
+            for page in atlas_data.pages:
+                self._add_element(page, 'Page')
         for key in atlas_data.texture_dict:
-            self._add_element(atlas, atlas_data.texture_dict[key].to_dict())
-        self.root_element.appendChild(atlas)
-
-    def _add_element(self, atlas_element, attribute_dict):
-        element = self.document.createElement('Image')
-        for key in attribute_dict.keys():
-            element.setAttribute(key, str(attribute_dict[key]))
-        atlas_element.appendChild(element)
-
-    def _clean_up(self):
-        self.document.unlink()
-        self.document = None
+            self._add_element(atlas_data.texture_dict[key].to_dict())
+        self._new_line(1)
+        self.data_file.write('</Atlas>')
+
+    def _add_element(self, attribute_dict, element_name='Image'):
+        self._new_line(2)
+        self._write_element(element_name, attribute_dict, True)
+
+    def _write_element(self, element_name, attribute_dict, empty):
+        # Attributes are in name order, as minidom writes them.
+        self.data_file.write('<' + element_name)
+        for key in sorted(attribute_dict.keys()):
+            self.data_file.write(' %s="%s"' % (key, escape(str(attribute_dict[key]), ATTRIBUTE_ENTITIES)))
+        self.data_file.write('/>' if empty else '>')
@@ -0,0 +1,62 @@
+import os
+
+
+class ImageWriterError(Exception):
+    pass
+
+
+class ImageWriter:
+    # Writes an image to a file a strip of rows at a time, top to bottom, so the whole image never has to
+    # be held in memory.
+    filename = None
+    image_file = None
+    width = 0
+    height = 0
+    color_mode = 'RGBA'
+    rows_written = 0
+
+    def __init__(self, filename, width, height, color_mode='RGBA'):
+        if color_mode not in ('RGB', 'RGBA'):
+            raise ImageWriterError('Unsupported color mode %s' % color_mode)
+
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.color_mode = color_mode
+        self.rows_written = 0
+        self.image_file = open(filename, 'wb')
+        self._write_header()
+
+    def write_strip(self, strip):
+        # strip is a PIL image as wide as the image in the writer's color mode.
+        if strip.size[0] != self.width or strip.mode != self.color_mode:
+            raise ImageWriterError('Strip is %dx%d %s, expected width %d %s' % (strip.size[0], strip.size[1], strip.mode, self.width, self.color_mode))
+        if self.rows_written + strip.size[1] > self.height:
+            raise ImageWriterError('Strip runs past the bottom of the image')
+
+        self._write_rows(strip)
+        self.rows_written += strip.size[1]
+
+    def close(self):
+        try:
+            if self.rows_written != self.height:
+                raise ImageWriterError('Only %d of %d rows were written' % (self.rows_written, self.height))
+            self._write_footer()
+        finally:
+            self.image_file.close()
+
+    def abort(self):
+        # Closes the file and removes it, for writing that failed part way.  A truncated image is never left to
+        # look like a finished one.
+        self.image_file.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def _write_header(self):
+        raise NotImplementedError('ImageWriter::_write_header() not implemented')
+
+    def _write_rows(self, strip):
+        raise NotImplementedError('ImageWriter::_write_rows() not implemented')
+
+    def _write_footer(self):
+        pass
@@ -0,0 +1,155 @@
+import zlib
+import struct
+from collections import deque
+
+from PIL import Image
+from PIL import ImageChops
+
+from image_writer import ImageWriter
+from image_writer import ImageWriterError
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# Compressed data is written out in IDAT chunks of about this many bytes.
+IDAT_CHUNK_SIZE = 1 << 18
+
+# The rows are deflated in independent pieces of about this many bytes, each on a thread of its own when there
+# is a pool to compress them on.  The pieces run on across the strips written, so every strip size keeps the
+# pool busy and the pieces are the same whatever the strips.
+DEFLATE_CHUNK_SIZE = 1 << 18
+
+# The most pieces given to the pool and not yet written, enough to keep that many threads busy.  Writing
+# waits for the oldest piece when there are more, which bounds the memory the pending pieces take.
+MAX_DEFLATING_CHUNKS = 64
+
+# The PNG row filter types, all rows of an image get the same one.  Sub stores each byte as the difference from
+# the byte one pixel to its left, Up as the difference from the byte above it.
+PNG_FILTERS = {'none': '\x00', 'sub': '\x01', 'up': '\x02'}
+
+# The second byte of the zlib header for each compression level, telling decoders how hard it was compressed.
+ZLIB_LEVEL_FLAGS = ['\x01', '\x01', '\x5e', '\x5e', '\x5e', '\x5e', '\x9c', '\xda', '\xda', '\xda']
+
+
+def _deflate_chunk(job):
+    # Compresses a piece of the zlib stream as raw deflate data.  The sync flush ends it on a byte boundary
+    # with the last block left open, so the pieces join up one after the other into a single stream.
+    (data, compress_level) = job
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class PngWriter(ImageWriter):
+    # 8 bit RGB or RGBA PNG.  The filtered rows are cut in pieces that are deflated independently and joined
+    # into one zlib stream, like pigz does, so with a thread pool they are compressed in parallel, zlib
+    # releases the GIL while it works.  The pieces only depend on the rows written, not on the pool, so the
+    # file is the same whatever the number of threads.
+    compress_level = 6
+    filter_type = 'up'
+    pool = None
+    adler = 1
+    pending = None
+    pending_size = 0
+    rows = None
+    rows_size = 0
+    deflating = None
+    last_row = None
+
+    def __init__(self, filename, width, height, color_mode='RGBA', compress_level=6, filter_type='up', pool=None):
+        if compress_level < 0 or compress_level > 9:
+            raise ImageWriterError('Compression level %d is not between 0 and 9' % compress_level)
+        if filter_type not in PNG_FILTERS:
+            raise ImageWriterError('Unknown PNG filter %s' % filter_type)
+
+        self.compress_level = compress_level
+        self.filter_type = filter_type
+        self.pool = pool
+        self.adler = zlib.adler32('')
+        self.pending = []
+        self.pending_size = 0
+        self.rows = []
+        self.rows_size = 0
+        self.deflating = deque()
+        self.last_row = None
+        ImageWriter.__init__(self, filename, width, height, color_mode)
+
+    def _write_chunk(self, chunkType, data):
+        self.image_file.write(struct.pack('>I', len(data)))
+        self.image_file.write(chunkType)
+        self.image_file.write(data)
+        self.image_file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunkType)) & 0xffffffff))
+
+    def _add_compressed(self, data):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending_size >= IDAT_CHUNK_SIZE:
+            self._flush_compressed()
+
+    def _flush_compressed(self):
+        if self.pending_size > 0:
+            self._write_chunk('IDAT', ''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def _write_header(self):
+        colorType = 6 if self.color_mode == 'RGBA' else 2
+        self.image_file.write(PNG_SIGNATURE)
+        self._write_chunk('IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, colorType, 0, 0, 0))
+        self._add_compressed('\x78' + ZLIB_LEVEL_FLAGS[self.compress_level])
+
+    def _filter_strip(self, strip):
+        # Filters the whole strip at once with PIL, returns the filtered bytes without the filter type bytes.
+        (width, height) = strip.size
+        if self.filter_type == 'none':
+            return strip.tobytes()
+
+        if self.filter_type == 'sub':
+            # Moved right a pixel, the first pixel of a row has zeros to its left.
+            previous = Image.new(self.color_mode, (width, height))
+            previous.paste(strip.crop((0, 0, width - 1, height)), (1, 0))
+        else:
+            # Moved down a row, the first row of the image has zeros above it.
+            previous = Image.new(self.color_mode, (width, height))
+            if self.last_row is not None:
+                previous.paste(self.last_row, (0, 0))
+            previous.paste(strip.crop((0, 0, width, height - 1)), (0, 1))
+            self.last_row = strip.crop((0, height - 1, width, height))
+
+        return ImageChops.subtract_modulo(strip, previous).tobytes()
+
+    def _write_rows(self, strip):
+        data = self._filter_strip(strip)
+        stride = len(data) / strip.size[1]
+        filterByte = PNG_FILTERS[self.filter_type]
+
+        for i in xrange(0, len(data), stride):
+            self.rows.append(filterByte + data[i:i + stride])
+            self.rows_size += stride + 1
+            if self.rows_size >= DEFLATE_CHUNK_SIZE:
+                self._deflate_rows()
+
+    def _deflate_rows(self):
+        # Cuts a piece from the rows waiting and deflates it, on the pool without waiting for it if there is one.
+        chunk = ''.join(self.rows)
+        self.rows = []
+        self.rows_size = 0
+        self.adler = zlib.adler32(chunk, self.adler)
+
+        if self.pool is None:
+            self._add_compressed(_deflate_chunk((chunk, self.compress_level)))
+            return
+        self.deflating.append(self.pool.apply_async(_deflate_chunk, ((chunk, self.compress_level),)))
+        while len(self.deflating) > MAX_DEFLATING_CHUNKS:
+            self._add_compressed(self.deflating.popleft().get())
+
+    def _write_footer(self):
+        if self.rows:
+            self._deflate_rows()
+        while self.deflating:
+            self._add_compressed(self.deflating.popleft().get())
+
+        # An empty last block ends the deflate data, the checksum of everything inflated ends the zlib stream.
+        self._add_compressed(zlib.compressobj(self.compress_level, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH))
+        self._add_compressed(struct.pack('>I', self.adler & 0xffffffff))
+        self._flush_compressed()
+        self._write_chunk('IEND', '')
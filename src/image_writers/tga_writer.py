@@ -0,0 +1,17 @@
+import struct
+
+from image_writer import ImageWriter
+
+
+class TgaWriter(ImageWriter):
+    # Uncompressed true color TGA with the origin in the top left corner, so rows are written top down.
+
+    def _write_header(self):
+        if self.color_mode == 'RGBA':
+            (pixelDepth, descriptor) = (32, 0x28)
+        else:
+            (pixelDepth, descriptor) = (24, 0x20)
+        self.image_file.write(struct.pack('<BBBHHBHHHHBB', 0, 0, 2, 0, 0, 0, 0, 0, self.width, self.height, pixelDepth, descriptor))
+
+    def _write_rows(self, strip):
+        self.image_file.write(strip.tobytes('raw', 'BGRA' if self.color_mode == 'RGBA' else 'BGR'))
@@ -0,0 +1,48 @@
+
+
+def is_power_of_two(number):
+    return ((number & (number - 1)) == 0) and number != 0
+
+
+def next_power_of_two(number):
+    p = 1
+    while (p <= number):
+        p *= 2
+    return p
+
+
+# Returns 0 if the two intervals i1 and i2 are disjoint, or the length of their overlap otherwise.
+def common_interval_length(one_start, one_end, two_start, two_end):
+    if one_start < two_start or two_end < one_start:
+        return 0
+    return min(one_end, two_end) - max(one_start, two_start)
+
+
+# Returns the smallest power of two that is greater than or equal to number.
+def round_up_power_of_two(number):
+    p = 1
+    while (p < number):
+        p *= 2
+    return p
+
+
+# Returns the largest power of two that is less than or equal to number.
+def round_down_power_of_two(number):
+    p = 1
+    while (p * 2 <= number):
+        p *= 2
+    return p
+
+
+# Returns the smallest integer whose square is greater than or equal to number.
+def integer_sqrt_ceil(number):
+    if number <= 0:
+        return 0
+    root = number
+    estimate = (root + 1) / 2
+    while estimate < root:
+        root = estimate
+        estimate = (root + number / root) / 2
+    if root * root < number:
+        root += 1
+    return root
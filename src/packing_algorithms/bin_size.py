@@ -0,0 +1,190 @@
+import sys
+
+from packing_algorithms.texture_packer import PackerError
+from maths.math import round_up_power_of_two
+from maths.math import integer_sqrt_ceil
+
+
+class SizeSearch:
+    # How the bin size is searched for, a square bin or a width x height rectangle ('rect') with each
+    # axis limited to powers of two or not.  Square bins are a power of two on both axes or on neither.
+    shape = 'square'
+    width_power_of_two = True
+    height_power_of_two = True
+
+    def __init__(self, shape='square', width_power_of_two=True, height_power_of_two=True):
+        self.shape = shape
+        self.width_power_of_two = width_power_of_two
+        self.height_power_of_two = height_power_of_two
+
+
+def get_bin_size_lower_bound(geometry):
+    # geometry is a list of (name, width, height) tuples.
+    # A square bin can never be smaller than the longest edge or the side of a square holding the total area.
+    totalArea = 0
+    longestEdge = 0
+
+    for (name, width, height) in geometry:
+        totalArea += width * height
+        longestEdge = max(longestEdge, width, height)
+
+    return max(longestEdge, integer_sqrt_ceil(totalArea))
+
+
+def _try_pack(pack_func, size, verbose):
+    try:
+        return pack_func(size)
+    except PackerError:
+        if verbose:
+            print "Failed to fit in bin size", size
+        return None
+
+
+def search_bin_size(pack_func, lower_bound, powerOfTwo=True, verbose=True, upper_bound=0):
+    # pack_func(size) packs the geometry into a size x size bin and raises PackerError if it does not fit.
+    # Sizes are probed galloping upwards from lower_bound until one fits, then the gap between the
+    # last failure and the first fit is binary searched.  Returns (size, pack_func result).
+    # A positive upper_bound caps the sizes probed and PackerError is raised if even that does not fit.
+    if powerOfTwo:
+        lower_bound = round_up_power_of_two(lower_bound)
+        # Steps are exponents, doubling the size each step is already a gallop.
+        get_size = lambda step: lower_bound << step
+        step = 1
+        growStep = False
+    else:
+        get_size = lambda step: lower_bound + step
+        step = max(1, lower_bound / 16)
+        growStep = True
+
+    maxStep = sys.maxint
+    if upper_bound > 0:
+        if lower_bound > upper_bound:
+            raise PackerError('Failed to fit in the maximum bin size %d' % upper_bound)
+        if powerOfTwo:
+            maxStep = 0
+            while get_size(maxStep + 1) <= upper_bound:
+                maxStep += 1
+        else:
+            maxStep = upper_bound - lower_bound
+
+    failed = -1
+    fitted = 0
+    result = _try_pack(pack_func, get_size(fitted), verbose)
+    while result is None:
+        if fitted == maxStep:
+            raise PackerError('Failed to fit in the maximum bin size %d' % upper_bound)
+        failed = fitted
+        fitted = min(fitted + step, maxStep)
+        if growStep:
+            step *= 2
+        result = _try_pack(pack_func, get_size(fitted), verbose)
+
+    best = (get_size(fitted), result)
+    while fitted - failed > 1:
+        middle = (failed + fitted) / 2
+        result = _try_pack(pack_func, get_size(middle), verbose)
+        if result is None:
+            failed = middle
+        else:
+            fitted = middle
+            best = (get_size(middle), result)
+
+    return best
+
+
+def get_bin_shape_bounds(geometry, rotations=False):
+    # Returns (totalArea, minWidth, minHeight, longestEdgeSum), no bin narrower than minWidth or shorter than
+    # minHeight can hold the geometry.  A rotated texture only needs its shorter side to fit either way.
+    totalArea = 0
+    minWidth = 0
+    minHeight = 0
+    longestEdgeSum = 0
+
+    for (name, width, height) in geometry:
+        totalArea += width * height
+        longestEdgeSum += max(width, height)
+        if rotations:
+            minWidth = max(minWidth, min(width, height))
+            minHeight = max(minHeight, min(width, height))
+        else:
+            minWidth = max(minWidth, width)
+            minHeight = max(minHeight, height)
+
+    return (totalArea, minWidth, minHeight, longestEdgeSum)
+
+
+def _get_candidate_widths(minWidth, maxWidth, powerOfTwo):
+    # Powers of two, or about six widths per doubling, from minWidth up to the first one reaching maxWidth.
+    widths = []
+    width = round_up_power_of_two(minWidth) if powerOfTwo else minWidth
+    while True:
+        widths.append(width)
+        if width >= maxWidth:
+            break
+        width = width * 2 if powerOfTwo else min(maxWidth, max(width + 1, width * 9 / 8))
+    return widths
+
+
+def search_bin_shape(pack_func, geometry, min_size, widthPowerOfTwo, heightPowerOfTwo, verbose=True, upper_bound=0, rotations=False):
+    # pack_func(width, height) packs the geometry into a width x height bin and raises PackerError if it does
+    # not fit.  Every candidate width gets the shortest height it fits in and the smallest area wins.
+    # Returns ((width, height), pack_func result).
+    (totalArea, minWidth, minHeight, longestEdgeSum) = get_bin_shape_bounds(geometry, rotations)
+    minWidth = max(min_size, minWidth)
+    minHeight = max(min_size, minHeight)
+
+    # A single row of every texture is as wide as a bin ever needs to be.
+    maxWidth = max(minWidth, longestEdgeSum)
+    if upper_bound > 0:
+        maxWidth = min(maxWidth, upper_bound)
+    widths = [width for width in _get_candidate_widths(minWidth, maxWidth, widthPowerOfTwo) if width <= maxWidth]
+
+    # Widths close to a square holding the total area usually pack best, trying them first lets the
+    # bound from the best bin so far rule out more of the others.
+    target = max(1, integer_sqrt_ceil(totalArea))
+    widths.sort(key=lambda width: float(max(width, target)) / min(width, target))
+
+    # Bins are ranked by area and then by their longest side, so equal areas go to the squarer bin.
+    best = None
+    bestRank = (sys.maxint, sys.maxint)
+    for width in widths:
+        lowerHeight = max(minHeight, (totalArea + width - 1) / width)
+        if heightPowerOfTwo:
+            lowerHeight = round_up_power_of_two(lowerHeight)
+        if (width * lowerHeight, max(width, lowerHeight)) >= bestRank:
+            continue
+
+        # Only heights making a bin no bigger than the best so far are worth packing.
+        heightLimit = upper_bound
+        if best is not None:
+            heightLimit = bestRank[0] / width
+            if upper_bound > 0:
+                heightLimit = min(heightLimit, upper_bound)
+
+        try:
+            (height, result) = search_bin_size(lambda height: pack_func(width, height), lowerHeight, heightPowerOfTwo, False, heightLimit)
+        except PackerError:
+            continue
+
+        rank = (width * height, max(width, height))
+        if rank < bestRank:
+            if verbose:
+                print "Fitted in bin shape %dx%d" % (width, height)
+            best = ((width, height), result)
+            bestRank = rank
+
+    if best is None:
+        raise PackerError('Failed to fit in any bin shape')
+    return best
+
+
+def search_bin(pack_func, geometry, min_size, size_search, verbose=True, upper_bound=0, rotations=False):
+    # pack_func(width, height) packs the geometry into a width x height bin and raises PackerError if it does
+    # not fit.  Searches the bin shapes size_search allows, no side shorter than min_size or, when positive,
+    # longer than upper_bound.  Returns ((width, height), pack_func result) for the smallest bin found.
+    if size_search.shape == 'rect':
+        return search_bin_shape(pack_func, geometry, min_size, size_search.width_power_of_two, size_search.height_power_of_two, verbose, upper_bound, rotations)
+
+    lower_bound = max(min_size, get_bin_size_lower_bound(geometry))
+    (size, result) = search_bin_size(lambda size: pack_func(size, size), lower_bound, size_search.width_power_of_two, verbose, upper_bound)
+    return ((size, size), result)
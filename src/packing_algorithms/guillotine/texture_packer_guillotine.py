@@ -0,0 +1,226 @@
+import sys
+
+from packing_algorithms.texture_packer import TexturePacker
+from packing_algorithms.texture_packer import PackerError
+from maths.rect import Rect
+
+
+class GuillotineChoiceHeuristicEnum:
+    (RectBestAreaFit, RectBestShortSideFit, RectBestLongSideFit) = range(0, 3)
+
+
+class GuillotineSplitHeuristicEnum:
+    (SplitShorterLeftoverAxis, SplitLongerLeftoverAxis, SplitMinimizeArea, SplitMaximizeArea) = range(0, 4)
+
+
+class TexturePackerGuillotine(TexturePacker):
+    # Places each texture in the top left corner of a free rectangle and cuts what is left of that rectangle
+    # in two with a single straight cut, so the free rectangles never overlap and every texture adds just one
+    # more of them.  Python implementation of GuillotineBinPack from https://github.com/juj/RectangleBinPack.
+    used_rect_list = None
+    free_rects = None
+    free_rect_ids = None
+    size_buckets = None
+    free_rect_edges = None
+    next_id = 0
+    bin_width = 0
+    bin_height = 0
+    used_surface_area = 0
+    heuristic = GuillotineChoiceHeuristicEnum.RectBestAreaFit
+    split_heuristic = GuillotineSplitHeuristicEnum.SplitShorterLeftoverAxis
+    merge = False
+
+    def __init__(self, method, split_method, width=0, height=0, merge=False):
+        TexturePacker.__init__(self)
+        self.used_rect_list = []
+        self.free_rects = {}
+        self.free_rect_ids = {}
+        self.size_buckets = {}
+        self.next_id = 0
+        self.bin_width = width
+        self.bin_height = height
+        self.used_surface_area = 0
+        self.heuristic = method
+        self.split_heuristic = split_method
+        self.merge = merge
+
+        # Merging looks free rectangles up by the edge they would share with a neighbour.  The free
+        # rectangles never overlap, so no two of them have the same edge on the same side.
+        if merge:
+            self.free_rect_edges = ({}, {}, {}, {})
+
+        self._add_free_rect(Rect.InitWithDim(0, 0, self.bin_width, self.bin_height))
+
+    def get_occupancy(self):
+        return float(self.used_surface_area) / (self.bin_width * self.bin_height)
+
+    def get_free_rects(self):
+        return [self.free_rects[rect_id] for rect_id in sorted(self.free_rects.keys())]
+
+    def get_free_rect_count(self):
+        return len(self.free_rects)
+
+    def add_texture(self, width, height, name):
+        TexturePacker.add_texture(self, width, height, name)
+
+        (free_rect, node) = self._find_position_for_new_node(width, height)
+        if node is None:
+            raise PackerError('Failed to fit in %s' % (name))
+
+        self._remove_free_rect(free_rect)
+        self._split_free_rect(free_rect, node)
+
+        self.used_rect_list.append(node)
+        self.used_surface_area += node.get_area()
+        return node
+
+    def pack_textures(self, powerOfTwo, oneBorderPixel):
+        i = 0
+
+        for rect in self.used_rect_list:
+            tex = self.texArr[i]
+            flipped = tex.width != rect.get_width() or tex.height != rect.get_height()
+            tex.place_texture(rect.x1, rect.y1, flipped)
+            i += 1
+
+        return (self.bin_width, self.bin_height, 0)
+
+    def _find_position_for_new_node(self, width, height):
+        # Returns (free_rect, node) for the free rectangle with the best score, lower is better, and the
+        # oldest free rectangle wins a tie.
+        orientations = [(width, height)]
+        if self.allow_rotations:
+            orientations.append((height, width))
+
+        # The free rectangles are bucketed by the bit length of their sides.  Every score grows with the
+        # size of the free rectangle, so scoring a bucket's smallest possible rectangle gives a bound on
+        # the scores inside it, and buckets are searched best bound first until none can beat the best.
+        candidates = []
+        for (bucket, ids) in self.size_buckets.items():
+            minWidth = 1 << (bucket[0] - 1)
+            minHeight = 1 << (bucket[1] - 1)
+            bound = None
+            for (rectWidth, rectHeight) in orientations:
+                if rectWidth < (1 << bucket[0]) and rectHeight < (1 << bucket[1]):
+                    score = self._score_free_rect(max(minWidth, rectWidth), max(minHeight, rectHeight), rectWidth, rectHeight)
+                    if bound is None or score < bound:
+                        bound = score
+            if bound is not None:
+                candidates.append((bound, ids))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        best = None
+        bestRect = None
+        bestNode = None
+        for (bound, ids) in candidates:
+            if best is not None and bound > best[:2]:
+                break
+            for rect_id in ids:
+                rect = self.free_rects[rect_id]
+                freeWidth = rect.x2 - rect.x1
+                freeHeight = rect.y2 - rect.y1
+                for (rectWidth, rectHeight) in orientations:
+                    if rectWidth <= freeWidth and rectHeight <= freeHeight:
+                        score = self._score_free_rect(freeWidth, freeHeight, rectWidth, rectHeight) + (rect_id,)
+                        if best is None or score < best:
+                            best = score
+                            bestRect = rect
+                            bestNode = Rect.InitWithDim(rect.x1, rect.y1, rectWidth, rectHeight)
+
+        return (bestRect, bestNode)
+
+    def _score_free_rect(self, freeWidth, freeHeight, width, height):
+        leftoverHoriz = freeWidth - width
+        leftoverVert = freeHeight - height
+
+        if self.heuristic == GuillotineChoiceHeuristicEnum.RectBestAreaFit:
+            return (freeWidth * freeHeight - width * height, min(leftoverHoriz, leftoverVert))
+        elif self.heuristic == GuillotineChoiceHeuristicEnum.RectBestShortSideFit:
+            return (min(leftoverHoriz, leftoverVert), max(leftoverHoriz, leftoverVert))
+        elif self.heuristic == GuillotineChoiceHeuristicEnum.RectBestLongSideFit:
+            return (max(leftoverHoriz, leftoverVert), min(leftoverHoriz, leftoverVert))
+        else:
+            raise NotImplementedError('Unknown Guillotine Heuristic encountered')
+
+    def _split_free_rect(self, free_rect, placed_rect):
+        placedWidth = placed_rect.get_width()
+        placedHeight = placed_rect.get_height()
+        leftoverWidth = free_rect.get_width() - placedWidth
+        leftoverHeight = free_rect.get_height() - placedHeight
+
+        # A horizontal cut runs the full width of the free rectangle below the texture, a vertical one
+        # runs its full height right of the texture.
+        if self.split_heuristic == GuillotineSplitHeuristicEnum.SplitShorterLeftoverAxis:
+            splitHorizontal = leftoverWidth <= leftoverHeight
+        elif self.split_heuristic == GuillotineSplitHeuristicEnum.SplitLongerLeftoverAxis:
+            splitHorizontal = leftoverWidth > leftoverHeight
+        elif self.split_heuristic == GuillotineSplitHeuristicEnum.SplitMinimizeArea:
+            splitHorizontal = placedWidth * leftoverHeight > leftoverWidth * placedHeight
+        elif self.split_heuristic == GuillotineSplitHeuristicEnum.SplitMaximizeArea:
+            splitHorizontal = placedWidth * leftoverHeight <= leftoverWidth * placedHeight
+        else:
+            raise NotImplementedError('Unknown Guillotine Split Heuristic encountered')
+
+        if splitHorizontal:
+            bottom = Rect(free_rect.x1, placed_rect.y2, free_rect.x2, free_rect.y2)
+            right = Rect(placed_rect.x2, free_rect.y1, free_rect.x2, placed_rect.y2)
+        else:
+            bottom = Rect(free_rect.x1, placed_rect.y2, placed_rect.x2, free_rect.y2)
+            right = Rect(placed_rect.x2, free_rect.y1, free_rect.x2, free_rect.y2)
+
+        if bottom.get_width() > 0 and bottom.get_height() > 0:
+            self._add_free_rect(bottom)
+        if right.get_width() > 0 and right.get_height() > 0:
+            self._add_free_rect(right)
+
+    def _add_free_rect(self, rect):
+        if self.merge:
+            rect = self._merge_free_rect(rect)
+            (tops, bottoms, lefts, rights) = self.free_rect_edges
+            tops[(rect.x1, rect.x2, rect.y1)] = rect
+            bottoms[(rect.x1, rect.x2, rect.y2)] = rect
+            lefts[(rect.y1, rect.y2, rect.x1)] = rect
+            rights[(rect.y1, rect.y2, rect.x2)] = rect
+
+        rect_id = self.next_id
+        self.next_id += 1
+        self.free_rects[rect_id] = rect
+        self.free_rect_ids[rect] = rect_id
+        self.size_buckets.setdefault(self._get_bucket(rect), set()).add(rect_id)
+
+    def _remove_free_rect(self, rect):
+        rect_id = self.free_rect_ids.pop(rect)
+        del self.free_rects[rect_id]
+        bucket = self._get_bucket(rect)
+        self.size_buckets[bucket].discard(rect_id)
+        if not self.size_buckets[bucket]:
+            del self.size_buckets[bucket]
+
+        if self.merge:
+            (tops, bottoms, lefts, rights) = self.free_rect_edges
+            del tops[(rect.x1, rect.x2, rect.y1)]
+            del bottoms[(rect.x1, rect.x2, rect.y2)]
+            del lefts[(rect.y1, rect.y2, rect.x1)]
+            del rights[(rect.y1, rect.y2, rect.x2)]
+
+    def _merge_free_rect(self, rect):
+        # Joins rect with every free neighbour sharing a whole edge with it, and with the neighbours of
+        # the result in turn, and returns what it grew into.  The free list stayed merged after the last
+        # texture, so only the new rectangles have anything to merge with.
+        neighbour = self._find_free_neighbour(rect)
+        while neighbour is not None:
+            self._remove_free_rect(neighbour)
+            rect = Rect(min(rect.x1, neighbour.x1), min(rect.y1, neighbour.y1), max(rect.x2, neighbour.x2), max(rect.y2, neighbour.y2))
+            neighbour = self._find_free_neighbour(rect)
+        return rect
+
+    def _find_free_neighbour(self, rect):
+        (tops, bottoms, lefts, rights) = self.free_rect_edges
+        for (edges, edge) in ((tops, (rect.x1, rect.x2, rect.y2)), (bottoms, (rect.x1, rect.x2, rect.y1)), (lefts, (rect.y1, rect.y2, rect.x2)), (rights, (rect.y1, rect.y2, rect.x1))):
+            neighbour = edges.get(edge)
+            if neighbour is not None:
+                return neighbour
+        return None
+
+    def _get_bucket(self, rect):
+        return (rect.get_width().bit_length(), rect.get_height().bit_length())
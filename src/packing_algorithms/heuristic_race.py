@@ -0,0 +1,133 @@
+import threading
+import multiprocessing
+import traceback
+
+from packing_algorithms.texture_packer import PackerError
+from packing_algorithms.bin_size import search_bin
+from util.utils import get_packer
+
+HEURISTICS = ('shortside', 'longside', 'area', 'bottomleft', 'contactpoint')
+ROTATIONS = (False, True)
+
+# Keys the geometry is sorted on, biggest first, before each variant is packed.
+SORT_ORDERS = (
+    ('area', lambda (name, width, height): width * height),
+    ('maxside', lambda (name, width, height): max(width, height)),
+    ('perimeter', lambda (name, width, height): width + height),
+)
+
+
+class PackingVariant:
+    heuristic = ''
+    allow_rotations = False
+    sort_order = ''
+
+    def __init__(self, heuristic, allow_rotations, sort_order):
+        self.heuristic = heuristic
+        self.allow_rotations = allow_rotations
+        self.sort_order = sort_order
+
+    def __str__(self):
+        return '%s, rotations %s, sorted by %s' % (self.heuristic, 'on' if self.allow_rotations else 'off', self.sort_order)
+
+
+def get_packing_variants():
+    variants = []
+    for heuristic in HEURISTICS:
+        for allow_rotations in ROTATIONS:
+            for (sort_order, sort_key) in SORT_ORDERS:
+                variants.append(PackingVariant(heuristic, allow_rotations, sort_order))
+    return variants
+
+
+def sort_geometry(geometry, sort_order):
+    # Python's sort is stable, so equal keys keep the directory order.
+    for (name, sort_key) in SORT_ORDERS:
+        if name == sort_order:
+            return sorted(geometry, key=sort_key, reverse=True)
+    raise NotImplementedError('Unknown sort order encountered %s' % sort_order)
+
+
+def pack_variant(geometry, variant, width, height, packer_options):
+    # packer_options is the (use_index, backend, batch) tuple handed on to get_packer.
+    texture_packer = get_packer('maxrects', width, variant.heuristic, *packer_options, height=height)
+    texture_packer.allow_rotations = variant.allow_rotations
+    texture_packer.add_textures(sort_geometry(geometry, variant.sort_order))
+    return (texture_packer, texture_packer.pack_textures(True, True))
+
+
+def race_variant_job(job):
+    # Runs in a pool worker, failures are handed back to the parent instead of being raised.
+    (index, geometry, variant, min_size, size_search, packer_options, upper_bound) = job
+    try:
+        pack_func = lambda width, height: pack_variant(geometry, variant, width, height, packer_options)
+        result = search_bin(pack_func, geometry, min_size, size_search, False, upper_bound, variant.allow_rotations)[1]
+        return (index, result, None)
+    except PackerError:
+        # Did not fit in the maximum bin size, which is not a failure of the variant.
+        return (index, None, None)
+    except Exception:
+        return (index, None, traceback.format_exc())
+
+
+def _get_used_area(texture_packer):
+    # The area of the bounding box of the placed textures.  Every finished variant places every texture, so
+    # their occupancy of a bin of the same size is the same, but the space they leave free in one piece along
+    # the right and bottom edges is not.  A flipped texture covers height x width.
+    right = 0
+    bottom = 0
+    for tex in texture_packer.texArr:
+        (width, height) = (tex.height, tex.width) if tex.flipped else (tex.width, tex.height)
+        right = max(right, tex.x + width)
+        bottom = max(bottom, tex.y + height)
+    return right * bottom
+
+
+def _get_rank(variant_result):
+    # Smallest bin first, then the smallest bounding box of the placed textures, then the first variant listed.
+    (index, (texture_packer, packResult)) = variant_result
+    return (packResult[0] * packResult[1], _get_used_area(texture_packer), index)
+
+
+def race_packing_variants(geometry, min_size, size_search, packer_options, numProcesses=0, upper_bound=0, pool=None):
+    # Packs the geometry with every variant and returns (variant, (texture_packer, packResult)) for the best.
+    # The variants run side by side on pool, or on a pool of numProcesses started for the race, so the race
+    # takes about as long as the slowest of them.  Raises PackerError if no variant fits in an upper_bound
+    # sized bin.
+    variants = get_packing_variants()
+    jobs = [(index, geometry, variant, min_size, size_search, packer_options, upper_bound) for (index, variant) in enumerate(variants)]
+
+    if numProcesses <= 0:
+        numProcesses = multiprocessing.cpu_count()
+
+    # The contact point variants are by far the slowest, start them first.
+    jobs.sort(key=lambda job: job[2].heuristic != 'contactpoint')
+
+    # Pool workers are daemonic and may not start pools of their own, so an atlas that is already being
+    # built in a worker (--jobs) races its variants in turn.  Neither is a pool started off the main thread,
+    # forking while other threads run is not safe.
+    if pool is not None:
+        results = list(pool.imap_unordered(race_variant_job, jobs, 1))
+    elif numProcesses == 1 or multiprocessing.current_process().daemon or threading.current_thread().name != 'MainThread':
+        results = [race_variant_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(min(numProcesses, len(jobs)))
+        try:
+            results = list(pool.imap_unordered(race_variant_job, jobs, 1))
+        finally:
+            pool.close()
+            pool.join()
+
+    finished = []
+    for (index, result, error) in results:
+        if error is not None:
+            print "ERROR: Packing variant failed:", variants[index]
+            print error
+        elif result is not None:
+            finished.append((index, result))
+
+    if not finished:
+        raise PackerError('Every packing variant failed or did not fit')
+
+    best = min(finished, key=_get_rank)
+    return (variants[best[0]], best[1])
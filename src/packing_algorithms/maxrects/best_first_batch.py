@@ -0,0 +1,225 @@
+import sys
+import heapq
+import bisect
+
+from packing_algorithms.texture_packer import TexturePacker
+from packing_algorithms.texture_packer import PackerError
+from maths.rect import Rect
+
+
+def get_rect_key(rect):
+    return (rect.x1, rect.y1, rect.x2, rect.y2)
+
+
+class BestFirstBatch:
+    # Places a batch of textures into a TexturePackerMaxRects, each round placing the remaining texture whose
+    # best position scores best (RectangleBinPack's Insert(vector)).  Ties go to the texture added first.
+    #
+    # Textures of the same size share a cache of their best scoring positions, sorted by (score1, score2,
+    # free list order, flipped) which is the order the find position loops prefer them in.  A full scan of
+    # the free list only keeps the best CANDIDATE_COUNT positions and remembers the worst one kept as the
+    # bound, every position left out scores worse.  Placing a texture removes the free rectangles it
+    # overlaps and appends new ones after the rest without changing the others, so each round only drops
+    # the dead positions from the caches and scores the new free rectangles for the sizes that fit in them.
+    # A size only has to scan the whole free list again once all of its cached positions are gone.
+    # The contact point scores change with the used rectangles, so that heuristic rescans every size.
+    packer = None
+    pending = None
+    candidates = None
+    bounds = None
+    sizes_by_free_rect = None
+    free_sequences = None
+    next_sequence = 0
+    versions = None
+    heap = None
+    sizes_by_width = None
+    sizes_by_height = None
+
+    CANDIDATE_COUNT = 16
+
+    def __init__(self, packer, geometry):
+        self.packer = packer
+        self.pending = {}
+        self.candidates = {}
+        self.bounds = {}
+        self.sizes_by_free_rect = {}
+        self.free_sequences = {}
+        self.next_sequence = 0
+        self.versions = {}
+        self.heap = []
+
+        for (index, (name, width, height)) in enumerate(geometry):
+            self.pending.setdefault((width, height), []).append((index, name))
+
+        self.sizes_by_width = sorted(self.pending.keys())
+        self.sizes_by_height = sorted([(height, width) for (width, height) in self.pending.keys()])
+
+    def run(self):
+        free_rects = self._add_free_rects(self.packer.get_free_rects())
+        for size in self.pending:
+            self._rescan(size, free_rects)
+            self._update_best(size)
+
+        while self.pending:
+            size = self._pop_best_size()
+            if size is None:
+                first = min([textures[0] for textures in self.pending.values()])
+                raise PackerError('Failed to fit in %s' % (first[1]))
+
+            (index, name) = self.pending[size].pop(0)
+            (score1, score2, sequence, flipped, key) = self.candidates[size][0]
+            (width, height) = size
+            if flipped:
+                node = Rect.InitWithDim(key[0], key[1], height, width)
+            else:
+                node = Rect.InitWithDim(key[0], key[1], width, height)
+
+            # Textures are recorded in placement order to line up with the used rect list.
+            TexturePacker.add_texture(self.packer, width, height, name)
+            self.packer._place_rect(node)
+
+            if not self.pending[size]:
+                del self.pending[size]
+                del self.candidates[size]
+                del self.bounds[size]
+            self._update_scores()
+
+    def _update_scores(self):
+        rects = self.packer.get_free_rects()
+        keys = [get_rect_key(rect) for rect in rects]
+        alive = set(keys)
+
+        removed = [key for key in self.free_sequences if key not in alive]
+        for key in removed:
+            del self.free_sequences[key]
+        new_rects = self._add_free_rects([rect for (key, rect) in zip(keys, rects) if key not in self.free_sequences])
+        free_rects = [(rect, key, self.free_sequences[key]) for (key, rect) in zip(keys, rects)]
+
+        if self.packer.uses_contact_point():
+            for size in self.pending:
+                self._rescan(size, free_rects)
+                self._update_best(size)
+            return
+
+        # Drop the dead positions from the front of the caches whose best free rectangle was removed.
+        changed = set()
+        rescanned = set()
+        for key in removed:
+            for size in self.sizes_by_free_rect.pop(key, ()):
+                if size not in self.pending:
+                    continue
+                changed.add(size)
+                candidates = self.candidates[size]
+                while candidates and not self._is_alive(candidates[0]):
+                    candidates.pop(0)
+                if not candidates and self.bounds[size] is not None:
+                    self._rescan(size, free_rects)
+                    rescanned.add(size)
+
+        for free_rect in new_rects:
+            for size in self._get_sizes_fitting(free_rect[0]):
+                if size in self.pending and size not in rescanned:
+                    if self._add_candidates(size, free_rect):
+                        changed.add(size)
+
+        for size in changed:
+            if size in self.pending:
+                self._update_best(size)
+
+    def _add_free_rects(self, rects):
+        # Free rectangles are numbered in free list order, the number breaks ties between equal scores.
+        # Returns them as the (rect, key, sequence) tuples the candidates are scored from.
+        free_rects = []
+        for rect in rects:
+            key = get_rect_key(rect)
+            self.free_sequences[key] = self.next_sequence
+            free_rects.append((rect, key, self.next_sequence))
+            self.next_sequence += 1
+        return free_rects
+
+    def _is_alive(self, candidate):
+        return self.free_sequences.get(candidate[4]) == candidate[2]
+
+    def _get_candidates(self, size, free_rect):
+        (rect, key, sequence) = free_rect
+        candidates = []
+        for flipped in ((False, True) if self.packer.allow_rotations else (False,)):
+            (width, height) = (size[1], size[0]) if flipped else size
+            if rect.get_width() >= width and rect.get_height() >= height:
+                (score1, score2) = self.packer._score_free_rect(rect, width, height)
+                candidates.append((score1, score2, sequence, flipped, key))
+        return candidates
+
+    def _rescan(self, size, free_rects):
+        # Most free rectangles are slivers, skip the ones too narrow for either orientation up front.
+        shortestEdge = min(size)
+        candidates = []
+        for free_rect in free_rects:
+            if free_rect[0].get_width() >= shortestEdge and free_rect[0].get_height() >= shortestEdge:
+                candidates.extend(self._get_candidates(size, free_rect))
+
+        if len(candidates) > self.CANDIDATE_COUNT:
+            candidates = heapq.nsmallest(self.CANDIDATE_COUNT, candidates)
+            self.bounds[size] = candidates[-1]
+        else:
+            candidates.sort()
+            self.bounds[size] = None
+        self.candidates[size] = candidates
+
+    def _add_candidates(self, size, free_rect):
+        # Returns True if the best position of the size changed.
+        candidates = self.candidates[size]
+        bound = self.bounds[size]
+        changed = False
+        for candidate in self._get_candidates(size, free_rect):
+            if bound is None or candidate < bound:
+                bisect.insort(candidates, candidate)
+                changed = changed or candidates[0] is candidate
+
+        # Trim the cache back down to its live positions, tightening the bound to the worst position kept.
+        if len(candidates) > 2 * self.CANDIDATE_COUNT:
+            candidates[:] = [candidate for candidate in candidates if self._is_alive(candidate)]
+            if len(candidates) > self.CANDIDATE_COUNT:
+                del candidates[self.CANDIDATE_COUNT:]
+                self.bounds[size] = candidates[-1]
+        return changed
+
+    def _update_best(self, size):
+        candidates = self.candidates[size]
+        if candidates:
+            self.sizes_by_free_rect.setdefault(candidates[0][4], set()).add(size)
+        self._push(size)
+
+    def _push(self, size):
+        # Stale heap entries are skipped when popped, the version tells them apart.
+        version = self.versions.get(size, 0) + 1
+        self.versions[size] = version
+        candidates = self.candidates[size]
+        if candidates:
+            heapq.heappush(self.heap, (candidates[0][0], candidates[0][1], self.pending[size][0][0], version, size))
+
+    def _pop_best_size(self):
+        while self.heap:
+            (score1, score2, index, version, size) = heapq.heappop(self.heap)
+            if size not in self.pending or self.versions[size] != version:
+                continue
+            if self.pending[size][0][0] != index:
+                # The first texture of this size has been placed since, queue the next one.
+                self._push(size)
+                continue
+            return size
+        return None
+
+    def _get_sizes_fitting(self, rect):
+        sizes = self._get_sizes_within(rect.get_width(), rect.get_height())
+        if self.packer.allow_rotations:
+            sizes.update(self._get_sizes_within(rect.get_height(), rect.get_width()))
+        return sizes
+
+    def _get_sizes_within(self, width, height):
+        # Take the shorter of the two sorted prefixes and filter it on the other axis.
+        widthEnd = bisect.bisect_right(self.sizes_by_width, (width, sys.maxint))
+        heightEnd = bisect.bisect_right(self.sizes_by_height, (height, sys.maxint))
+        if widthEnd <= heightEnd:
+            return set([size for size in self.sizes_by_width[:widthEnd] if size[1] <= height])
+        return set([(size[1], size[0]) for size in self.sizes_by_height[:heightEnd] if size[1] <= width])
@@ -0,0 +1,179 @@
+import bisect
+
+
+class FreeRectIndex:
+    # Indexes the maxrects free rectangles twice.
+    #   - A uniform grid over the bin, each rectangle is listed in every cell it covers, so the free
+    #     rectangles overlapping a placed rect can be found without scanning the whole free list.
+    #   - Sorted by width, height, area and top edge, in size buckets keyed by the bit length of the width
+    #     and height, for find_best.  Buckets too small for the texture are skipped whole.  In each of the
+    #     others a placement heuristic walks the orders its score grows with from the first rectangle big
+    #     enough and stops as soon as the key shows nothing further on can beat the best placement found, so
+    #     it only looks at the few rectangles near the best one of each bucket rather than at every rectangle
+    #     the texture fits in.
+    # Every rectangle is numbered as it is added, the sets hold these numbers rather than the rectangles
+    # and results come back sorted by them.  That is free list order, which keeps the heuristic tie
+    # breaking identical to the unindexed packer.
+    cell_size = 0
+    cells = None
+    orders = None
+    rects = None
+    ids = None
+    next_id = 0
+
+    def __init__(self, bin_width, bin_height, cell_size=0):
+        if cell_size <= 0:
+            cell_size = max(32, max(bin_width, bin_height) / 16)
+        self.cell_size = cell_size
+        self.cells = {}
+        self.orders = {'width': {}, 'height': {}, 'area': {}, 'top': {}}
+        self.rects = {}
+        self.ids = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.rects)
+
+    def add(self, rect):
+        rect_id = self.next_id
+        self.next_id += 1
+        self.rects[rect_id] = rect
+        self.ids[rect] = rect_id
+
+        for cell in self._get_cells(rect.x1, rect.y1, rect.x2, rect.y2):
+            self.cells.setdefault(cell, set()).add(rect_id)
+        bucket = self._get_bucket(rect)
+        for (order, key) in self._get_keys(rect):
+            bisect.insort(self.orders[order].setdefault(bucket, []), (key, rect_id))
+
+    def remove(self, rect):
+        rect_id = self.ids.pop(rect)
+        del self.rects[rect_id]
+
+        for cell in self._get_cells(rect.x1, rect.y1, rect.x2, rect.y2):
+            ids = self.cells[cell]
+            ids.discard(rect_id)
+            if not ids:
+                del self.cells[cell]
+
+        bucket = self._get_bucket(rect)
+        for (order, key) in self._get_keys(rect):
+            keys = self.orders[order][bucket]
+            del keys[bisect.bisect_left(keys, (key, rect_id))]
+            if not keys:
+                del self.orders[order][bucket]
+
+    def get_rects(self):
+        return self._get_sorted(self.rects.keys())
+
+    def get_overlapping(self, rect):
+        # Free rectangles sharing some area with rect.
+        found = set()
+        for cell in self._get_cells(rect.x1, rect.y1, rect.x2, rect.y2):
+            found.update(self.cells.get(cell, ()))
+
+        overlapping = []
+        for rect_id in found:
+            free_rect = self.rects[rect_id]
+            if rect.x1 < free_rect.x2 and rect.x2 > free_rect.x1 and rect.y1 < free_rect.y2 and rect.y2 > free_rect.y1:
+                overlapping.append(rect_id)
+        return self._get_sorted(overlapping)
+
+    def get_containing(self, rect):
+        # Anything containing rect also covers its top left corner, so a single cell holds every candidate.
+        cell = (rect.x1 / self.cell_size, rect.y1 / self.cell_size)
+        containing = []
+        for rect_id in self.cells.get(cell, ()):
+            if rect.contains(self.rects[rect_id]):
+                containing.append(self.rects[rect_id])
+        return containing
+
+    def get_fitting(self, width, height, allow_rotations=False):
+        # Free rectangles that can hold a width x height texture upright or, if allowed, rotated, in free list
+        # order.
+        found = self._get_fitting(width, height)
+        if allow_rotations:
+            found.update(self._get_fitting(height, width))
+        return self._get_sorted(found)
+
+    def find_best(self, width, height, allow_rotations, orders, score):
+        # Returns (rect, flipped, scores) for the best placement of a width x height texture at the top left
+        # of a free rectangle, or None if it fits nowhere.  score(rect, width, height) gives the scores of a
+        # placement as a tuple, lower being better, ties going to the earlier rectangle and then to the upright
+        # texture as they do in the packer's loops.  orders names the orders to walk, what one of them says of
+        # a placement (see _get_walk) must be no more than its first score for at least one of them: 'width'
+        # and 'height' give the leftover on that side, 'area' the leftover area and 'top' the top side y.
+        best = None
+        orientations = [(width, height, False)]
+        if allow_rotations:
+            orientations.append((height, width, True))
+
+        for (rectWidth, rectHeight, flipped) in orientations:
+            minWidthBucket = self._get_bucket_edge(rectWidth)
+            minHeightBucket = self._get_bucket_edge(rectHeight)
+            for order in orders:
+                (firstKey, offset) = self._get_walk(order, rectWidth, rectHeight)
+                for (bucket, keys) in self.orders[order].items():
+                    if bucket[0] < minWidthBucket or bucket[1] < minHeightBucket:
+                        continue
+                    for i in xrange(bisect.bisect_left(keys, (firstKey,)), len(keys)):
+                        (key, rect_id) = keys[i]
+                        if best is not None and key + offset > best[0][0]:
+                            break
+                        rect = self.rects[rect_id]
+                        if rect.x2 - rect.x1 >= rectWidth and rect.y2 - rect.y1 >= rectHeight:
+                            candidate = (score(rect, rectWidth, rectHeight), rect_id, flipped)
+                            if best is None or candidate < best:
+                                best = candidate
+
+        if best is None:
+            return None
+        return (self.rects[best[1]], best[2], best[0])
+
+    def _get_walk(self, order, width, height):
+        # Returns (firstKey, offset) to walk an order for a width x height placement: the smallest key of a
+        # rectangle it can fit in and what to add to a key for what the order says of a placement in that
+        # rectangle, which any rectangle after it only raises.
+        if order == 'width':
+            return (width, -width)
+        elif order == 'height':
+            return (height, -height)
+        elif order == 'area':
+            return (width * height, -width * height)
+        elif order == 'top':
+            return (0, height)
+        else:
+            raise NotImplementedError('Unknown free rectangle order %s' % order)
+
+    def _get_fitting(self, width, height):
+        minWidthBucket = self._get_bucket_edge(width)
+        minHeightBucket = self._get_bucket_edge(height)
+
+        found = set()
+        for (bucket, keys) in self.orders['width'].items():
+            if bucket[0] < minWidthBucket or bucket[1] < minHeightBucket:
+                continue
+            for i in xrange(bisect.bisect_left(keys, (width,)), len(keys)):
+                rect = self.rects[keys[i][1]]
+                if rect.y2 - rect.y1 >= height:
+                    found.add(keys[i][1])
+        return found
+
+    def _get_sorted(self, ids):
+        return [self.rects[rect_id] for rect_id in sorted(ids)]
+
+    def _get_cells(self, x1, y1, x2, y2):
+        cells = []
+        for cellY in range(y1 / self.cell_size, (max(y1, y2 - 1) / self.cell_size) + 1):
+            for cellX in range(x1 / self.cell_size, (max(x1, x2 - 1) / self.cell_size) + 1):
+                cells.append((cellX, cellY))
+        return cells
+
+    def _get_bucket(self, rect):
+        return (self._get_bucket_edge(rect.get_width()), self._get_bucket_edge(rect.get_height()))
+
+    def _get_bucket_edge(self, edge):
+        return max(edge, 1).bit_length()
+
+    def _get_keys(self, rect):
+        return (('width', rect.x2 - rect.x1), ('height', rect.y2 - rect.y1), ('area', (rect.x2 - rect.x1) * (rect.y2 - rect.y1)), ('top', rect.y1))
@@ -2,8 +2,10 @@ import sys
 
 from packing_algorithms.texture_packer import TexturePacker
 from packing_algorithms.texture_packer import PackerError
-from math.rect import Rect
-from math.math import common_interval_length
+from maths.rect import Rect
+from packing_algorithms.maxrects.free_rect_index import FreeRectIndex
+from packing_algorithms.maxrects.used_edge_index import UsedEdgeIndex
+from packing_algorithms.maxrects.best_first_batch import BestFirstBatch
 
 
 class FreeRectChoiceHeuristicEnum:
@@ -13,18 +15,31 @@ class FreeRectChoiceHeuristicEnum:
 class TexturePackerMaxRects(TexturePacker):
     used_rect_list = None
     free_rect_list = None
+    new_free_rect_list = None
+    free_rect_index = None
+    used_edge_index = None
     bin_width = 0
     bin_height = 0
     heuristic = FreeRectChoiceHeuristicEnum.RectBestShortSideFit
+    batch = False
 
-    def __init__(self, method, width=0, height=0):
+    def __init__(self, method, width=0, height=0, use_index=False, batch=False):
         TexturePacker.__init__(self)
         self.used_rect_list = []
         self.free_rect_list = []
+        self.new_free_rect_list = []
+        self.used_edge_index = UsedEdgeIndex()
         self.bin_width = width
         self.bin_height = height
-        self.free_rect_list.append(Rect.InitWithDim(0, 0, self.bin_width, self.bin_height))
         self.heuristic = method
+        self.batch = batch
+
+        # The spatial index replaces the free list when enabled.
+        if use_index:
+            self.free_rect_index = FreeRectIndex(self.bin_width, self.bin_height)
+            self.free_rect_index.add(Rect.InitWithDim(0, 0, self.bin_width, self.bin_height))
+        else:
+            self.free_rect_list.append(Rect.InitWithDim(0, 0, self.bin_width, self.bin_height))
 
     def get_occupancy(self):
         usedSurfaceArea = 0
@@ -34,6 +49,26 @@ class TexturePackerMaxRects(TexturePacker):
 
         return float(usedSurfaceArea) / self._get_bin_area()
 
+    def get_free_rects(self):
+        if self.free_rect_index is not None:
+            return self.free_rect_index.get_rects()
+        return self.free_rect_list
+
+    def get_free_rect_count(self):
+        if self.free_rect_index is not None:
+            return len(self.free_rect_index)
+        return len(self.free_rect_list)
+
+    def uses_contact_point(self):
+        return self.heuristic == FreeRectChoiceHeuristicEnum.RectContactPointRule
+
+    def add_textures(self, geometry):
+        # In batch mode every round places whichever remaining texture has the best score, see BestFirstBatch.
+        if self.batch:
+            BestFirstBatch(self, geometry).run()
+        else:
+            TexturePacker.add_textures(self, geometry)
+
     def add_texture(self, width, height, name):
         TexturePacker.add_texture(self, width, height, name)
         result = None
@@ -70,7 +105,9 @@ class TexturePackerMaxRects(TexturePacker):
         i = 0
 
         for rect in self.used_rect_list:
-            self.texArr[i].place_texture(rect.x1, rect.y1)
+            tex = self.texArr[i]
+            flipped = tex.width != rect.get_width() or tex.height != rect.get_height()
+            tex.place_texture(rect.x1, rect.y1, flipped)
             i += 1
 
         return (self.bin_width, self.bin_height, 0)
@@ -89,59 +126,118 @@ class TexturePackerMaxRects(TexturePacker):
             score2 = result[2]
         elif self.heuristic == FreeRectChoiceHeuristicEnum.RectBestLongSideFit:
             result = self._find_position_for_new_node_best_long_side_fit(width, height)
-            #TODO: Is score order here correct??
-            score2 = result[1]
             score1 = result[2]
+            score2 = result[1]
         elif self.heuristic == FreeRectChoiceHeuristicEnum.RectBestAreaFit:
             result = self._find_position_for_new_node_best_area_fit(width, height)
             score1 = result[1]
             score2 = result[2]
         elif self.heuristic == FreeRectChoiceHeuristicEnum.RectBottomLeftRule:
             result = self._find_position_for_new_node_bottom_left(width, height)
-            score1 = result[1]
-            score2 = result[2]
+            # The bottom left rule compares the top side Y first and then X.
+            score1 = result[2]
+            score2 = result[1]
         elif self.heuristic == FreeRectChoiceHeuristicEnum.RectContactPointRule:
             result = self._find_position_for_new_node_contact_point(width, height)
             # Reverse since we are minimizing, but for contact point score bigger is better.
             score1 = -result[1]
-            score2 = result[2]
+            score2 = 0
         else:
             raise NotImplementedError('Unknown MaxRects Heuristic encountered')
 
-        if result[0].get_height() == 0:
+        if result[0] is None or result[0].get_height() == 0:
             score1 = sys.maxint
             score2 = sys.maxint
 
         return (result[0], score1, score2)
 
+    def _score_free_rect(self, rect, width, height):
+        # The (score1, score2) of placing a width x height texture at the top left of a free rectangle it fits
+        # in, lower is better.  These are the scores the find position loops compare.
+        if self.heuristic == FreeRectChoiceHeuristicEnum.RectBottomLeftRule:
+            return (rect.y1 + height, rect.x1)
+        elif self.heuristic == FreeRectChoiceHeuristicEnum.RectContactPointRule:
+            return (-self._contact_point_score_node(rect.x1, rect.y1, width, height), 0)
+
+        leftoverHoriz = rect.get_width() - width
+        leftoverVert = rect.get_height() - height
+        if self.heuristic == FreeRectChoiceHeuristicEnum.RectBestShortSideFit:
+            return (min(leftoverHoriz, leftoverVert), max(leftoverHoriz, leftoverVert))
+        elif self.heuristic == FreeRectChoiceHeuristicEnum.RectBestLongSideFit:
+            return (max(leftoverHoriz, leftoverVert), min(leftoverHoriz, leftoverVert))
+        elif self.heuristic == FreeRectChoiceHeuristicEnum.RectBestAreaFit:
+            return (rect.get_area() - width * height, min(leftoverHoriz, leftoverVert))
+        else:
+            raise NotImplementedError('Unknown MaxRects Heuristic encountered')
+
     def _place_rect(self, rect):
-        count = len(self.free_rect_list)
+        if self.free_rect_index is not None:
+            for free_rect in self.free_rect_index.get_overlapping(rect):
+                self._split_free_node(free_rect, rect)
+                self.free_rect_index.remove(free_rect)
+        else:
+            count = len(self.free_rect_list)
+            i = 0
+            while i < count:
+                if (self._split_free_node(self.free_rect_list[i], rect)):
+                    self.free_rect_list.pop(i)
+                    i -= 1
+                    count -= 1
+                i += 1
+
+        self._prune_free_list()
+        self.used_rect_list.append(rect)
+        self.used_edge_index.add(rect)
+
+    def _find_indexed_position(self, width, height, orders):
+        # Returns (node, score1, score2) for the best placement the free rect index finds walking orders,
+        # scored by _score_free_rect, or (None, sys.maxint, sys.maxint) if the texture fits nowhere.
+        best = self.free_rect_index.find_best(width, height, self.allow_rotations, orders, self._score_free_rect)
+        if best is None:
+            return (None, sys.maxint, sys.maxint)
+        (rect, flipped, (score1, score2)) = best
+        if flipped:
+            return (Rect.InitWithDim(rect.x1, rect.y1, height, width), score1, score2)
+        return (Rect.InitWithDim(rect.x1, rect.y1, width, height), score1, score2)
+
+    def _get_candidate_free_rects(self, width, height):
+        # Free rectangles to try a width x height texture in, in free list order.
+        if self.free_rect_index is not None:
+            return self.free_rect_index.get_fitting(width, height, self.allow_rotations)
+        return self.free_rect_list
+
+    def _insert_new_free_rect(self, new_rect):
+        # Keep the rectangles created by the current split free of containment between themselves.
         i = 0
-        while i < count:
-            if (self._split_free_node(self.free_rect_list[i], rect)):
-                self.free_rect_list.pop(i)
+        while i < len(self.new_free_rect_list):
+            if new_rect.contains(self.new_free_rect_list[i]) and not self.new_free_rect_list[i].contains(new_rect):
+                return
+            if self.new_free_rect_list[i].contains(new_rect):
+                self.new_free_rect_list.pop(i)
                 i -= 1
-                count -= 1
             i += 1
 
-        self._prune_free_list()
-        self.used_rect_list.append(rect)
+        self.new_free_rect_list.append(new_rect)
 
     def _prune_free_list(self):
-        # Go through each pair and remove any rectangle that is redundant.
-        i = 0
-        while i < len(self.free_rect_list):
-            j = i + 1
-            while j < len(self.free_rect_list):
-                if self.free_rect_list[i].contains(self.free_rect_list[j]):
-                    self.free_rect_list.pop(i)
-                    i -= 1
-                    break
-                if self.free_rect_list[j].contains(self.free_rect_list[i]):
-                    self.free_rect_list.pop(j)
-                    j -= 1
-                j += 1
-            i += 1
+        # Only the rectangles created by the latest split need testing, the old free rectangles are already
+        # pruned against each other.  An old rectangle can never be contained in a new one as the new ones
+        # are cut from an old rectangle, so the new ones only need testing for containment in the old ones.
+        if self.free_rect_index is not None:
+            for new_rect in self.new_free_rect_list:
+                if not self.free_rect_index.get_containing(new_rect):
+                    self.free_rect_index.add(new_rect)
+        else:
+            for new_rect in self.new_free_rect_list:
+                contained = False
+                for rect in self.free_rect_list:
+                    if new_rect.contains(rect):
+                        contained = True
+                        break
+                if not contained:
+                    self.free_rect_list.append(new_rect)
+
+        self.new_free_rect_list = []
 
     def _contact_point_score_node(self, x, y, width, height):
         score = 0
@@ -151,11 +247,7 @@ class TexturePackerMaxRects(TexturePacker):
         if y == 0 or y + height == self.bin_height:
             score += width
 
-        for rect in self.used_rect_list:
-            if (rect.x1 == x + width or rect.x2 == x):
-                score += common_interval_length(rect.y1, rect.y2, y, y + height)
-            if (rect.y1 == y + height or rect.y2 == y):
-                score += common_interval_length(rect.x1, rect.x2, x, x + width)
+        score += self.used_edge_index.get_contact_length(x, y, width, height)
 
         return score
 
@@ -168,36 +260,40 @@ class TexturePackerMaxRects(TexturePacker):
             # New node at the top side of the used node.
             if used_rect.y1 > free_rect.y1 and used_rect.y1 < free_rect.y2:
                 new_rect = Rect.InitWithDim(free_rect.x1, free_rect.y1, free_rect.get_width(), used_rect.y1 - free_rect.y1)
-                self.free_rect_list.append(new_rect)
+                self._insert_new_free_rect(new_rect)
 
             # New node at the bottom side of the used node.
             if used_rect.y2 < free_rect.y2:
                 new_rect = Rect.InitWithDim(free_rect.x1, used_rect.y2, free_rect.get_width(), free_rect.y2 - used_rect.y2)
-                self.free_rect_list.append(new_rect)
+                self._insert_new_free_rect(new_rect)
 
         if used_rect.y1 < free_rect.y2 and used_rect.y2 > free_rect.y1:
             # New node at the left side of the used node.
             if used_rect.x1 > free_rect.x1 and used_rect.x1 < free_rect.x2:
                 new_rect = Rect.InitWithDim(free_rect.x1, free_rect.y1, used_rect.x1 - free_rect.x1, free_rect.get_height())
-                self.free_rect_list.append(new_rect)
+                self._insert_new_free_rect(new_rect)
 
             # New node at the right side of the used node.
             if used_rect.x2 < free_rect.x2:
                 new_rect = Rect.InitWithDim(used_rect.x2, free_rect.y1, free_rect.x2 - used_rect.x2, free_rect.get_height())
-                self.free_rect_list.append(new_rect)
+                self._insert_new_free_rect(new_rect)
 
         return True
 
     def _find_position_for_new_node_bottom_left(self, width, height):
+        if self.free_rect_index is not None:
+            (bestRect, bestY, bestX) = self._find_indexed_position(width, height, ('top',))
+            return (bestRect, bestX, bestY)
+
         bestRect = None
         bestX = sys.maxint
         bestY = sys.maxint
 
-        for rect in self.free_rect_list:
+        for rect in self._get_candidate_free_rects(width, height):
             # Try to place the rectangle in upright (non-flipped) orientation.
             if rect.get_width() >= width and rect.get_height() >= height:
                 topSideY = rect.y1 + height
-                if topSideY < bestY and (topSideY == bestY and rect.x1 < bestX):
+                if topSideY < bestY or (topSideY == bestY and rect.x1 < bestX):
                     bestRect = Rect.InitWithDim(rect.x1, rect.y1, width, height)
                     bestY = topSideY
                     bestX = rect.x1
@@ -212,11 +308,14 @@ class TexturePackerMaxRects(TexturePacker):
         return (bestRect, bestX, bestY)
 
     def _find_position_for_new_node_best_short_side_fit(self, width, height):
+        if self.free_rect_index is not None:
+            return self._find_indexed_position(width, height, ('width', 'height'))
+
         bestNode = None
         bestShortSideFit = sys.maxint
         bestLongSideFit = sys.maxint
 
-        for rect in self.free_rect_list:
+        for rect in self._get_candidate_free_rects(width, height):
             # Try to place the rectangle in upright (non-flipped) orientation.
             if rect.get_width() >= width and rect.get_height() >= height:
                 leftoverHoriz = abs(rect.get_width() - width)
@@ -243,11 +342,15 @@ class TexturePackerMaxRects(TexturePacker):
         return (bestNode, bestShortSideFit, bestLongSideFit)
 
     def _find_position_for_new_node_best_long_side_fit(self, width, height):
+        if self.free_rect_index is not None:
+            (bestNode, bestLongSideFit, bestShortSideFit) = self._find_indexed_position(width, height, ('width',))
+            return (bestNode, bestShortSideFit, bestLongSideFit)
+
         bestNode = None
         bestLongSideFit = sys.maxint
         bestShortSideFit = sys.maxint
 
-        for rect in self.free_rect_list:
+        for rect in self._get_candidate_free_rects(width, height):
             # Try to place the rectangle in upright (non-flipped) orientation.
             if rect.get_width() >= width and rect.get_height() >= height:
                 leftoverHoriz = abs(rect.get_width() - width)
@@ -274,11 +377,14 @@ class TexturePackerMaxRects(TexturePacker):
         return (bestNode, bestShortSideFit, bestLongSideFit)
 
     def _find_position_for_new_node_best_area_fit(self, width, height):
+        if self.free_rect_index is not None:
+            return self._find_indexed_position(width, height, ('area',))
+
         bestNode = None
         bestAreaFit = sys.maxint
         bestShortSideFit = sys.maxint
 
-        for rect in self.free_rect_list:
+        for rect in self._get_candidate_free_rects(width, height):
             areaFit = rect.get_area() - (width * height)
 
             # Try to place the rectangle in upright (non-flipped) orientation.
@@ -307,8 +413,10 @@ class TexturePackerMaxRects(TexturePacker):
     def _find_position_for_new_node_contact_point(self, width, height):
         bestNode = None
         bestContactScore = -1
+        # Edges of used rects never overlap, so no position can touch more than the whole perimeter.
+        maxContactScore = 2 * (width + height)
 
-        for rect in self.free_rect_list:
+        for rect in self._get_candidate_free_rects(width, height):
             # Try to place the rectangle in upright (non-flipped) orientation.
             if (rect.get_width() >= width and rect.get_height() >= height):
                 score = self._contact_point_score_node(rect.x1, rect.y1, width, height)
@@ -322,4 +430,8 @@ class TexturePackerMaxRects(TexturePacker):
                     bestNode = Rect.InitWithDim(rect.x1, rect.y1, height, width)
                     bestContactScore = score
 
+            # Only a strictly better score replaces the best node, so nothing later can beat a full contact.
+            if bestContactScore == maxContactScore:
+                break
+
         return (bestNode, bestContactScore)
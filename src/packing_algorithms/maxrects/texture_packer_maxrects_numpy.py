@@ -0,0 +1,200 @@
+import sys
+
+import numpy
+
+from packing_algorithms.maxrects.texture_packer_maxrects import TexturePackerMaxRects
+from maths.rect import Rect
+
+NO_FIT = numpy.iinfo(numpy.int64).max
+
+
+class TexturePackerMaxRectsNumpy(TexturePackerMaxRects):
+    # Keeps the free rectangles in a contiguous (count, 4) array of x1, y1, x2, y2 and scores every
+    # free rectangle for a heuristic at once.  The free rectangles are kept in free list order and ties are
+    # broken on that order and then on orientation, upright first, which is the order the loops in
+    # TexturePackerMaxRects visit them in, so both backends place every texture identically.
+    free_rects = None
+    free_count = 0
+
+    def __init__(self, method, width=0, height=0, batch=False):
+        TexturePackerMaxRects.__init__(self, method, width, height, False, batch)
+        self.free_rect_list = []
+        self.free_rects = numpy.zeros((16, 4), numpy.int64)
+        self.free_count = 0
+        self._append_free_rects([Rect.InitWithDim(0, 0, self.bin_width, self.bin_height)])
+
+    def get_free_rects(self):
+        return [Rect(*[int(value) for value in row]) for row in self.free_rects[:self.free_count]]
+
+    def get_free_rect_count(self):
+        return self.free_count
+
+    def _append_free_rects(self, rects):
+        # Grow by doubling so appends stay amortised constant time.
+        if self.free_count + len(rects) > len(self.free_rects):
+            grown = numpy.zeros((max(2 * len(self.free_rects), self.free_count + len(rects)), 4), numpy.int64)
+            grown[:self.free_count] = self.free_rects[:self.free_count]
+            self.free_rects = grown
+        for rect in rects:
+            self.free_rects[self.free_count] = (rect.x1, rect.y1, rect.x2, rect.y2)
+            self.free_count += 1
+
+    def _place_rect(self, rect):
+        free = self.free_rects[:self.free_count]
+        overlapping = (rect.x1 < free[:, 2]) & (rect.x2 > free[:, 0]) & (rect.y1 < free[:, 3]) & (rect.y2 > free[:, 1])
+
+        for index in numpy.flatnonzero(overlapping):
+            self._split_free_node(Rect(*[int(value) for value in free[index]]), rect)
+
+        kept = free[~overlapping]
+        self.free_count = len(kept)
+        self.free_rects[:self.free_count] = kept
+
+        self._prune_free_list()
+        self.used_rect_list.append(rect)
+        self.used_edge_index.add(rect)
+
+    def _prune_free_list(self):
+        # The new rectangles only need testing for containment in the old ones, see TexturePackerMaxRects.
+        if not self.new_free_rect_list:
+            return
+
+        free = self.free_rects[:self.free_count]
+        new = numpy.array([(rect.x1, rect.y1, rect.x2, rect.y2) for rect in self.new_free_rect_list], numpy.int64)
+        contained = ((new[:, None, 0] >= free[None, :, 0]) & (new[:, None, 1] >= free[None, :, 1]) &
+                     (new[:, None, 2] <= free[None, :, 2]) & (new[:, None, 3] <= free[None, :, 3])).any(axis=1)
+
+        self._append_free_rects([rect for (rect, isContained) in zip(self.new_free_rect_list, contained) if not isContained])
+        self.new_free_rect_list = []
+
+    def _get_free_dimensions(self):
+        free = self.free_rects[:self.free_count]
+        return (free[:, 0], free[:, 1], free[:, 2] - free[:, 0], free[:, 3] - free[:, 1])
+
+    def _get_fits(self, freeWidth, freeHeight, width, height):
+        upright = (freeWidth >= width) & (freeHeight >= height)
+        if self.allow_rotations:
+            rotated = (freeWidth >= height) & (freeHeight >= width)
+        else:
+            rotated = numpy.zeros(len(freeWidth), bool)
+        return (upright, rotated)
+
+    def _select_best(self, upright, rotated, uprightScores, rotatedScores):
+        # Interleaves both orientations so that position 2 * index + flipped orders the candidates by free
+        # list index and then orientation, then picks the lowest (primary, secondary, position).
+        # Returns (index, flipped) or None if nothing fits.
+        count = len(upright)
+        if count == 0 or not (upright.any() or rotated.any()):
+            return None
+
+        primary = numpy.empty(2 * count, numpy.int64)
+        primary[0::2] = numpy.where(upright, uprightScores[0], NO_FIT)
+        primary[1::2] = numpy.where(rotated, rotatedScores[0], NO_FIT)
+        tied = numpy.flatnonzero(primary == primary.min())
+
+        if len(tied) > 1:
+            secondary = numpy.empty(2 * count, numpy.int64)
+            secondary[0::2] = uprightScores[1]
+            secondary[1::2] = rotatedScores[1]
+            tiedSecondary = secondary[tied]
+            tied = tied[tiedSecondary == tiedSecondary.min()]
+
+        return (int(tied[0]) / 2, tied[0] % 2 == 1)
+
+    def _get_node(self, best, width, height):
+        (index, flipped) = best
+        x = int(self.free_rects[index, 0])
+        y = int(self.free_rects[index, 1])
+        if flipped:
+            return Rect.InitWithDim(x, y, height, width)
+        return Rect.InitWithDim(x, y, width, height)
+
+    def _get_side_fits(self, freeWidth, freeHeight, width, height):
+        leftoverHoriz = numpy.abs(freeWidth - width)
+        leftoverVert = numpy.abs(freeHeight - height)
+        return (numpy.minimum(leftoverHoriz, leftoverVert), numpy.maximum(leftoverHoriz, leftoverVert))
+
+    def _find_position_for_new_node_bottom_left(self, width, height):
+        (freeX, freeY, freeWidth, freeHeight) = self._get_free_dimensions()
+        (upright, rotated) = self._get_fits(freeWidth, freeHeight, width, height)
+
+        best = self._select_best(upright, rotated, (freeY + height, freeX), (freeY + width, freeX))
+        if best is None:
+            return (None, sys.maxint, sys.maxint)
+
+        (index, flipped) = best
+        return (self._get_node(best, width, height), int(freeX[index]), int(freeY[index]) + (width if flipped else height))
+
+    def _find_position_for_new_node_best_short_side_fit(self, width, height):
+        (freeX, freeY, freeWidth, freeHeight) = self._get_free_dimensions()
+        (upright, rotated) = self._get_fits(freeWidth, freeHeight, width, height)
+
+        uprightScores = self._get_side_fits(freeWidth, freeHeight, width, height)
+        rotatedScores = self._get_side_fits(freeWidth, freeHeight, height, width)
+        best = self._select_best(upright, rotated, uprightScores, rotatedScores)
+        if best is None:
+            return (None, sys.maxint, sys.maxint)
+
+        scores = rotatedScores if best[1] else uprightScores
+        return (self._get_node(best, width, height), int(scores[0][best[0]]), int(scores[1][best[0]]))
+
+    def _find_position_for_new_node_best_long_side_fit(self, width, height):
+        (freeX, freeY, freeWidth, freeHeight) = self._get_free_dimensions()
+        (upright, rotated) = self._get_fits(freeWidth, freeHeight, width, height)
+
+        uprightScores = self._get_side_fits(freeWidth, freeHeight, width, height)
+        rotatedScores = self._get_side_fits(freeWidth, freeHeight, height, width)
+        best = self._select_best(upright, rotated, uprightScores[::-1], rotatedScores[::-1])
+        if best is None:
+            return (None, sys.maxint, sys.maxint)
+
+        scores = rotatedScores if best[1] else uprightScores
+        return (self._get_node(best, width, height), int(scores[0][best[0]]), int(scores[1][best[0]]))
+
+    def _find_position_for_new_node_best_area_fit(self, width, height):
+        (freeX, freeY, freeWidth, freeHeight) = self._get_free_dimensions()
+        (upright, rotated) = self._get_fits(freeWidth, freeHeight, width, height)
+
+        areaFit = freeWidth * freeHeight - width * height
+        uprightScores = (areaFit, self._get_side_fits(freeWidth, freeHeight, width, height)[0])
+        rotatedScores = (areaFit, self._get_side_fits(freeWidth, freeHeight, height, width)[0])
+        best = self._select_best(upright, rotated, uprightScores, rotatedScores)
+        if best is None:
+            return (None, sys.maxint, sys.maxint)
+
+        scores = rotatedScores if best[1] else uprightScores
+        return (self._get_node(best, width, height), int(scores[0][best[0]]), int(scores[1][best[0]]))
+
+    def _find_position_for_new_node_contact_point(self, width, height):
+        (freeX, freeY, freeWidth, freeHeight) = self._get_free_dimensions()
+        (upright, rotated) = self._get_fits(freeWidth, freeHeight, width, height)
+
+        # Bigger contact scores are better, negate them as the selection minimises.
+        zeros = numpy.zeros(len(freeX), numpy.int64)
+        uprightScores = (-self._get_contact_point_scores(freeX, freeY, width, height, upright), zeros)
+        rotatedScores = (-self._get_contact_point_scores(freeX, freeY, height, width, rotated), zeros)
+        best = self._select_best(upright, rotated, uprightScores, rotatedScores)
+        if best is None:
+            return (None, -1)
+
+        scores = rotatedScores if best[1] else uprightScores
+        return (self._get_node(best, width, height), -int(scores[0][best[0]]))
+
+    def _get_contact_point_scores(self, freeX, freeY, width, height, fits):
+        # _contact_point_score_node for every fitting free rectangle, the border terms vectorised.
+        scores = numpy.zeros(len(freeX), numpy.int64)
+        indices = numpy.flatnonzero(fits)
+        if len(indices) == 0:
+            return scores
+
+        x = freeX[indices]
+        y = freeY[indices]
+        score = numpy.where((x == 0) | (x + width == self.bin_width), height, 0)
+        score += numpy.where((y == 0) | (y + height == self.bin_height), width, 0)
+
+        # Each candidate only looks up the used rectangle edges on its own four sides.
+        get_contact_length = self.used_edge_index.get_contact_length
+        score += [get_contact_length(candidateX, candidateY, width, height) for (candidateX, candidateY) in zip(x.tolist(), y.tolist())]
+
+        scores[indices] = score
+        return scores
@@ -0,0 +1,44 @@
+import sys
+import bisect
+
+
+class UsedEdgeIndex:
+    # Indexes the edges of the used rectangles by coordinate for the contact point heuristic.
+    # Vertical edges are keyed by x and hold sorted (y1, y2) intervals, horizontal edges are keyed by y and
+    # hold sorted (x1, x2) intervals.  Left and right (top and bottom) edges are kept apart since a used rect
+    # only touches a candidate when its left edge lies on the candidate's right side and so on.
+    left_edges = None
+    right_edges = None
+    top_edges = None
+    bottom_edges = None
+
+    def __init__(self):
+        self.left_edges = {}
+        self.right_edges = {}
+        self.top_edges = {}
+        self.bottom_edges = {}
+
+    def add(self, rect):
+        bisect.insort(self.left_edges.setdefault(rect.x1, []), (rect.y1, rect.y2))
+        bisect.insort(self.right_edges.setdefault(rect.x2, []), (rect.y1, rect.y2))
+        bisect.insort(self.top_edges.setdefault(rect.y1, []), (rect.x1, rect.x2))
+        bisect.insort(self.bottom_edges.setdefault(rect.y2, []), (rect.x1, rect.x2))
+
+    def get_contact_length(self, x, y, width, height):
+        # The total length of used rectangle edges lying on the sides of a width x height rect at x, y.
+        length = self._get_edge_length(self.left_edges.get(x + width), y, y + height)
+        length += self._get_edge_length(self.right_edges.get(x), y, y + height)
+        length += self._get_edge_length(self.top_edges.get(y + height), x, x + width)
+        length += self._get_edge_length(self.bottom_edges.get(y), x, x + width)
+        return length
+
+    def _get_edge_length(self, intervals, start, end):
+        # Matches common_interval_length, which only counts intervals starting inside [start, end], so a
+        # bisect on the interval starts finds every edge that contributes.
+        if not intervals:
+            return 0
+
+        length = 0
+        for i in range(bisect.bisect_left(intervals, (start,)), bisect.bisect_right(intervals, (end, sys.maxint))):
+            length += min(intervals[i][1], end) - intervals[i][0]
+        return length
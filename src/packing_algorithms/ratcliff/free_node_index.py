@@ -0,0 +1,105 @@
+import bisect
+
+
+class FreeNodeIndex:
+    # Indexes the Ratcliff free nodes for the two searches the packer makes.
+    #   - By width and by (width, height), for the first node a texture shares two edges with.
+    #   - Sorted by (y, x) in buckets keyed by the bit length of the shorter and longer side, for the
+    #     lowest then leftmost node a texture fits in.  Buckets too small for the texture are skipped whole.
+    # Nodes are numbered as they are added and keep their number when they are resized, which is the
+    # position they would hold in the packer's free list, so ties still go to the earliest node.
+    nodes = None
+    by_width = None
+    by_size = None
+    size_buckets = None
+    next_id = 0
+
+    def __init__(self):
+        self.nodes = {}
+        self.by_width = {}
+        self.by_size = {}
+        self.size_buckets = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        node_id = self.next_id
+        self.next_id += 1
+        self._insert(node_id, node)
+        return node_id
+
+    def remove(self, node_id):
+        node = self.nodes.pop(node_id)
+        self._discard(self.by_width, node.width, node_id)
+        self._discard(self.by_size, (node.width, node.height), node_id)
+        bucket = self._get_bucket(node.width, node.height)
+        positions = self.size_buckets[bucket]
+        del positions[bisect.bisect_left(positions, (node.y, node.x, node_id))]
+        if not positions:
+            del self.size_buckets[bucket]
+
+    def update(self, node_id, x, y, width, height):
+        # Resizes a node in place.  Nodes with no area left can never be used again and are dropped.
+        node = self.nodes[node_id]
+        self.remove(node_id)
+        node.x = x
+        node.y = y
+        node.width = width
+        node.height = height
+        if width > 0 and height > 0:
+            self._insert(node_id, node)
+
+    def get_node(self, node_id):
+        return self.nodes[node_id]
+
+    def get_nodes(self):
+        return [self.nodes[node_id] for node_id in sorted(self.nodes.keys())]
+
+    def find_best_fit(self, width, height):
+        # Returns (node_id, edgeCount) for the node TexturePackerRatcliff places a width x height texture in,
+        # or (None, 0) if it fits nowhere.  The first node it fits sharing two edges wins, otherwise the
+        # lowest then leftmost node it fits in.
+        matches = set(self.by_width.get(width, ()))
+        matches.update(self.by_size.get((height, width), ()))
+        for node_id in sorted(matches):
+            (fits, edgeCount) = self.nodes[node_id].does_rect_fit(width, height)
+            if fits and edgeCount == 2:
+                return (node_id, edgeCount)
+
+        # A texture fits a node, either way round, when neither its shorter nor its longer side is longer.
+        shortSide = min(width, height)
+        longSide = max(width, height)
+        (minShortBucket, minLongBucket) = self._get_bucket(width, height)
+        best = None
+        for (bucket, positions) in self.size_buckets.items():
+            if bucket[0] < minShortBucket or bucket[1] < minLongBucket:
+                continue
+            for position in positions:
+                if best is not None and position >= best:
+                    break
+                if position[3] >= shortSide and position[4] >= longSide:
+                    best = position
+                    break
+
+        if best is None:
+            return (None, 0)
+        return (best[2], self.nodes[best[2]].does_rect_fit(width, height)[1])
+
+    def _insert(self, node_id, node):
+        self.nodes[node_id] = node
+        self.by_width.setdefault(node.width, set()).add(node_id)
+        self.by_size.setdefault((node.width, node.height), set()).add(node_id)
+        # Positions carry the node's shorter and longer side for the fit test.
+        position = (node.y, node.x, node_id, min(node.width, node.height), max(node.width, node.height))
+        bisect.insort(self.size_buckets.setdefault(self._get_bucket(node.width, node.height), []), position)
+
+    def _discard(self, buckets, key, node_id):
+        ids = buckets[key]
+        ids.discard(node_id)
+        if not ids:
+            del buckets[key]
+
+    def _get_bucket(self, width, height):
+        return (max(min(width, height), 1).bit_length(), max(width, height, 1).bit_length())
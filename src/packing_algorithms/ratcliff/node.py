@@ -1,4 +1,4 @@
-from math.rect import Rect
+from maths.rect import Rect
 
 
 class Node:
@@ -43,33 +43,29 @@ class Node:
         return Rect(self.x, self.y, self.x + self.width, self.y + self.height)
 
     def validate(self, node):
-        r1 = self.get_rect()
-        r2 = node.get_rect()
-        return (r1 != r2)
+        # Free nodes never overlap, returns False if this one does overlap node.
+        return (self.x >= node.x + node.width or node.x >= self.x + self.width or
+                self.y >= node.y + node.height or node.y >= self.y + self.height)
 
     def merge(self, node):
+        # Absorbs node if the two share a whole edge, returns True if they were merged.
         ret = False
-        r1 = self.get_rect()
-        r2 = node.get_rect()
 
-        r1.x2 += 1
-        r1.y2 += 1
-        r2.x2 += 1
-        r2.y2 += 1
-
-        if (r1.x1 == r2.x1 and r1.x2 == r2.x2 and r1.y1 == r2.y2):
-            self.y = node.y
-            self.height += node.get_rect().height
-            ret = True
-        elif (r1.x1 == r2.x1 and r1.x2 == r2.x2 and r1.y2 == r2.y1):
-            self.height += node.get_rect().height
-            ret = True
-        elif (r1.y1 == r2.y1 and r1.y2 == r2.y1 and r1.x1 == r2.x2):
-            self.x = node.x
-            self.width += node.get_rect().width
-            ret = True
-        elif (r1.y1 == r2.y1 and r1.y2 == r2.y1 and r1.x2 == r2.x1):
-            self.width += node.get_rect().width
-            ret = True
+        if (self.x == node.x and self.width == node.width):
+            if (node.y + node.height == self.y):
+                self.y = node.y
+                self.height += node.height
+                ret = True
+            elif (self.y + self.height == node.y):
+                self.height += node.height
+                ret = True
+        elif (self.y == node.y and self.height == node.height):
+            if (node.x + node.width == self.x):
+                self.x = node.x
+                self.width += node.width
+                ret = True
+            elif (self.x + self.width == node.x):
+                self.width += node.width
+                ret = True
 
         return ret
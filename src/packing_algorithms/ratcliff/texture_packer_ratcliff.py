@@ -5,20 +5,26 @@
 #
 
 from packing_algorithms.ratcliff.node import Node
-from math.math import next_power_of_two
+from packing_algorithms.ratcliff.free_node_index import FreeNodeIndex
+from maths.math import next_power_of_two
 from packing_algorithms.texture_packer import TexturePacker
+from packing_algorithms.texture_packer import PackerError
+from util.trace import trace_span
 
 
 class TexturePackerRatcliff(TexturePacker):
-    freeArr = None
+    free_node_index = None
     longestEdge = 0
     totalArea = 0
+    validate_nodes = False
 
-    def __init__(self):
+    def __init__(self, validate=False):
         TexturePacker.__init__(self)
-        self.freeArr = []
+        self.free_node_index = FreeNodeIndex()
         self.longestEdge = 0
         self.totalArea = 0
+        # Checking the free nodes after every placement is quadratic, it is only meant for debugging.
+        self.validate_nodes = validate
 
     def add_texture(self, width, height, name=""):
         TexturePacker.add_texture(self, width, height, name)
@@ -27,25 +33,38 @@ class TexturePackerRatcliff(TexturePacker):
         self.totalArea += width * height
 
     def add_node(self, x, y, width, height):
-        self.freeArr.append(Node(x, y, width, height))
+        if width > 0 and height > 0:
+            self.free_node_index.add(Node(x, y, width, height))
+
+    def get_free_nodes(self):
+        return self.free_node_index.get_nodes()
+
+    def get_free_rect_count(self):
+        return len(self.free_node_index)
 
     def merge_nodes(self):
-        for f in self.freeArr:
-            fIdx = 0
-            for s in self.freeArr:
-                if (f != s):
-                    if (f.merge(s)):
-                        self.freeArr[fIdx] = f
-                        return True
-            fIdx += 1
+        # Coalesces free nodes sharing a whole edge in one sweep down the columns and one along the rows.
+        # Returns the number of nodes merged away.
+        merged = 0
+        for sort_key in (lambda node: (node.x, node.width, node.y), lambda node: (node.y, node.height, node.x)):
+            nodes = []
+            for node in sorted(self.free_node_index.get_nodes(), key=sort_key):
+                if nodes and nodes[-1].merge(node):
+                    merged += 1
+                else:
+                    nodes.append(node)
 
-        return False
+            self.free_node_index = FreeNodeIndex()
+            for node in nodes:
+                self.free_node_index.add(node)
+        return merged
 
     def validate(self):
-        for f in self.freeArr:
-            for c in self.freeArr:
-                if (f != c):
-                    f.validate(c)
+        nodes = self.free_node_index.get_nodes()
+        for i in range(len(nodes)):
+            for j in range(i + 1, len(nodes)):
+                if not nodes[i].validate(nodes[j]):
+                    raise PackerError('Free nodes overlap at %d,%d and %d,%d' % (nodes[i].x, nodes[i].y, nodes[j].x, nodes[j].y))
 
     def pack_textures(self, forcePowerOfTwo, onePixelBorder):
         # 0 = width
@@ -54,12 +73,9 @@ class TexturePackerRatcliff(TexturePacker):
         returnList = []
 
         if (onePixelBorder):
-            i = 0
             for t in self.texArr:
                 t.width += 2
                 t.height += 2
-                self.texArr[i] = t
-                i += 1
             self.longestEdge += 2
 
         if (forcePowerOfTwo):
@@ -69,154 +85,25 @@ class TexturePackerRatcliff(TexturePacker):
         count = self.totalArea / (self.longestEdge * self.longestEdge)
         height = (count + 2) * self.longestEdge
 
-        self.add_node(0, 0, width, height)
-
-        # We must place_texture each texture
-        loopI = 0
-        while (loopI < self.get_texture_count()):
-            index = 0
-            longestEdge = 0
-            mostArea = 0
-
-            # We first search for the texture with the longest edge, placing it first.
-            # And the most area...
-            j = 0
-            for texture in self.texArr:
-                #print "Checking texture ", tmpTex.GetName()
-                if (not texture.placed):
-                    if (texture.longestEdge > longestEdge):
-                        mostArea = texture.area
-                        longestEdge = texture.longestEdge
-                        index = j
-                    elif (texture.longestEdge == longestEdge):
-                        if (texture.area > mostArea):
-                            mostArea = texture.area
-                            index = j
-                j += 1
-
-            # For the texture with the longest edge we place_texture it according to this criteria.
-            #   (1) If it is a perfect match, we always accept it as it causes the least amount of fragmentation.
-            #   (2) A match of one edge with the minimum area left over after the split.
-            #   (3) No edges match, so look for the node which leaves the least amount of area left over after the split.
-            tex = self.texArr[index]
-            #print "Going to try and place_texture ", tex.GetName()
-
-            leastY = 0x7FFFFFFF
-            leastX = 0x7FFFFFFF
-
-            nodeIndex = 0
-            idx = 0
-            previousBestFitNodeIdx = 0
-            bestFitNode = Node(0, 0, 0, 0)
-            previousNodeIdx = 0
-            edgeCount = 0
-
-            # Walk the singly linked list of free nodes
-            # see if it will fit into any currently free space
-            for currNode in self.freeArr:
-                resultdoes_rect_fitArr = currNode.does_rect_fit(tex.get_rect().get_width(), tex.get_rect().get_height())
-                ec = resultdoes_rect_fitArr[1]
-
-                # see if the texture will fit into this slot, and if so how many edges does it share.
-                if (resultdoes_rect_fitArr[0] is True):
-                    if (ec == 2):
-                        previousBestFitNodeIdx = previousNodeIdx
-                        bestFitNode = currNode
-                        nodeIndex = idx
-                        edgeCount = ec
-                        break
-
-                    if (currNode.y < leastY):
-                        leastY = currNode.y
-                        leastX = currNode.x
-                        previousBestFitNodeIdx = previousNodeIdx
-                        bestFitNode = currNode
-                        nodeIndex = idx
-                        edgeCount = ec
-                    elif (currNode.y == leastY and currNode.x < leastX):
-                        leastX = currNode.x
-                        previousBestFitNodeIdx = previousNodeIdx
-                        bestFitNode = currNode
-                        nodeIndex = idx
-                        edgeCount = ec
-
-                previousNodeIdx = idx
-                idx += 1
-
-            # we should always find a fit location!
-            if(bestFitNode.x == 0 and bestFitNode.y == 0 and bestFitNode.get_rect().get_width() == 0 and bestFitNode.get_rect().get_height() == 0):
-                print "TexturePacker::pack_textures() BestFit node not found!!"
-                exit(1)
-
-            self.validate()
-
-            if (edgeCount == 0):
-                if (tex.longestEdge <= bestFitNode.get_rect().get_width()):
-                    if (tex.height > tex.width):
-                        tex.flip_dimensions()
-                        tex.flipped = True
-
-                    tex.place_texture(bestFitNode.x, bestFitNode.y, tex.flipped)
-
-                    self.add_node(bestFitNode.x, bestFitNode.y + tex.height, bestFitNode.get_rect().get_width(), bestFitNode.get_rect().get_height() - tex.height)
-
-                    bestFitNode.x += tex.width
-                    bestFitNode.width -= tex.width
-                    bestFitNode.height = tex.height
-                    self.validate()
-                else:
-                    if (tex.longestEdge <= bestFitNode.height):
-                        print("TexturePacker::PackTexture() ERROR - Current textures longest edge is less than the BestFitNodes Height!!!")
-                        exit(1)
-
-                    if (tex.height < tex.width):
-                        tex.flip_dimensions()
-                        tex.flipped = True
-
-                    tex.place_texture(bestFitNode.x, bestFitNode.y, tex.flipped)
-                    self.add_node(bestFitNode.x, bestFitNode.y + tex.height, bestFitNode.get_rect().width, bestFitNode.get_rect().height - tex.height)
-                    bestFitNode.x += tex.width
-                    bestFitNode.width -= tex.width
-                    bestFitNode.height = tex.height
-                    self.validate()
-            elif(edgeCount == 1):
-                if (tex.width == bestFitNode.get_rect().get_width()):
-                    tex.place_texture(bestFitNode.x, bestFitNode.y, False)
-                    bestFitNode.y += tex.height
-                    bestFitNode.height -= tex.height
-                    self.validate()
-                elif (tex.height == bestFitNode.get_rect().get_height()):
-                    tex.place_texture(bestFitNode.x, bestFitNode.y, False)
-                    bestFitNode.x += tex.width
-                    bestFitNode.width -= tex.width
-                    self.validate()
-                elif (tex.width == bestFitNode.get_rect().get_height()):
-                    tex.place_texture(bestFitNode.x, bestFitNode.y, True)
-                    bestFitNode.x += tex.height
-                    bestFitNode.width -= tex.height
-                    self.validate()
-                elif (tex.height == bestFitNode.get_rect().get_width()):
-                    tex.place_texture(bestFitNode.x, bestFitNode.y, True)
-                    bestFitNode.y += tex.width
-                    bestFitNode.height -= tex.width
-                    self.validate()
-            elif(edgeCount == 2):
-                flipped = tex.width != bestFitNode.get_rect().get_width() or tex.height != bestFitNode.get_rect().get_height()
-                tex.place_texture(bestFitNode.x, bestFitNode.y, flipped)
-                if (previousBestFitNodeIdx >= 0):
-                    previousBestFitNodeIdx = index
-                self.validate()
-
-            # Save latest version of texture and Node back into lists since python is pass by value
-            self.freeArr[nodeIndex] = bestFitNode
-            self.texArr[index] = tex
+        # Place the textures with the longest edge first, and then the most area.  The sort is stable so
+        # ties keep the order the textures were added in.
+        textures = sorted(self.texArr, key=lambda texture: (texture.longestEdge, texture.area), reverse=True)
+
+        # The strip is not always tall enough for the borders and the space lost to splits, so double it
+        # until everything fits.  Stacking every texture on its own row always fits.
+        maxHeight = sum([max(texture.width, texture.height) for texture in textures])
+        while True:
+            try:
+                with trace_span('ratcliff strip', 'pack', width=width, height=height):
+                    self._place_textures(textures, width, height)
+                break
+            except PackerError:
+                if height >= maxHeight:
+                    raise
+                height = min(2 * height, maxHeight)
+
+        self.merge_nodes()
 
-            loopI += 1
-
-        while (self.merge_nodes()):
-            print "Merging nodes"
-
-        index = 0
         height = 0
         for t in self.texArr:
             if (onePixelBorder):
@@ -224,7 +111,6 @@ class TexturePackerRatcliff(TexturePacker):
                 t.height -= 2
                 t.x += 1
                 t.y += 1
-                self.texArr[index] = t
 
             y = 0
             if (t.flipped):
@@ -235,8 +121,6 @@ class TexturePackerRatcliff(TexturePacker):
             if (y > height):
                 height = y
 
-            index += 1
-
         if (forcePowerOfTwo):
             height = next_power_of_two(height)
 
@@ -244,3 +128,65 @@ class TexturePackerRatcliff(TexturePacker):
         returnList.append(height)
         returnList.append((width * height) - self.totalArea)
         return (returnList)
+
+    def _place_textures(self, textures, width, height):
+        self.free_node_index = FreeNodeIndex()
+        self.add_node(0, 0, width, height)
+
+        for tex in textures:
+            self._place_texture(tex)
+            if (self.validate_nodes):
+                self.validate()
+
+    def _place_texture(self, tex):
+        # For the texture we place it according to this criteria.
+        #   (1) If it is a perfect match, we always accept it as it causes the least amount of fragmentation.
+        #   (2) A match of one edge with the minimum area left over after the split.
+        #   (3) No edges match, so look for the node which leaves the least amount of area left over after the split.
+        # Textures keep their own dimensions when flipped, the flag says they are turned in the atlas.
+        (nodeId, edgeCount) = self.free_node_index.find_best_fit(tex.width, tex.height)
+        if nodeId is None:
+            raise PackerError('Failed to fit in %s' % (tex.name))
+
+        node = self.free_node_index.get_node(nodeId)
+
+        if (edgeCount == 2):
+            flipped = tex.width != node.width or tex.height != node.height
+            tex.place_texture(node.x, node.y, flipped)
+            self.free_node_index.remove(nodeId)
+            return
+
+        if (edgeCount == 1):
+            if (tex.width == node.width and tex.height <= node.height):
+                tex.place_texture(node.x, node.y, False)
+                self.free_node_index.update(nodeId, node.x, node.y + tex.height, node.width, node.height - tex.height)
+                return
+            elif (tex.height == node.height and tex.width <= node.width):
+                tex.place_texture(node.x, node.y, False)
+                self.free_node_index.update(nodeId, node.x + tex.width, node.y, node.width - tex.width, node.height)
+                return
+            elif (tex.width == node.height and tex.height <= node.width):
+                tex.place_texture(node.x, node.y, True)
+                self.free_node_index.update(nodeId, node.x + tex.height, node.y, node.width - tex.height, node.height)
+                return
+            elif (tex.height == node.width and tex.width <= node.height):
+                tex.place_texture(node.x, node.y, True)
+                self.free_node_index.update(nodeId, node.x, node.y + tex.width, node.width, node.height - tex.width)
+                return
+            # The shared edge only lines up in the orientation that does not fit, split it like no edges match.
+
+        # Lay the texture along its longest edge if the node is wide enough, otherwise stand it up.
+        longestEdge = max(tex.width, tex.height)
+        if (longestEdge <= node.width):
+            flipped = tex.height > tex.width
+        else:
+            if (longestEdge > node.height):
+                raise PackerError('Longest edge of %s does not fit the best fit node' % (tex.name))
+            flipped = tex.height < tex.width
+
+        placedWidth = tex.height if flipped else tex.width
+        placedHeight = tex.width if flipped else tex.height
+        tex.place_texture(node.x, node.y, flipped)
+
+        self.add_node(node.x, node.y + placedHeight, node.width, node.height - placedHeight)
+        self.free_node_index.update(nodeId, node.x + placedWidth, node.y, node.width - placedWidth, placedHeight)
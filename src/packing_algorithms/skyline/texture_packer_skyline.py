@@ -0,0 +1,211 @@
+import sys
+
+from packing_algorithms.texture_packer import TexturePacker
+from packing_algorithms.texture_packer import PackerError
+from maths.rect import Rect
+from packing_algorithms.skyline.waste_map import WasteMap
+
+
+class SkylineHeuristicEnum:
+    (LevelBottomLeft, LevelMinWasteFit) = range(0, 2)
+
+
+class SkylineNode:
+    x = 0
+    y = 0
+    width = 0
+
+    def __init__(self, x, y, width):
+        self.x = x
+        self.y = y
+        self.width = width
+
+
+class TexturePackerSkyline(TexturePacker):
+    # Keeps the top edge of the packed textures as a list of horizontal segments (the skyline) and sits
+    # each texture on it, so placing a texture only looks at the skyline and never at the free space.
+    # Python implementation of SkylineBinPack from https://github.com/juj/RectangleBinPack.
+    sky_line = None
+    used_rect_list = None
+    waste_map = None
+    bin_width = 0
+    bin_height = 0
+    used_surface_area = 0
+    heuristic = SkylineHeuristicEnum.LevelBottomLeft
+
+    def __init__(self, method, width=0, height=0, use_waste_map=False):
+        TexturePacker.__init__(self)
+        self.sky_line = [SkylineNode(0, 0, width)]
+        self.used_rect_list = []
+        self.bin_width = width
+        self.bin_height = height
+        self.used_surface_area = 0
+        self.heuristic = method
+
+        # The gaps below the skyline are lost for good unless the waste map keeps track of them.
+        if use_waste_map:
+            self.waste_map = WasteMap(self.bin_width, self.bin_height)
+
+    def get_occupancy(self):
+        return float(self.used_surface_area) / (self.bin_width * self.bin_height)
+
+    def add_texture(self, width, height, name):
+        TexturePacker.add_texture(self, width, height, name)
+
+        if self.waste_map is not None:
+            node = self.waste_map.insert(width, height, self.allow_rotations)
+            if node is not None:
+                self._add_used_rect(node)
+                return node
+
+        if self.heuristic == SkylineHeuristicEnum.LevelBottomLeft:
+            result = self._find_position_for_new_node_bottom_left(width, height)
+        elif self.heuristic == SkylineHeuristicEnum.LevelMinWasteFit:
+            result = self._find_position_for_new_node_min_waste(width, height)
+        else:
+            raise NotImplementedError('Unknown Skyline Heuristic encountered')
+
+        (node, index) = result
+        if node is None:
+            raise PackerError('Failed to fit in %s' % (name))
+
+        self._add_skyline_level(index, node)
+        self._add_used_rect(node)
+        return node
+
+    def pack_textures(self, powerOfTwo, oneBorderPixel):
+        i = 0
+
+        for rect in self.used_rect_list:
+            tex = self.texArr[i]
+            flipped = tex.width != rect.get_width() or tex.height != rect.get_height()
+            tex.place_texture(rect.x1, rect.y1, flipped)
+            i += 1
+
+        return (self.bin_width, self.bin_height, 0)
+
+    def _add_used_rect(self, rect):
+        self.used_rect_list.append(rect)
+        self.used_surface_area += rect.get_area()
+
+    def _get_fit(self, index, width, height, maxHeight, maxWastedArea):
+        # Returns (y, wastedArea) for a width x height texture resting on the skyline with its left edge on
+        # node index, wastedArea being the area left under it.  Returns None if it sticks out of the bin,
+        # its top ends above maxHeight or it wastes more than maxWastedArea.  Both only grow as the texture
+        # is walked across the skyline, so a position that cannot win is dropped as soon as that shows.
+        sky_line = self.sky_line
+        rectRight = sky_line[index].x + width
+        if rectRight > self.bin_width or height > maxHeight:
+            return None
+
+        y = 0
+        coveredWidth = 0
+        coveredArea = 0
+        while coveredWidth < width:
+            node = sky_line[index]
+            if node.y > y:
+                y = node.y
+                if y + height > maxHeight:
+                    return None
+            nodeWidth = min(rectRight, node.x + node.width) - node.x
+            coveredWidth += nodeWidth
+            coveredArea += nodeWidth * node.y
+            if y * coveredWidth - coveredArea > maxWastedArea:
+                return None
+            index += 1
+
+        return (y, y * width - coveredArea)
+
+    def _find_position_for_new_node_bottom_left(self, width, height):
+        bestNode = None
+        bestIndex = -1
+        bestHeight = self.bin_height
+        bestWidth = sys.maxint
+
+        orientations = [(width, height)]
+        if self.allow_rotations:
+            orientations.append((height, width))
+
+        for i in range(len(self.sky_line)):
+            node = self.sky_line[i]
+            for (rectWidth, rectHeight) in orientations:
+                # The texture rests at least at the node's own height.
+                if node.y + rectHeight > bestHeight or (node.y + rectHeight == bestHeight and node.width >= bestWidth):
+                    continue
+                fit = self._get_fit(i, rectWidth, rectHeight, bestHeight, sys.maxint)
+                if fit is not None:
+                    y = fit[0]
+                    if y + rectHeight < bestHeight or (y + rectHeight == bestHeight and node.width < bestWidth):
+                        bestNode = Rect.InitWithDim(node.x, y, rectWidth, rectHeight)
+                        bestIndex = i
+                        bestHeight = y + rectHeight
+                        bestWidth = node.width
+
+        return (bestNode, bestIndex)
+
+    def _find_position_for_new_node_min_waste(self, width, height):
+        bestNode = None
+        bestIndex = -1
+        bestHeight = sys.maxint
+        bestWastedArea = sys.maxint
+
+        orientations = [(width, height)]
+        if self.allow_rotations:
+            orientations.append((height, width))
+
+        for i in range(len(self.sky_line)):
+            node = self.sky_line[i]
+            for (rectWidth, rectHeight) in orientations:
+                fit = self._get_fit(i, rectWidth, rectHeight, self.bin_height, bestWastedArea)
+                if fit is not None:
+                    (y, wastedArea) = fit
+                    if wastedArea < bestWastedArea or (wastedArea == bestWastedArea and y + rectHeight < bestHeight):
+                        bestNode = Rect.InitWithDim(node.x, y, rectWidth, rectHeight)
+                        bestIndex = i
+                        bestHeight = y + rectHeight
+                        bestWastedArea = wastedArea
+
+        return (bestNode, bestIndex)
+
+    def _add_waste_map_area(self, index, rect):
+        # Hands the gaps between rect and the skyline segments it covers over to the waste map.
+        while index < len(self.sky_line) and self.sky_line[index].x < rect.x2:
+            node = self.sky_line[index]
+            if node.x + node.width <= rect.x1:
+                break
+            leftSide = node.x
+            rightSide = min(rect.x2, leftSide + node.width)
+            self.waste_map.add_gap(leftSide, node.y, rightSide - leftSide, rect.y1 - node.y)
+            index += 1
+
+    def _add_skyline_level(self, index, rect):
+        if self.waste_map is not None:
+            self._add_waste_map_area(index, rect)
+
+        self.sky_line.insert(index, SkylineNode(rect.x1, rect.y2, rect.get_width()))
+
+        # Cut the segments the new level now covers back to its right edge.
+        i = index + 1
+        while i < len(self.sky_line):
+            previous = self.sky_line[i - 1]
+            node = self.sky_line[i]
+            if node.x >= previous.x + previous.width:
+                break
+
+            shrink = previous.x + previous.width - node.x
+            node.x += shrink
+            node.width -= shrink
+            if node.width > 0:
+                break
+            del self.sky_line[i]
+
+        self._merge_skylines()
+
+    def _merge_skylines(self):
+        i = 0
+        while i < len(self.sky_line) - 1:
+            if self.sky_line[i].y == self.sky_line[i + 1].y:
+                self.sky_line[i].width += self.sky_line[i + 1].width
+                del self.sky_line[i + 1]
+            else:
+                i += 1
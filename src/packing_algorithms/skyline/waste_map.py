@@ -0,0 +1,52 @@
+from maths.rect import Rect
+from packing_algorithms.maxrects.free_rect_index import FreeRectIndex
+
+
+def _score_short_side_fit(rect, width, height):
+    return (min(rect.get_width() - width, rect.get_height() - height),)
+
+
+class WasteMap:
+    # The gaps the skyline leaves below itself when a texture is placed over a lower neighbour.
+    # Textures are fitted into the gaps best short side first and the space left over is split
+    # guillotine style along the axis that leaves the biggest rectangle (RectangleBinPack's wasteMap).
+    free_rect_index = None
+
+    def __init__(self, bin_width, bin_height):
+        self.free_rect_index = FreeRectIndex(bin_width, bin_height)
+
+    def __len__(self):
+        return len(self.free_rect_index)
+
+    def add_gap(self, x, y, width, height):
+        if width > 0 and height > 0:
+            self.free_rect_index.add(Rect.InitWithDim(x, y, width, height))
+
+    def insert(self, width, height, allow_rotations):
+        # Returns the rect the texture was placed at, or None if no gap holds it.
+        best = self.free_rect_index.find_best(width, height, allow_rotations, ('width', 'height'), _score_short_side_fit)
+        if best is None:
+            return None
+
+        (bestRect, flipped, score) = best
+        if flipped:
+            bestNode = Rect.InitWithDim(bestRect.x1, bestRect.y1, height, width)
+        else:
+            bestNode = Rect.InitWithDim(bestRect.x1, bestRect.y1, width, height)
+        self.free_rect_index.remove(bestRect)
+        self._split_free_rect(bestRect, bestNode)
+        return bestNode
+
+    def _split_free_rect(self, free_rect, placed_rect):
+        leftoverWidth = free_rect.get_width() - placed_rect.get_width()
+        leftoverHeight = free_rect.get_height() - placed_rect.get_height()
+
+        # Give the full width to the bottom piece if that makes the bigger of the two leftovers.
+        splitHorizontal = placed_rect.get_width() * leftoverHeight <= leftoverWidth * placed_rect.get_height()
+
+        if splitHorizontal:
+            self.add_gap(free_rect.x1, placed_rect.y2, free_rect.get_width(), leftoverHeight)
+            self.add_gap(placed_rect.x2, free_rect.y1, leftoverWidth, placed_rect.get_height())
+        else:
+            self.add_gap(free_rect.x1, placed_rect.y2, placed_rect.get_width(), leftoverHeight)
+            self.add_gap(placed_rect.x2, free_rect.y1, leftoverWidth, free_rect.get_height())
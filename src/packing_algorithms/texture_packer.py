@@ -15,6 +15,24 @@ class TexturePacker:
     def add_texture(self, width, height, name):
         self.texArr.append(Texture(width, height, name))
 
+    def add_textures(self, geometry):
+        # geometry is a list of (name, width, height) tuples, added in order.
+        for (name, width, height) in geometry:
+            self.add_texture(width, height, name)
+
+    def fill_textures(self, geometry):
+        # Adds every texture that still fits, in order, and returns the geometry of the ones that did not.
+        # Packers that place textures as they are added raise PackerError before placing anything, so the
+        # texture that failed only has to be taken back off the list.
+        overflow = []
+        for (name, width, height) in geometry:
+            try:
+                self.add_texture(width, height, name)
+            except PackerError:
+                self.texArr.pop()
+                overflow.append((name, width, height))
+        return overflow
+
     def get_texture(self, name):
         tex = None
         for t in self.texArr:
@@ -28,5 +46,9 @@ class TexturePacker:
     def get_texture_count(self):
         return len(self.texArr)
 
+    def get_free_rect_count(self):
+        # The size of the free list of packers that keep one, None for the others.
+        return None
+
     def pack_textures(self, powerOfTwo, oneBorderPixel):
         raise NotImplementedError('pack_textures() has not been implemented')
@@ -0,0 +1,135 @@
+import os.path
+import hashlib
+
+import simplejson
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = '.manifest.json'
+
+# Command line options that do not change the generated atlases.
+NON_BUILD_OPTIONS = ('verbose', 'res_path', 'jobs', 'incremental', 'maxrects_spatial_index', 'maxrects_backend', 'max_open_files',
+                     'pixel_cache', 'pixel_cache_size', 'max_decoded_images', 'max_atlas_images',
+                     'scan_threads', 'composite_threads', 'encode_threads', 'png_threads',
+                     'trace')
+
+
+def get_manifest_path(atlas_path):
+    return os.path.join(atlas_path, MANIFEST_FILENAME)
+
+
+def load_manifest(atlas_path):
+    # A missing, unreadable or out of date manifest just means everything gets rebuilt.
+    try:
+        manifest_file = open(get_manifest_path(atlas_path), 'r')
+        try:
+            manifest = simplejson.load(manifest_file)
+        finally:
+            manifest_file.close()
+    except (IOError, ValueError):
+        return {}
+
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('atlases', {})
+
+
+def save_manifest(atlas_path, atlases):
+    manifest_file = open(get_manifest_path(atlas_path), 'w')
+    try:
+        simplejson.dump({'version': MANIFEST_VERSION, 'atlases': atlases}, manifest_file, indent=4, sort_keys=True)
+    finally:
+        manifest_file.close()
+
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    hashed_file = open(path, 'rb')
+    try:
+        chunk = hashed_file.read(1 << 16)
+        while chunk:
+            sha1.update(chunk)
+            chunk = hashed_file.read(1 << 16)
+    finally:
+        hashed_file.close()
+    return sha1.hexdigest()
+
+
+def get_build_options(args):
+    options = {}
+    for key in args:
+        if key not in NON_BUILD_OPTIONS:
+            options[key] = args[key]
+    return options
+
+
+def scan_inputs(dir_path, previous_inputs=None):
+    # Files whose size and mtime match the previous build keep their old hash instead of being read again.
+    if previous_inputs is None:
+        previous_inputs = {}
+
+    inputs = {}
+    for name in os.listdir(dir_path):
+        file_path = os.path.join(dir_path, name)
+        if name.startswith(".") or os.path.isdir(file_path):
+            continue
+
+        stat = os.stat(file_path)
+        previous = previous_inputs.get(name)
+        if previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+            sha1 = previous['sha1']
+        else:
+            sha1 = hash_file(file_path)
+        inputs[name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1}
+
+    return inputs
+
+
+def hash_outputs(output_paths):
+    outputs = {}
+    for path in output_paths:
+        outputs[os.path.basename(path)] = hash_file(path)
+    return outputs
+
+
+def create_entry(options, inputs, output_paths):
+    return {'options': options, 'inputs': inputs, 'outputs': hash_outputs(output_paths)}
+
+
+def _same_inputs(one, two):
+    if sorted(one.keys()) != sorted(two.keys()):
+        return False
+    for name in one:
+        if one[name]['size'] != two[name]['size'] or one[name]['sha1'] != two[name]['sha1']:
+            return False
+    return True
+
+
+def is_up_to_date(entry, options, inputs, atlas_path):
+    if entry is None or entry.get('options') != options:
+        return False
+    if not _same_inputs(entry.get('inputs', {}), inputs):
+        return False
+
+    # Outputs that were deleted or edited by hand are regenerated.
+    for (name, sha1) in entry.get('outputs', {}).items():
+        path = os.path.join(atlas_path, name)
+        if not os.path.isfile(path) or hash_file(path) != sha1:
+            return False
+
+    return True
+
+
+def remove_stale_outputs(atlas_path, old_atlases, new_atlases):
+    current = set()
+    for entry in new_atlases.values():
+        current.update(entry['outputs'].keys())
+
+    removed = []
+    for entry in old_atlases.values():
+        for name in entry.get('outputs', {}):
+            path = os.path.join(atlas_path, name)
+            if name not in current and os.path.isfile(path):
+                os.remove(path)
+                removed.append(name)
+
+    return removed
@@ -0,0 +1,80 @@
+import Queue
+import threading
+import traceback
+
+# Put on a queue once per thread reading it after the last item.
+_END_OF_ITEMS = object()
+
+
+class PipelineStage:
+    # A step of a pipeline, run on threads of its own.  func(item) returns or yields the items handed on to the
+    # next stage, so a stage can drop an item or split it in several.  At most queue_size items wait for the
+    # stage, a full queue blocks the stage before it, which keeps fast stages from running far ahead.
+    name = None
+    func = None
+    threads = 1
+    queue_size = 1
+
+    def __init__(self, name, func, threads=1, queue_size=1):
+        self.name = name
+        self.func = func
+        self.threads = max(1, threads)
+        self.queue_size = max(1, queue_size)
+
+
+def _run_stage(stage, in_queue, out_queue, next_threads, running, failures):
+    while True:
+        item = in_queue.get()
+        if item is _END_OF_ITEMS:
+            break
+
+        try:
+            for result in stage.func(item):
+                out_queue.put(result)
+                result = None
+        except Exception:
+            failures.append((stage.name, item, traceback.format_exc()))
+
+        # Items can hold a lot of memory, nothing of this one is kept while waiting for the next.
+        item = None
+
+    # The last thread of the stage to finish tells the next stage there is nothing more to come.
+    running['lock'].acquire()
+    try:
+        running['threads'] -= 1
+        last = running['threads'] == 0
+    finally:
+        running['lock'].release()
+    if last:
+        for i in range(next_threads):
+            out_queue.put(_END_OF_ITEMS)
+
+
+def run_pipeline(items, stages):
+    # Runs every item through the stages in order, the stages working on different items at the same time.
+    # Returns (results, failures), results being what the last stage returned in the order it finished and
+    # failures a (stage name, item, traceback) for every item a stage raised on, which goes no further.
+    queues = [Queue.Queue(stage.queue_size) for stage in stages] + [Queue.Queue()]
+    failures = []
+
+    for (index, stage) in enumerate(stages):
+        next_threads = stages[index + 1].threads if index + 1 < len(stages) else 1
+        running = {'lock': threading.Lock(), 'threads': stage.threads}
+        for i in range(stage.threads):
+            thread = threading.Thread(target=_run_stage, name='%s-%d' % (stage.name, i), args=(stage, queues[index], queues[index + 1], next_threads, running, failures))
+            thread.daemon = True
+            thread.start()
+
+    for item in items:
+        queues[0].put(item)
+    for i in range(stages[0].threads):
+        queues[0].put(_END_OF_ITEMS)
+
+    results = []
+    while True:
+        result = queues[-1].get()
+        if result is _END_OF_ITEMS:
+            break
+        results.append(result)
+
+    return (results, failures)
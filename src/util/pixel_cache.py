@@ -0,0 +1,127 @@
+import os
+import mmap
+import struct
+import hashlib
+import threading
+
+from PIL import Image
+
+from util.manifest import hash_file
+
+PIXEL_CACHE_VERSION = 1
+ENTRY_EXT = '.rgba'
+
+# Each entry is the raw RGBA pixels followed by this trailer, so the pixels start at the beginning of the file
+# and can be mapped straight into an image.  The trim values are -1 for an image that was not trimmed.
+TRAILER_MAGIC = 'PXC1'
+TRAILER_FORMAT = '<4sIIIiiii'
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+
+
+class PixelCache:
+    # Decoded images kept on disk between builds, keyed by the contents of the image file and the decoding
+    # options.  Entries are read back memory mapped, so a hit neither decodes nor copies the pixels, and the
+    # least recently used entries are evicted once the cache grows past max_size bytes.
+    cache_path = None
+    max_size = 0
+    file_hashes = None
+
+    def __init__(self, cache_path, max_size):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.file_hashes = {}
+
+    def _get_file_hash(self, file_path):
+        # Files are only hashed once per size and mtime, a build looks most of them up more than once.
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_size, stat.st_mtime)
+        sha1 = self.file_hashes.get(key)
+        if sha1 is None:
+            sha1 = hash_file(file_path)
+            self.file_hashes[key] = sha1
+        return sha1
+
+    def _get_entry_path(self, file_path, trim):
+        key = hashlib.sha1('%s:%d:%d' % (self._get_file_hash(file_path), PIXEL_CACHE_VERSION, trim)).hexdigest()
+        return os.path.join(self.cache_path, key[:2], key + ENTRY_EXT)
+
+    def load(self, file_path, trim=False):
+        # Returns (img, imgTrim) for a read only RGBA image mapped from the cache, or None if it is not cached.
+        entry_path = self._get_entry_path(file_path, trim)
+        try:
+            entry_file = open(entry_path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            entry_map = mmap.mmap(entry_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return None
+        finally:
+            entry_file.close()
+
+        trailer = struct.unpack(TRAILER_FORMAT, entry_map[-TRAILER_SIZE:]) if len(entry_map) >= TRAILER_SIZE else None
+        if trailer is None or trailer[0] != TRAILER_MAGIC or trailer[1] != PIXEL_CACHE_VERSION or len(entry_map) != trailer[2] * trailer[3] * 4 + TRAILER_SIZE:
+            entry_map.close()
+            return None
+        (magic, version, width, height, offsetX, offsetY, originalWidth, originalHeight) = trailer
+
+        # The modification time orders the entries for eviction.
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+
+        img = Image.frombuffer('RGBA', (width, height), entry_map, 'raw', 'RGBA', 0, 1)
+        imgTrim = None
+        if offsetX >= 0:
+            imgTrim = (offsetX, offsetY, originalWidth, originalHeight)
+        return (img, imgTrim)
+
+    def store(self, file_path, trim, img, imgTrim):
+        # Entries are written under a temporary name and renamed into place, so other processes and threads
+        # never map a partly written one.  The cache is only there to save time, failing to write is ignored.
+        entry_path = self._get_entry_path(file_path, trim)
+        temp_path = '%s.%d.%d.tmp' % (entry_path, os.getpid(), threading.current_thread().ident)
+        if imgTrim is None:
+            imgTrim = (-1, -1, -1, -1)
+
+        try:
+            if not os.path.isdir(os.path.dirname(entry_path)):
+                try:
+                    os.makedirs(os.path.dirname(entry_path))
+                except OSError:
+                    # Made by another process in the meantime.
+                    pass
+
+            entry_file = open(temp_path, 'wb')
+            try:
+                entry_file.write(img.convert('RGBA').tobytes() if img.mode != 'RGBA' else img.tobytes())
+                entry_file.write(struct.pack(TRAILER_FORMAT, TRAILER_MAGIC, PIXEL_CACHE_VERSION, img.size[0], img.size[1], *imgTrim))
+            finally:
+                entry_file.close()
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def evict(self):
+        # Removes the least recently used entries until the cache fits in max_size, returns how many went.
+        entries = []
+        totalSize = 0
+        for (dir_path, dir_names, file_names) in os.walk(self.cache_path):
+            for name in file_names:
+                if name.endswith(ENTRY_EXT):
+                    path = os.path.join(dir_path, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    totalSize += stat.st_size
+
+        removed = 0
+        for (mtime, size, path) in sorted(entries):
+            if totalSize <= self.max_size:
+                break
+            os.remove(path)
+            totalSize -= size
+            removed += 1
+        return removed
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import resource
+import threading
+
+import simplejson
+
+# The tracer of the running build, None when it is not being traced.
+_tracer = None
+
+
+def get_memory_usage():
+    # Returns (rss, peak rss) of this process in MB.  The current size is only known where /proc is.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts the peak in KB, OS X in bytes.
+    peak = peak / 1024.0 if sys.platform != 'darwin' else peak / 1048576.0
+    rss = None
+    try:
+        statm = open('/proc/self/statm')
+        try:
+            rss = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+        finally:
+            statm.close()
+    except (IOError, OSError, ValueError):
+        pass
+    return (rss, peak)
+
+
+class _NoSpan:
+    # Stands in for a span when the build is not traced.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        return False
+
+    def set_arg(self, key, value):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    # A timed part of the build, recorded when it ends.  Spans started inside another span on the same thread
+    # take the atlas it is for, so the packing attempts and the like add up per atlas.
+    tracer = None
+    name = None
+    category = None
+    args = None
+    start = 0
+    start_rss = None
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def set_arg(self, key, value):
+        self.args[key] = value
+
+    def __enter__(self):
+        stack = self.tracer.get_span_stack()
+        if stack and 'atlas' not in self.args and 'atlas' in stack[-1].args:
+            self.args['atlas'] = stack[-1].args['atlas']
+        stack.append(self)
+        self.start_rss = get_memory_usage()[0]
+        self.start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        end = time.time()
+        self.tracer.get_span_stack().pop()
+        if excType is not None:
+            self.args['failed'] = excType.__name__
+        self.tracer.end_span(self, end)
+        return False
+
+
+class Tracer:
+    # Records the spans of a build as Chrome trace events (chrome://tracing or https://ui.perfetto.dev), each
+    # with the memory use of its process when it ended.  Pool worker processes have a copy of the tracer, the
+    # events they record are handed back with take_worker_events and merged in with add_events.
+    start_time = 0
+    pid = 0
+    events = None
+    thread_names = None
+    lock = None
+    local = None
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_span_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _get_timestamp(self, seconds):
+        # Trace event times are in microseconds.
+        return int((seconds - self.start_time) * 1000000)
+
+    def span(self, name, category, args):
+        return Span(self, name, category, args)
+
+    def end_span(self, span, end):
+        (rss, peak) = get_memory_usage()
+        args = dict(span.args)
+        args['peak_rss_mb'] = round(peak, 1)
+        if rss is not None:
+            args['rss_mb'] = round(rss, 1)
+            if span.start_rss is not None:
+                args['rss_delta_mb'] = round(rss - span.start_rss, 1)
+
+        thread = threading.current_thread()
+        pid = os.getpid()
+        event = {'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': thread.ident,
+                 'ts': self._get_timestamp(span.start), 'dur': self._get_timestamp(end) - self._get_timestamp(span.start), 'args': args}
+        memory = {'name': 'memory', 'ph': 'C', 'pid': pid, 'tid': thread.ident, 'ts': self._get_timestamp(end),
+                  'args': {'rss_mb': args.get('rss_mb', 0), 'peak_rss_mb': args['peak_rss_mb']}}
+
+        self.lock.acquire()
+        try:
+            self.events.append(event)
+            self.events.append(memory)
+            self.thread_names[(pid, thread.ident)] = thread.name if pid == self.pid else 'pack worker %d' % pid
+        finally:
+            self.lock.release()
+
+    def take_worker_events(self):
+        # In a pool worker, returns and forgets the events it recorded since the last call.  In the process
+        # that started the trace the events are already where they belong and nothing is returned.
+        pid = os.getpid()
+        if pid == self.pid:
+            return None
+        self.lock.acquire()
+        try:
+            events = [event for event in self.events if event['pid'] == pid]
+            names = dict([(key, name) for (key, name) in self.thread_names.items() if key[0] == pid])
+            self.events = []
+            self.thread_names = {}
+        finally:
+            self.lock.release()
+        return (events, names)
+
+    def add_events(self, worker_events):
+        if not worker_events:
+            return
+        (events, names) = worker_events
+        self.lock.acquire()
+        try:
+            self.events.extend(events)
+            self.thread_names.update(names)
+        finally:
+            self.lock.release()
+
+    def save(self, filename):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                    for ((pid, tid), name) in self.thread_names.items()]
+        trace_file = open(filename, 'w')
+        try:
+            for chunk in simplejson.JSONEncoder().iterencode({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}):
+                trace_file.write(chunk)
+        finally:
+            trace_file.close()
+
+    def print_summary(self, stream=None):
+        # Prints the time and memory of each stage, then the time each atlas spent in each stage, the slowest
+        # atlas first, with how many bins its packing tried and the sizes of the ones that fitted.
+        if stream is None:
+            stream = sys.stderr
+        spans = [event for event in self.events if event['ph'] == 'X']
+
+        stages = {}
+        for event in spans:
+            stage = stages.setdefault(event['name'], [0, 0, 0, 0.0])
+            stage[0] += 1
+            stage[1] += event['dur']
+            stage[2] = max(stage[2], event['dur'])
+            stage[3] = max(stage[3], event['args']['peak_rss_mb'])
+
+        stream.write('%-16s %8s %10s %10s %10s %12s\n' % ('stage', 'count', 'total s', 'mean ms', 'max ms', 'peak rss MB'))
+        for (name, (count, total, longest, peak)) in sorted(stages.items(), key=lambda stage: -stage[1][1]):
+            stream.write('%-16s %8d %10.2f %10.1f %10.1f %12.1f\n' % (name, count, total / 1e6, total / 1e3 / count, longest / 1e3, peak))
+
+        columns = ('scan', 'pack', 'data', 'composite', 'encode')
+        atlases = {}
+        for event in spans:
+            atlas = event['args'].get('atlas')
+            if atlas is None:
+                continue
+            entry = atlases.setdefault(atlas, {'attempts': 0, 'fitted': []})
+            if event['name'] in columns:
+                entry[event['name']] = entry.get(event['name'], 0) + event['dur']
+            elif event['name'] == 'pack attempt':
+                entry['attempts'] += 1
+                if 'fitted' in event['args']:
+                    entry['fitted'].append(event['args']['fitted'])
+        if not atlases:
+            return
+
+        stream.write('\n%-24s' % 'atlas' + ''.join(['%12s' % ('%s s' % column) for column in columns]) + '%12s %9s  %s\n' % ('total s', 'attempts', 'bins fitted'))
+        totals = [(sum([entry.get(column, 0) for column in columns]), atlas) for (atlas, entry) in atlases.items()]
+        for (total, atlas) in sorted(totals, reverse=True):
+            entry = atlases[atlas]
+            stream.write('%-24s' % atlas + ''.join(['%12.2f' % (entry.get(column, 0) / 1e6) for column in columns]) +
+                         '%12.2f %9d  %s\n' % (total / 1e6, entry['attempts'], ' '.join(entry['fitted'])))
+
+
+def start_trace():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def trace_span(name, category, **args):
+    # Times the with block as a span of the trace, args are shown with it.  Does nothing when not tracing.
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, category, args)
@@ -1,23 +1,44 @@
 import os.path
 import shutil
 
+from data_parsers.bin_parser import BinParser
 from data_parsers.json_parser import JsonParser
 from data_parsers.xml_parser import XmlParser
 from data_parsers.parser import ParserError
+from image_writers.image_writer import ImageWriterError
+from image_writers.png_writer import PngWriter
+from image_writers.tga_writer import TgaWriter
 from packing_algorithms.ratcliff.texture_packer_ratcliff import TexturePackerRatcliff
 from packing_algorithms.maxrects.texture_packer_maxrects import TexturePackerMaxRects
 from packing_algorithms.maxrects.texture_packer_maxrects import FreeRectChoiceHeuristicEnum
+from packing_algorithms.skyline.texture_packer_skyline import TexturePackerSkyline
+from packing_algorithms.skyline.texture_packer_skyline import SkylineHeuristicEnum
+from packing_algorithms.guillotine.texture_packer_guillotine import TexturePackerGuillotine
+from packing_algorithms.guillotine.texture_packer_guillotine import GuillotineChoiceHeuristicEnum
+from packing_algorithms.guillotine.texture_packer_guillotine import GuillotineSplitHeuristicEnum
 
 
-def get_parser(parser_type):
+def get_parser(parser_type, compact=False):
     if parser_type == 'xml':
-        return XmlParser()
+        return XmlParser(compact)
     elif parser_type == 'json':
-        return JsonParser()
+        return JsonParser(compact)
+    elif parser_type == 'bin':
+        return BinParser(compact)
     else:
         raise ParserError('Unknown parser_type encountered %s' % parser_type)
 
 
+def get_image_writer(file_type, filename, width, height, color_mode, compress_level=6, filter_type='up', pool=None):
+    # compress_level, filter_type and pool only apply to png, pool being a thread pool to compress on.
+    if file_type == 'png':
+        return PngWriter(filename, width, height, color_mode, compress_level, filter_type, pool)
+    elif file_type == 'tga':
+        return TgaWriter(filename, width, height, color_mode)
+    else:
+        raise ImageWriterError('Unknown file_type encountered %s' % file_type)
+
+
 def get_maxrects_heuristic(heuristic):
     if heuristic == 'shortside':
         return FreeRectChoiceHeuristicEnum.RectBestShortSideFit
@@ -33,11 +54,55 @@ def get_maxrects_heuristic(heuristic):
         raise NotImplementedError('Unknown heuristic enum encountered')
 
 
-def get_packer(algorithm_type, size=0, heuristic=""):
+def get_skyline_heuristic(heuristic):
+    if heuristic == 'bottomleft':
+        return SkylineHeuristicEnum.LevelBottomLeft
+    elif heuristic == 'minwaste':
+        return SkylineHeuristicEnum.LevelMinWasteFit
+    else:
+        raise NotImplementedError('Unknown heuristic enum encountered')
+
+
+def get_guillotine_heuristic(heuristic):
+    if heuristic == 'area':
+        return GuillotineChoiceHeuristicEnum.RectBestAreaFit
+    elif heuristic == 'shortside':
+        return GuillotineChoiceHeuristicEnum.RectBestShortSideFit
+    elif heuristic == 'longside':
+        return GuillotineChoiceHeuristicEnum.RectBestLongSideFit
+    else:
+        raise NotImplementedError('Unknown heuristic enum encountered')
+
+
+def get_guillotine_split_heuristic(heuristic):
+    if heuristic == 'shorterleftover':
+        return GuillotineSplitHeuristicEnum.SplitShorterLeftoverAxis
+    elif heuristic == 'longerleftover':
+        return GuillotineSplitHeuristicEnum.SplitLongerLeftoverAxis
+    elif heuristic == 'minarea':
+        return GuillotineSplitHeuristicEnum.SplitMinimizeArea
+    elif heuristic == 'maxarea':
+        return GuillotineSplitHeuristicEnum.SplitMaximizeArea
+    else:
+        raise NotImplementedError('Unknown heuristic enum encountered')
+
+
+def get_packer(algorithm_type, size=0, heuristic="", use_index=False, backend='python', batch=False, waste_map=False, split_heuristic='shorterleftover', merge=False, height=0):
+    # The bin is size x size unless a height is given.
+    width = int(size)
+    height = int(height) if height else width
     if algorithm_type == 'ratcliff':
         return TexturePackerRatcliff()
+    elif algorithm_type == 'maxrects' and backend == 'numpy':
+        # NumPy is optional, only import it when the backend is asked for.
+        from packing_algorithms.maxrects.texture_packer_maxrects_numpy import TexturePackerMaxRectsNumpy
+        return TexturePackerMaxRectsNumpy(get_maxrects_heuristic(heuristic), width, height, batch)
     elif algorithm_type == 'maxrects':
-        return TexturePackerMaxRects(get_maxrects_heuristic(heuristic), int(size), int(size))
+        return TexturePackerMaxRects(get_maxrects_heuristic(heuristic), width, height, use_index, batch)
+    elif algorithm_type == 'skyline':
+        return TexturePackerSkyline(get_skyline_heuristic(heuristic), width, height, waste_map)
+    elif algorithm_type == 'guillotine':
+        return TexturePackerGuillotine(get_guillotine_heuristic(heuristic), get_guillotine_split_heuristic(split_heuristic), width, height, merge)
     else:
         raise NotImplementedError('%s is unknown or not implemented yet.' % (algorithm_type))
 
@@ -56,3 +121,8 @@ def clear_atlas_dir(directory):
     if(os.path.isdir(directory)):
         shutil.rmtree(directory)
     os.mkdir(directory)
+
+
+def create_atlas_dir(directory):
+    if not os.path.isdir(directory):
+        os.mkdir(directory)